@@ -12,34 +12,63 @@ import getopt
 import os
 import logging
 import shutil
+import tempfile
+import copy
+import json
+import random
+import hashlib
+import numbers
+import functools
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import ig_tools_init
-import drawing_utils
 import files_utils
-
-def CheckBinaries(log):
+import stage_cache
+import process_utils
+import repertoire_utils
+import compression_utils
+import stream_utils
+import batch_utils
+import germline_cache
+import read_index
+import ground_truth_db
+import progress_utils
+import resource_estimator
+
+class IgSimulatorError(Exception):
+    # stages raise it instead of exiting, so that simulations can be run from other Python code;
+    # main() reports the message as ERROR and exits with code 1
+    pass
+
+class OptionsError(IgSimulatorError):
+    # incorrect options, main() also prints usage
+    pass
+
+class ToolFailedError(IgSimulatorError):
+    def __init__(self, tool_name):
+        IgSimulatorError.__init__(self, "Script " + tool_name + " finished abnormally")
+        self.tool_name = tool_name
+
+def CheckBinaries():
     if not os.path.exists(ig_tools_init.PathToBins.paired_read_merger_tool):
-        log.info("ERROR: Paired Read Merger tool was not found")
-        sys.exit(1)
+        raise IgSimulatorError("Paired Read Merger tool was not found")
 
     if not os.path.exists(ig_tools_init.PathToBins.simulate_repertoire_tool):
-        log.info("ERROR: Repertoire Simulator tool was not found")
-        sys.exit(1)
+        raise IgSimulatorError("Repertoire Simulator tool was not found")
 
     if not os.path.exists(ig_tools_init.PathToBins.create_ideal_repertoire_tool):
-        log.info("ERROR: Ideal Repertoire Constructor tool was not found")
-        sys.exit(1)
+        raise IgSimulatorError("Ideal Repertoire Constructor tool was not found")
 
     if not os.path.exists(ig_tools_init.PathToBins.art_illumina):
-        log.info("ERROR: ART Illumina read simulator was not found")
-        sys.exit(1)
+        raise IgSimulatorError("ART Illumina read simulator was not found")
 
     if not os.path.exists(ig_tools_init.PathToBins.art_454):
-        log.info("ERROR: ART 454 read simulator was not found")
-        sys.exit(1)
+        raise IgSimulatorError("ART 454 read simulator was not found")
 
 class BaseOptions:
-    long_options = "test skip-drawing".split()
+    long_options = "test skip-drawing threads= resume compact-repertoire compress= seed= stream keep-reads manifest= batch-memory= germline-cache= skip-germline-cache skip-ground-truth-db skip-read-index progress-interval= progress-textfile= estimate calibration= scratch-dir= retention=".split()
     short_options = "o:"
 
 class RepertoireSimulatorOptions:
@@ -62,18 +91,27 @@ class Options:
     dgenes_path = ""
     jgenes_path = ""
     database_type = "imgt"
+    # directory of compiled germline databases, "" disables them
+    germline_cache_dir = germline_cache.DefaultCacheDir()
+    germline_cache = ""
 
     repertoire_fasta = ""
+    compact_repertoire = False
 
     base_multiplicities = ""
     base_sequences = ""
+    mutated_sequences = ""
     mutated_multiplicities = ""
     shm_positions = ""
+    shm_numbers = ""
+    cdr_positions = ""
 
     technology = 'illumina'
     left_reads = ""
     right_reads = ""
 
+    num_threads = multiprocessing.cpu_count()
+
     min_overlap = 60
     max_mismatch = 0.1
     sim_mode = False
@@ -81,10 +119,89 @@ class Options:
     merged_reads = ""
     ideal_repertoire_fa = ""
     ideal_repertoire_rcm = ""   
+    # index of merged reads and clusters, "" if it was not built
+    read_index = ""
+    # SQLite database joining repertoire, SHMs, reads and clusters, "" if it was not built
+    ground_truth_db = ""
+    build_ground_truth_db = True
+    build_read_index = True
+
+    max_vdj_index_size = 20000000
+    external_sort_run_size = 1000000
+    # max number of repertoire copies expanded for one ART run in compact mode
+    art_batch_size = 100000
     
     draw_hist = True
 
+    stream_reads = False
+    keep_reads = False
+    stream_chunks_per_thread = 4
+
+    # seed of all random generators, -1 - not specified
+    seed = -1
+    # with seed, repertoire is split into this number of ART shards for any number of threads,
+    # so that reads do not depend on --threads
+    num_seeded_read_shards = 16
+
+    # compression of FASTA/FASTQ artifacts: "", "gzip" or "zstd"
+    compression = ""
+
+    # directory for intermediate files (simulated paired reads, ART alignments and chunks, named pipes), "" - output directory
+    scratch_dir = ""
+    # which files are kept, see retention_policies
+    retention = "keep-all"
+
+    resume = False
+    stage_cache = None
+
+    # batch mode: JSON manifest of simulations, memory budget of the batch in MB (0 - available memory)
+    # and expected peak memory of a simulation if it is not specified in the manifest
+    manifest = ""
+    batch_memory_mb = 0
+    batch_job_memory_mb = 1024
+
+    # --estimate prints predicted resources of stages instead of running them,
+    # the model is calibrated by benchmark results (src/benchmark/run_benchmark.py) from calibration file or directory
+    estimate = False
+    calibration = os.path.join(ig_tools_init.home_directory, "data/resource_calibration")
+
+    # progress of running stages is logged every progress_interval seconds (0 - never) and written to
+    # Prometheus textfile (default: ig_simulator.prom in output directory)
+    progress_interval = 30
+    progress_textfile = ""
+
     log = ""
+    run_metrics = None
+    progress = None
+    # stages running concurrently with the rest of the pipeline
+    background_stages = None
+
+    def __init__(self, **params):
+        # options of Python API, e.g. Options(output_dir = "out", num_bases = 10, num_mutated = 50, repertoire_size = 100),
+        # are checked against names and types of the defaults above
+        for name in params:
+            if name.startswith("_") or not hasattr(Options, name):
+                raise OptionsError("Unknown option " + name)
+            if not OptionValueMatches(getattr(Options, name), params[name]):
+                raise OptionsError("Option " + name + " should be of type " + type(getattr(Options, name)).__name__)
+            setattr(self, name, params[name])
+
+# keep-all: all files are kept
+# keep-none-intermediate: simulated paired reads are removed as soon as they are merged, ART alignments are not written
+# keep-main: in addition, files of the repertoire simulator are removed at the end of the pipeline,
+#            only main output files (see PrintMainOutputFiles) are kept
+retention_policies = ["keep-all", "keep-none-intermediate", "keep-main"]
+
+def OptionValueMatches(default, value):
+    if default is None:
+        return True
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, int):
+        return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+    if isinstance(default, float):
+        return isinstance(value, numbers.Real) and not isinstance(value, bool)
+    return isinstance(value, (str, type(u"")))
 
 def PrintOptions(options, log):
     log.info("\nInput parameters:")
@@ -96,7 +213,11 @@ def PrintOptions(options, log):
     log.info("Min allowed overlap size:\t\t\t" + str(options.min_overlap))
     log.info("Max allowed mismatch rate:\t\t\t" + str(options.max_mismatch))
     log.info("Simulated technology:\t\t\t\t" + str(options.technology))
+    log.info("Number of threads:\t\t\t\t" + str(options.num_threads))
+    log.info("Compact final repertoire:\t\t\t" + str(options.compact_repertoire))
+    log.info("Compression of artifacts:\t\t\t" + (options.compression if options.compression != "" else "none"))
     log.info("Database type:\t\t\t\t\t" + str(options.database_type))
+    log.info("Seed:\t\t\t\t\t\t" + (str(options.seed) if options.seed != -1 else "not specified"))
 
 def usage(log):
     log.info("./ig_repertoire_simulator.py [options] --chain-type TYPE --num-bases N1 --num-mutated N2 --repertoire-size N3 -o <output-dir>")
@@ -118,16 +239,112 @@ def usage(log):
     log.info("  --db-type\t\timgt or reg\t\t\ttype of database: imgt (headers are consistent with http://www.imgt.org/IMGTindex/Fasta.html) or reg (regular, applied for all other cases) [default: imgt]")
 
     #log.info("  --tech\t\t<illumina/454>\t\t\tNGS technology for read simulation")
-    #log.info("  --min-overlap\t\t<int>\t\t\t\tminimal allowed size of overlap in paired reads merging [default: '60']")
-    #log.info("  --max-mismatch\t<float>\t\t\t\tmaximal allowed mismatch of overlap in paired reads merging [default: '0.1']")
+    log.info("  --min-overlap\t\t<int>\t\t\t\tminimal allowed size of overlap in paired reads merging [default: '60']")
+    log.info("  --max-mismatch\t<float>\t\t\t\tmaximal allowed mismatch of overlap in paired reads merging [default: '0.1']")
+    log.info("  --threads\t\t<int>\t\t\t\tnumber of threads for read simulation [default: number of CPUs]")
+    log.info("  --compact-repertoire\t\t\t\t\twrites every sequence of the final repertoire once with its multiplicity;")
+    log.info("  \t\t\t\t\t\t\tcopies are expanded only for read simulation")
+    log.info("  --seed\t\t<int>\t\t\t\tseed of repertoire and read simulation, results do not depend on --threads if it is specified")
+    log.info("  --compress\t\tgzip or zstd\t\t\tcompresses FASTA/FASTQ files, RCM and ALN files of the pipeline [default: no compression]")
+    log.info("  --stream\t\t\t\t\t\truns read simulation, paired reads merging and ideal repertoire construction")
+    log.info("  \t\t\t\t\t\t\tconcurrently, reads are passed between them through named pipes")
+    log.info("  --keep-reads\t\t\t\t\t\tstores simulated and merged reads in --stream mode")
+    log.info("  --manifest\t\t<filename>\t\t\truns simulations described in JSON manifest concurrently, -o is directory of the batch;")
+    log.info("  \t\t\t\t\t\t\t--threads and --batch-memory limit threads and memory used by all simulations together")
+    log.info("  --batch-memory\t<int>\t\t\t\tmemory budget of the batch in MB [default: available memory]")
+    log.info("  --germline-cache\t<dirname>\t\t\tdirectory of indexed germline databases compiled from V/D/J FASTA files")
+    log.info("  \t\t\t\t\t\t\t[default: $XDG_CACHE_HOME/ig_simulator/germline_cache or ~/.cache/ig_simulator/germline_cache]")
+    log.info("  --skip-germline-cache\t\t\t\t\tpasses FASTA files of germline genes to the simulator as is")
+    log.info("  --skip-ground-truth-db\t\t\t\t\tdoes not build SQLite database of the ground truth (ground_truth.sqlite)")
+    log.info("  --skip-read-index\t\t\t\t\tdoes not build index of merged reads and clusters (ideal_repertoire.idx)")
+    log.info("  --progress-interval\t<int>\t\t\t\tinterval in seconds of progress reports of running stages, 0 disables them [default: 30]")
+    log.info("  --progress-textfile\t<filename>\t\t\tPrometheus textfile with progress of stages, e.g. in textfile directory of node exporter")
+    log.info("  \t\t\t\t\t\t\t[default: 'ig_simulator.prom' in output directory]")
+    log.info("  --estimate\t\t\t\t\t\tprints predicted wall time, peak memory and disk usage of stages without running them")
+    log.info("  --calibration\t\t<filename>\t\t\tbenchmark_results.json of src/benchmark/run_benchmark.py or directory of such files")
+    log.info("  \t\t\t\t\t\t\tcalibrating --estimate [default: 'data/resource_calibration' in IgSimulator directory]")
+    log.info("  --scratch-dir\t\t<dirname>\t\t\tdirectory for intermediate files (simulated paired reads, ART alignments and chunks),")
+    log.info("  \t\t\t\t\t\t\te.g. on tmpfs or local disk [default: output directory]")
+    log.info("  --retention\t\t<policy>\t\t\tkeep-all, keep-none-intermediate (paired reads are removed once they are merged,")
+    log.info("  \t\t\t\t\t\t\tART alignments are not written) or keep-main (only main output files are kept) [default: keep-all]")
+    log.info("  --resume\t\t\t\t\t\tkeeps output directory and reruns only stages whose parameters or inputs were changed")
     log.info("  --skip-drawing\t\t\t\t\tskips visualization of statistics for merged reads")
     log.info("  --help\t\t\t\t\t\tprints help")
 
-def PrepareOutputDir(output_dir_path):
+def PrepareOutputDir(output_dir_path, resume = False):
     if os.path.exists(output_dir_path):
+        if resume:
+            return
         shutil.rmtree(output_dir_path)
     os.makedirs(output_dir_path)
 
+def RunStageCommandWithPipes(options, stage_name, command_line, log, compressed_inputs = [], compressed_outputs = []):
+    # output of the stage goes to both console and log file through the logger
+    # binaries read and write plain files, so compressed inputs and outputs are passed
+    # through named pipes at the paths of corresponding plain files
+    # returns exit code and list of errors of pipes
+    pipes = [compression_utils.FifoDecompressor(fname, compression_utils.PlainFname(fname)) for fname in compressed_inputs]
+    pipes += [compression_utils.FifoCompressor(compression_utils.PlainFname(fname), fname) for fname in compressed_outputs]
+    for pipe in pipes:
+        pipe.start()
+    outputs, expected_records = StageProgressOutputs(options, stage_name)
+    progress = options.progress.Start(stage_name, outputs, expected_records)
+    error_code, usage = process_utils.RunCommand(command_line, progress.OutputHandler(log.info))
+    options.progress.Finish(progress)
+    options.run_metrics.Add(stage_name, command_line, usage)
+    pipe_errors = [pipe.Finish() for pipe in pipes]
+    return error_code, [error for error in pipe_errors if error is not None]
+
+def RunStageCommand(options, stage_name, command_line, log, compressed_inputs = [], compressed_outputs = []):
+    error_code, pipe_errors = RunStageCommandWithPipes(options, stage_name, command_line, log, compressed_inputs, compressed_outputs)
+    if error_code == 0 and len(pipe_errors) != 0:
+        raise IgSimulatorError("Streaming of compressed files failed: " + "; ".join(pipe_errors))
+    return error_code
+
+def StageProgressOutputs(options, stage_name):
+    # outputs of a binary stage whose records are counted by progress reports and expected number of records
+    # (None if it is unknown, progress lines of the binary are used instead). ART simulates about one read pair
+    # per repertoire copy, outputs of streamed stages are named pipes and are not counted
+    if stage_name == "repertoire_simulation":
+        expected_records = options.num_mutated if options.compact_repertoire else options.repertoire_size
+        return [(RepertoireFastaFname(options), "fasta")], expected_records
+    if stage_name == "read_simulation":
+        return [(options.left_reads, "fastq")], options.repertoire_size
+    if stage_name == "paired_read_merging" and not options.stream_reads:
+        return [(ArtifactFname(options, os.path.join(options.output_dir, "merged_reads.fastq")), "fastq")], None
+    return [], None
+
+def IntermediateDir(options):
+    if options.scratch_dir == "":
+        return options.output_dir
+    # the name depends on the output directory, so that --resume finds intermediate files of the previous run
+    output_dir = os.path.normpath(options.output_dir)
+    return os.path.join(options.scratch_dir, os.path.basename(output_dir) + "_" + hashlib.sha1(output_dir.encode("utf-8")).hexdigest()[:8])
+
+def RemoveEmptyIntermediateDir(options):
+    if options.scratch_dir != "" and os.path.isdir(IntermediateDir(options)) and len(os.listdir(IntermediateDir(options))) == 0:
+        os.rmdir(IntermediateDir(options))
+
+def KeepIntermediates(options):
+    return options.retention == "keep-all"
+
+def RemoveFiles(fnames, description, options, log):
+    removed = [fname for fname in fnames if fname != "" and os.path.exists(fname)]
+    for fname in removed:
+        os.remove(fname)
+    if len(removed) != 0:
+        log.info(description + " were removed (--retention " + options.retention + ")")
+
+def ArtifactFname(options, fname):
+    return compression_utils.CompressedFname(fname, options.compression)
+
+def StageIsUpToDate(options, stage_name, stage_key, log):
+    if options.stage_cache.IsUpToDate(stage_name, stage_key):
+        log.info("Results of stage " + stage_name + " are up to date and will be reused")
+        return True
+    options.stage_cache.Invalidate(stage_name)
+    return False
+
 # -------------------------- IgRepertoireSimulation --------------------------------------------
 
 def CheckVDJgenes(options, self_dir_path, log):
@@ -140,190 +357,453 @@ def CheckVDJgenes(options, self_dir_path, log):
         
     if not os.path.exists(options.vgenes_path):
         if not os.path.exists(os.path.abspath(inner_vgenes)):
-            log.info("ERROR: FASTA file with HV genes was not found")
-            sys.exit(1)
+            raise IgSimulatorError("FASTA file with HV genes was not found")
         options.vgenes_path = os.path.join(self_dir_path, inner_vgenes)
         log.info("FASTA file with V genes was not specified. IMGT database " + options.vgenes_path + " will be used by default")
 
     if not os.path.exists(options.dgenes_path) and options.chain_type == "HC":
         if not os.path.exists(os.path.abspath(inner_dgenes)):
-            log.info("ERROR: FASTA file with HD genes was not found")
-            sys.exit(1)
+            raise IgSimulatorError("FASTA file with HD genes was not found")
         options.dgenes_path = os.path.join(self_dir_path, inner_dgenes)
         log.info("FASTA file with D genes was not specified. IMGT database " + options.dgenes_path + " will be used by default")
 
     if not os.path.exists(options.jgenes_path):
         if not os.path.exists(os.path.abspath(inner_jgenes)):
-            log.info("ERROR: FASTA file with HJ genes was not found")
-            sys.exit(1)
+            raise IgSimulatorError("FASTA file with HJ genes was not found")
         options.jgenes_path = os.path.join(self_dir_path, inner_jgenes)
         log.info("FASTA file with J genes was not specified. IMGT database " + options.jgenes_path + " will be used by default")
 
+def RepertoireFastaFname(options):
+    if options.compact_repertoire:
+        return ArtifactFname(options, os.path.join(options.output_dir, "final_repertoire_compact.fasta"))
+    return ArtifactFname(options, os.path.join(options.output_dir, "final_repertoire.fasta"))
+
 def CheckForRepertoireSimulationResults(options, log):
-    options.repertoire_fasta = os.path.join(options.output_dir, "final_repertoire.fasta")
+    options.repertoire_fasta = RepertoireFastaFname(options)
     if os.path.exists(options.repertoire_fasta):
         log.info("* Simulated reperoire was written to "+ options.repertoire_fasta)
     else:
-        log.info("ERROR: FASTA file with simulated repetoire was not found")
-        sys.exit(1)
+        raise IgSimulatorError("FASTA file with simulated repetoire was not found")
 
     options.base_sequences = os.path.join(options.output_dir, "base_sequences.fasta")
     if os.path.exists(options.base_sequences):
         log.info("* Base sequences were written to " + options.base_sequences)
     else:
-        log.info("ERROR: base sequences was not found")
-        sys.exit(1)
+        raise IgSimulatorError("base sequences was not found")
 
     options.base_multiplicities = os.path.join(options.output_dir, "base_frequencies.txt")
     if os.path.exists(options.base_multiplicities):
         log.info("* Frequencies of base sequences were written to " + options.base_multiplicities)
     else:
-        log.info("ERROR: File with frequencies of base sequences was not found")
-        sys.exit(1)
+        raise IgSimulatorError("File with frequencies of base sequences was not found")
+
+    options.mutated_sequences = os.path.join(options.output_dir, "mutated_sequences.fasta")
+    if os.path.exists(options.mutated_sequences):
+        log.info("* Mutated sequences were written to " + options.mutated_sequences)
+    else:
+        raise IgSimulatorError("mutated sequences was not found")
         
     options.mutated_multiplicities = os.path.join(options.output_dir, "mutated_frequencies.txt")
     if os.path.exists(options.mutated_multiplicities):
         log.info("* Frequencies of mutated sequences were written to " + options.mutated_multiplicities)
     else:
-        log.info("ERROR: File with frequencies of mutated sequences was not found")
-        sys.exit(1)
+        raise IgSimulatorError("File with frequencies of mutated sequences was not found")
 
     options.shm_positions = os.path.join(options.output_dir, "shm_positions.txt")
     if os.path.exists(options.shm_positions):
         log.info("* Positions of SHM were written to " + options.shm_positions)
     else:
-        log.info("ERROR: File with positions of SHM was not found")
-        sys.exit(1)  
+        raise IgSimulatorError("File with positions of SHM was not found")
+
+    options.shm_numbers = os.path.join(options.output_dir, "shm_numbers.txt")
+    if os.path.exists(options.shm_numbers):
+        log.info("* Numbers of SHM were written to " + options.shm_numbers)
+    else:
+        raise IgSimulatorError("File with numbers of SHM was not found")
+
+    options.cdr_positions = os.path.join(options.output_dir, "cdr_positions.txt")
+    if os.path.exists(options.cdr_positions):
+        log.info("* Positions of CDRs were written to " + options.cdr_positions)
+    else:
+        raise IgSimulatorError("File with positions of CDRs was not found")
 
     options.repertoire_vdj = os.path.join(options.output_dir, "repertoire_vdj_recombination.txt")
     if os.path.exists(options.repertoire_vdj):
         log.info("* V(D)J recombination for sequences of the final reperoire was written to " + options.repertoire_vdj)
     else:
-        log.info("ERROR: File with V(D)J recombination for sequences of the final reperoire was not found")
-        sys.exit(1)
+        raise IgSimulatorError("File with V(D)J recombination for sequences of the final reperoire was not found")
                 
-def DrawBaseStats(options, base_lens, base_freqs, log, min_mult):
-    hist_name1 = os.path.join(options.output_dir, "base_seq_lens.png")
-    len_hist_settings = drawing_utils.GetGraphicalSettings(xlabel = "Sequence length", ylabel = "# sequences", output_filename = hist_name1)
-    drawing_utils.DrawHistogram(base_lens, len_hist_settings)
-    if os.path.exists(hist_name1):
-        log.info("* Histogram of distribution of base sequence lengths was written to " + hist_name1)
-    else:
-        log.info("ERROR: Histogram of distribution of base sequence lengths was not found")
-        sys.exit(1)
-    
-    hist_name2 = os.path.join(options.output_dir, "base_seq_freqs.png")
-    freq_hist_settings = drawing_utils.GetGraphicalSettings(xlabel = "Base sequence frequency (>" + str(min_mult) + ")", ylabel = "# sequences", output_filename = hist_name2)
-    drawing_utils.DrawHistogram(base_freqs, freq_hist_settings)
-    if os.path.exists(hist_name2):
-        log.info("* Histogram of distribution of base sequence frequencies was written to " + hist_name2)
-    else:
-        log.info("ERROR: Histogram of distribution of base sequence frequencies was not found")
-        sys.exit(1)
-
-def DrawMutatedStats(options, mutated_freqs, mutation_pos, log, min_mult):
-    hist_name1 = os.path.join(options.output_dir, "mutated_seq_freqs.png")
-    freq_hist_settings = drawing_utils.GetGraphicalSettings(xlabel = "Mutated sequence frequency (>" + str(min_mult) + ")", ylabel = "# sequences", output_filename = hist_name1)
-    drawing_utils.DrawHistogram(mutated_freqs, freq_hist_settings)
-    if os.path.exists(hist_name1):
-        log.info("* Histogram of distribution of mutated sequence frequencies was written to " + hist_name1)
-    else:
-        log.info("ERROR: Histogram of distribution of mutated sequence frequencies was not found")
+# Statistics are collected in one pass into sketches (repertoire_stats), so memory does not depend on
+# the number of sequences and SHMs. Figures are rendered from the sketches by drawing_utils (matplotlib) in
+# worker processes; these modules are imported only when statistics are drawn.
+# Statistics are drawn by a separate python process started by RepertoireStatsCommand: it gets only the values
+# of RepertoireStatsOptions on its command line and runs RunRepertoireStatsVisualization.
+
+class RepertoireStatsOptions:
+    # options used by VisualizeRepertoireStats, in order of arguments of RepertoireStatsCommand
+    names = ["output_dir", "num_threads", "base_sequences", "base_multiplicities", "mutated_sequences",
+             "mutated_multiplicities", "shm_positions", "shm_numbers", "cdr_positions"]
+
+    def __init__(self, args):
+        for name, value in zip(RepertoireStatsOptions.names, args):
+            setattr(self, name, value)
+        self.num_threads = int(self.num_threads)
+
+def RepertoireStatsCommand(options):
+    code = ("import sys; sys.path.insert(0, " + repr(ig_tools_init.home_directory) + "); import ig_simulator; "
+            "ig_simulator.RunRepertoireStatsVisualization(sys.argv[1:])")
+    return [sys.executable, "-c", code] + [str(getattr(options, name)) for name in RepertoireStatsOptions.names]
+
+def RunRepertoireStatsVisualization(args):
+    # entry point of the process of RepertoireStatsCommand, exits with code 1 if statistics were not drawn
+    log = logging.getLogger("ig_simulator.repertoire_stats")
+    log.setLevel(logging.INFO)
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(console)
+    try:
+        VisualizeRepertoireStats(RepertoireStatsOptions(args), log)
+    except IgSimulatorError:
+        log.info("ERROR: " + str(sys.exc_info()[1]))
         sys.exit(1)
 
-    hist_name2 = os.path.join(options.output_dir, "shm_positions.png")
-    pos_hist_settings = drawing_utils.GetGraphicalSettings(xlabel = "Relative SHM position", ylabel = "# SHMs", output_filename = hist_name2)
-    drawing_utils.DrawMutationHistogram(mutation_pos, pos_hist_settings, options.chain_type)
-    if os.path.exists(hist_name2):
-        log.info("* Histogram of distribution of SHM positions was written to " + hist_name2)
+class StatsFigure:
+    def __init__(self, output_filename, description, counts, edges, xlabel, ylabel, cdr_positions = None):
+        self.output_filename = output_filename
+        self.description = description
+        self.counts = counts
+        self.edges = edges
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        # CDRs are shaded on histograms of SHM positions only
+        self.cdr_positions = cdr_positions
+
+def SelectMultiplicityThreshold(multiplicity_sketch):
+    min_mult = 5
+    if multiplicity_sketch.NumValues(min_mult + 1) == 0:
+        min_mult = 1
+    return min_mult
+
+def SHMStatsFname(options):
+    return os.path.join(options.output_dir, "shm_stats.json")
+
+def RepertoireStatsReportFnames(options):
+    return [os.path.join(options.output_dir, "repertoire_stats." + extension) for extension in ["json", "html"]]
+
+def RepertoireStatsFigures(options, stats):
+    import numpy
+    import shm_analytics
+    figures = list()
+
+    counts, edges = stats.base_lengths.Binned(100)
+    figures.append(StatsFigure(os.path.join(options.output_dir, "base_seq_lens.png"), "distribution of base sequence lengths",
+                               counts, edges, "Sequence length", "# sequences"))
+
+    min_mult = SelectMultiplicityThreshold(stats.base_multiplicities)
+    counts, edges = stats.base_multiplicities.Binned(100, min_mult + 1)
+    figures.append(StatsFigure(os.path.join(options.output_dir, "base_seq_freqs.png"), "distribution of base sequence frequencies",
+                               counts, edges, "Base sequence frequency (>" + str(min_mult) + ")", "# sequences"))
+
+    min_mult = SelectMultiplicityThreshold(stats.mutated_multiplicities)
+    counts, edges = stats.mutated_multiplicities.Binned(100, min_mult + 1)
+    figures.append(StatsFigure(os.path.join(options.output_dir, "mutated_seq_freqs.png"), "distribution of mutated sequence frequencies",
+                               counts, edges, "Mutated sequence frequency (>" + str(min_mult) + ")", "# sequences"))
+
+    shm_stats = stats.shm_stats
+    counts, edges = shm_stats.relative_profile.Binned()
+    figures.append(StatsFigure(os.path.join(options.output_dir, "shm_positions.png"), "distribution of SHM positions",
+                               counts, edges, "Relative SHM position", "# SHMs", shm_stats.RelativeCDRPositions()))
+
+    # regions are aligned by real boundaries of CDRs of every sequence, region i spans [i, i + 1]
+    profile = shm_stats.RegionProfile()
+    edges = numpy.linspace(0, profile.shape[0], profile.size + 1)
+    figures.append(StatsFigure(os.path.join(options.output_dir, "shm_region_profile.png"), "density of SHMs in FRs and CDRs",
+                               profile.ravel(), edges, "FR1, CDR1, FR2, CDR2, FR3, CDR3, FR4", "SHMs per nucleotide",
+                               [(region, region + 1) for region in shm_analytics.cdr_regions]))
+    return figures
+
+def RenderStatsFigure(figure):
+    import drawing_utils
+    settings = drawing_utils.GetGraphicalSettings(xlabel = figure.xlabel, ylabel = figure.ylabel, output_filename = figure.output_filename)
+    if figure.cdr_positions is not None:
+        drawing_utils.DrawBinnedMutationHistogram(figure.counts, figure.edges, settings, cdr_positions = figure.cdr_positions)
     else:
-        log.info("ERROR: Histogram of distribution of SHM positions was not found")
-        sys.exit(1)
-
-def PrepareMutationPositions(mutation_position, seq_len):
-    rel_mutation_pos = list()
-    for i in range(0, len(mutation_position)):
-        rel_mutation_pos.append(mutation_position[i] / seq_len[i])
-    return rel_mutation_pos
-
-def ReadBaseLens(options):
-    base_sequences_fname = options.base_sequences
-    base_lens = []
-    lines = open(base_sequences_fname, "r").readlines()
-    for i in range(0, len(lines) / 2):
-        base_lens.append(len(lines[i * 2 + 1].strip()))
-    return base_lens 
+        drawing_utils.DrawBinnedHistogram(figure.counts, figure.edges, settings)
 
 def VisualizeRepertoireStats(options, log) :
-    if not options.draw_hist:
-        return 
-
     log.info("\n==== Visualization of repertoire statistics")
+    import shm_analytics
+    import repertoire_stats
+    files = repertoire_stats.RepertoireStatsFiles(options.base_sequences, options.base_multiplicities, options.mutated_sequences,
+                                                  options.mutated_multiplicities, options.shm_positions, options.shm_numbers,
+                                                  options.cdr_positions)
+    try:
+        stats = repertoire_stats.CollectRepertoireStats(files)
+    except ValueError:
+        raise IgSimulatorError("Statistics of repertoire were not collected: " + str(sys.exc_info()[1]))
+    shm_analytics.WriteSummary(stats.shm_stats, SHMStatsFname(options))
+    summary = stats.shm_stats.Summary()
+    log.info("* Statistics of " + str(summary["num_shms"]) + " SHMs in FRs and CDRs were written to " + SHMStatsFname(options))
+    if summary["cdr_fr_density_ratio"] is not None:
+        log.info("  density of SHMs in CDRs is " + "%.2f" % summary["cdr_fr_density_ratio"] + " times of density in FRs")
+    figures = RepertoireStatsFigures(options, stats)
+    num_workers = min(options.num_threads, len(figures))
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        pool.map(RenderStatsFigure, figures)
+        pool.close()
+        pool.join()
+    else:
+        for figure in figures:
+            RenderStatsFigure(figure)
 
-    base_mult_all = drawing_utils.ReadIntGraphicalData(options.base_multiplicities).all_keys
-    min_mult = 5
-    base_mult = [m for m in base_mult_all if m > min_mult]
-    if len(base_mult) == 0:
-        min_mult = 1
-        base_mult = [m for m in base_mult_all if m > min_mult]
-    base_lens = ReadBaseLens(options)
-    DrawBaseStats(options, base_lens, base_mult, log, min_mult)
+    for figure in figures:
+        if os.path.exists(figure.output_filename):
+            log.info("* Histogram of " + figure.description + " was written to " + figure.output_filename)
+        else:
+            raise IgSimulatorError("Histogram of " + figure.description + " was not found")
 
-    mutated_mult_all = drawing_utils.ReadIntGraphicalData(options.mutated_multiplicities).all_keys
-    min_mult = 5
-    mutated_mult = [m for m in mutated_mult_all if m > min_mult]
-    if len(mutated_mult) == 0:
-        min_mult = 1
-        mutated_mult = [m for m in mutated_mult_all if m > min_mult]
-    mutation_pos_data = files_utils.ReadData(options.shm_positions)
-    mutation_pos_list = PrepareMutationPositions(files_utils.StrListToFloat(mutation_pos_data.data["col1"]), files_utils.StrListToFloat(mutation_pos_data.data["col2"]))
-    DrawMutatedStats(options, mutated_mult, mutation_pos_list, log, min_mult)
+    json_fname, html_fname = RepertoireStatsReportFnames(options)
+    repertoire_stats.WriteJSONReport(stats, json_fname)
+    repertoire_stats.WriteHTMLReport(stats, html_fname, [(figure.output_filename, figure.description) for figure in figures])
+    log.info("* Report on statistics of repertoire was written to " + json_fname + " and " + html_fname)
 
-def GetSimulatorCommandLine(options, path_to_binary):
-    command_line = path_to_binary + " " + options.chain_type + " " + options.output_dir + " " + str(options.num_bases) + " " + str(options.num_mutated) + " " + str(options.repertoire_size) + " " + options.vgenes_path + " "
+def GermlineGeneSets(options):
+    gene_sets = [("V", options.vgenes_path)]
     if options.chain_type == "HC":
-        command_line += options.dgenes_path + " "
-    command_line += options.jgenes_path + " " + options.database_type
+        gene_sets.append(("D", options.dgenes_path))
+    gene_sets.append(("J", options.jgenes_path))
+    return gene_sets
+
+def PrepareGermlineCache(options, log):
+    # simulator recognizes the compiled database by its header, so it replaces every FASTA file of genes
+    if options.germline_cache_dir == "":
+        options.germline_cache = ""
+        return
+    try:
+        options.germline_cache, compiled = germline_cache.PrepareGermlineCache(options.germline_cache_dir,
+                                                                               GermlineGeneSets(options),
+                                                                               options.database_type)
+    except (IOError, OSError, ValueError):
+        # the simulator parses FASTA files itself, so the run does not depend on a writable cache
+        options.germline_cache = ""
+        log.info("WARNING: germline cache was not prepared in " + options.germline_cache_dir + " (" + str(sys.exc_info()[1]) +
+                 "), FASTA files of germline genes will be passed to the repertoire simulator")
+        return
+    if compiled:
+        log.info("Germline genes were compiled into " + options.germline_cache)
+    else:
+        log.info("Compiled germline genes " + options.germline_cache + " will be reused")
+
+def GetSimulatorCommandLine(options, path_to_binary):
+    gene_fnames = [fname for _, fname in GermlineGeneSets(options)]
+    if options.germline_cache != "":
+        gene_fnames = [options.germline_cache] * len(gene_fnames)
+    command_line = path_to_binary + " " + options.chain_type + " " + options.output_dir + " " + str(options.num_bases) + " " + str(options.num_mutated) + " " + str(options.repertoire_size) + " "
+    command_line += " ".join(gene_fnames) + " " + options.database_type
+    if options.compact_repertoire:
+        command_line += " compact"
+    if options.seed != -1:
+        command_line += " seed=" + str(options.seed)
     return command_line
 
+def RepertoireSimulationOutputs(options):
+    return [options.repertoire_fasta, options.base_sequences, options.base_multiplicities, options.mutated_sequences,
+            options.mutated_multiplicities, options.shm_positions, options.shm_numbers, options.cdr_positions,
+            options.repertoire_vdj]
+
+def RepertoireStatsOutputs(options):
+    return [os.path.join(options.output_dir, fname) for fname in
+            ["base_seq_lens.png", "base_seq_freqs.png", "mutated_seq_freqs.png", "shm_positions.png",
+             "shm_region_profile.png"]] + [SHMStatsFname(options)] + RepertoireStatsReportFnames(options)
+
 def RunRepertoireSimulation(options, path_to_binary, self_dir_path, log):
     CheckVDJgenes(options, self_dir_path, log)
-    command_line = GetSimulatorCommandLine(options, path_to_binary)
-    log.info("Repertoire simulator command line: " + command_line + "\n")
-    error_code = os.system(command_line + " 2>&1 | tee -a " + options.log)
-
-    if error_code != 0:
-        AbnormalFinishMsg(log, "repertoire_simulator")
-        sys.exit(1)
+    gene_fnames = [options.vgenes_path, options.jgenes_path]
+    if options.chain_type == "HC":
+        gene_fnames.append(options.dgenes_path)
+    stage_key = options.stage_cache.StageKey("repertoire_simulation",
+                                             [options.chain_type, options.num_bases, options.num_mutated,
+                                              options.repertoire_size, options.database_type, options.compact_repertoire,
+                                              options.compression, options.seed],
+                                             [path_to_binary] + gene_fnames, [])
+    stage_skipped = StageIsUpToDate(options, "repertoire_simulation", stage_key, log)
+    if not stage_skipped:
+        options.run_metrics.RunPythonStep("germline_cache", PrepareGermlineCache, options, log)
+        command_line = GetSimulatorCommandLine(options, path_to_binary)
+        log.info("Repertoire simulator command line: " + command_line + "\n")
+        compressed_outputs = list()
+        if options.compression != "":
+            compressed_outputs.append(RepertoireFastaFname(options))
+        error_code = RunStageCommand(options, "repertoire_simulation", command_line, log, compressed_outputs = compressed_outputs)
+
+        if error_code != 0:
+            raise ToolFailedError("repertoire_simulator")
 
     CheckForRepertoireSimulationResults(options, log)
-    VisualizeRepertoireStats(options, log)
+    if not stage_skipped:
+        options.stage_cache.Update("repertoire_simulation", stage_key, RepertoireSimulationOutputs(options))
+    if options.draw_hist and (not stage_skipped or not all([os.path.exists(fname) for fname in RepertoireStatsOutputs(options)])):
+        # read simulation needs only the final repertoire, so statistics are drawn by a separate process
+        # concurrently with the following stages
+        options.background_stages.Start("repertoire_stats_visualization", RepertoireStatsCommand(options), log.info)
 
 # -------------------------- Read Simulator --------------------------------------------
 
-def RunReadSimulator(options, log):
-    log.info('\n==== Read Simulator (ART) starts')
-
+def GetARTCommandLine(options, input_fasta, output_prefix, seed = None):
     command_line = ""
     if options.technology == "illumina":
         command_line = ig_tools_init.PathToBins.run_art_illumina
-        command_line = command_line + " -i " + options.repertoire_fasta + " -p -l 250 -f 1 -m 350 -s 50 -o " + os.path.join(options.output_dir, "paired_reads")
+        command_line = command_line + " -i " + input_fasta + " -p -l 250 -f 1 -m 350 -s 50 -o " + output_prefix
+        if seed is not None:
+            command_line += " -rs " + str(seed)
+        if not KeepIntermediates(options):
+            command_line += " -na"
     if options.technology == "454":
         command_line = ig_tools_init.PathToBins.run_art_454
-        command_line = command_line + " " + options.repertoire_fasta + " " + os.path.join(options.output_dir, "paired_reads") + " 1 350 50"
-    log.info("ART's command line: " + command_line)
-    error_code = os.system(command_line + " 2>&1 | tee -a " + options.log) 
+        if seed is not None:
+            command_line += " -r " + str(seed)
+        command_line = command_line + " " + input_fasta + " " + output_prefix + " 1 350 50"
+    return command_line
 
-    if error_code != 0:
-        AbnormalFinishMsg(log, "ART")
-        sys.exit(1)
+def RunARTChunk(chunk):
+    # chunks run concurrently, so their output is collected and logged afterwards
+    # chunks of compact repertoire are expanded right before ART and removed after it
+    command_line, input_fasta, write_input = chunk
+    if write_input is not None:
+        write_input()
+    output = list()
+    error_code, usage = process_utils.RunCommand(command_line, output.append)
+    if write_input is not None:
+        os.remove(input_fasta)
+    return error_code, usage, output
+
+def StitchARTAlignments(aln_fnames, output_fname):
+    # ALN header of every chunk ends with "##Header End", @SQ lines of all chunks are merged
+    output_fhandler = compression_utils.OpenFile(output_fname, "w")
+    for i in range(0, len(aln_fnames)):
+        for line in open(aln_fnames[i], "r"):
+            if line.startswith("##Header End"):
+                break
+            if i == 0 or line.startswith("@SQ"):
+                output_fhandler.write(line)
+    output_fhandler.write("##Header End\n")
+    for fname in aln_fnames:
+        header = True
+        for line in open(fname, "r"):
+            if not header:
+                output_fhandler.write(line)
+            elif line.startswith("##Header End"):
+                header = False
+    output_fhandler.close()
+
+def ShardSeed(seed, stage_name, shard_index):
+    # independent seed of a shard derived from --seed, ART accepts positive 32-bit seeds
+    digest = hashlib.sha1((str(seed) + " " + stage_name + " " + str(shard_index)).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % (2 ** 31 - 1) + 1
+
+def NumReadShards(options, num_chunks):
+    if options.seed != -1:
+        return options.num_seeded_read_shards
+    return num_chunks
+
+def PrepareARTChunks(options, chunks_dir, log, num_chunks):
+    # returns ART chunks (command line, input FASTA, function writing input FASTA or None) and output prefixes of chunks
+    if os.path.exists(chunks_dir):
+        shutil.rmtree(chunks_dir)
+    os.makedirs(chunks_dir)
+    if options.compact_repertoire:
+        # batches are read by offsets, so compressed repertoire is decompressed first (it has no copies and is small)
+        compact_fasta = options.repertoire_fasta
+        if options.compression != "":
+            compact_fasta = os.path.join(chunks_dir, os.path.basename(compression_utils.PlainFname(compact_fasta)))
+            compression_utils.CopyFile(options.repertoire_fasta, compact_fasta)
+        batches = repertoire_utils.PlanCopyBatches(compact_fasta, num_chunks, options.art_batch_size)
+        chunk_fastas = [os.path.join(chunks_dir, "chunk_" + str(i + 1) + ".fasta") for i in range(0, len(batches))]
+        input_writers = [functools.partial(repertoire_utils.WriteRepertoireCopies, compact_fasta, batches[i], chunk_fastas[i])
+                         for i in range(0, len(batches))]
+        log.info("Copies of repertoire sequences were split into " + str(len(chunk_fastas)) + " batches, ART will be run in " + str(options.num_threads) + " threads")
+    else:
+        chunk_fastas = files_utils.SplitFastaByRecords(options.repertoire_fasta, num_chunks, os.path.join(chunks_dir, "chunk_"))
+        input_writers = [None] * len(chunk_fastas)
+        log.info("Repertoire was split into " + str(len(chunk_fastas)) + " chunks, ART will be run in " + str(options.num_threads) + " threads")
+
+    chunk_prefixes = [files_utils.remove_extension(fname) + "_reads" for fname in chunk_fastas]
+    command_lines = list()
+    for i in range(0, len(chunk_fastas)):
+        # every chunk gets its own seed, otherwise chunks would share random streams
+        seed = random.randint(1, 2 ** 31 - 1)
+        if options.seed != -1:
+            seed = ShardSeed(options.seed, "read_simulation", i)
+        command_lines.append(GetARTCommandLine(options, chunk_fastas[i], chunk_prefixes[i], seed))
+        log.info("ART's command line for chunk " + str(i + 1) + ": " + command_lines[-1])
+    return list(zip(command_lines, chunk_fastas, input_writers)), chunk_prefixes
+
+def ReportARTChunks(options, chunks, results, log):
+    for i in range(0, len(results)):
+        error_code, usage, output = results[i]
+        for line in output:
+            log.info(line)
+        options.run_metrics.Add("read_simulation_chunk_" + str(i + 1), chunks[i][0], usage)
+        if error_code != 0:
+            raise ToolFailedError("ART")
+
+def StitchChunkAlignments(options, chunk_prefixes, output_prefix):
+    for ind in ["1", "2"]:
+        aln_fnames = [prefix + ind + ".aln" for prefix in chunk_prefixes]
+        if all([os.path.exists(fname) for fname in aln_fnames]):
+            StitchARTAlignments(aln_fnames, ArtifactFname(options, output_prefix + ind + ".aln"))
+
+def RunChunkedReadSimulator(options, output_prefix, log):
+    chunks_dir = os.path.join(IntermediateDir(options), "art_chunks")
+    chunks, chunk_prefixes = PrepareARTChunks(options, chunks_dir, log, NumReadShards(options, options.num_threads))
+    progress = options.progress.Start("read_simulation", [(prefix + "1.fq", "fastq") for prefix in chunk_prefixes], options.repertoire_size)
+    pool = ThreadPool(options.num_threads)
+    results = pool.map(RunARTChunk, chunks)
+    pool.close()
+    pool.join()
+    options.progress.Finish(progress)
+    ReportARTChunks(options, chunks, results, log)
+
+    # chunks are record-aligned, so read names stay unique and
+    # concatenation in chunk order keeps left and right reads in sync
+    num_left_lines = files_utils.ConcatenateFiles([prefix + "1.fq" for prefix in chunk_prefixes], options.left_reads)
+    num_right_lines = files_utils.ConcatenateFiles([prefix + "2.fq" for prefix in chunk_prefixes], options.right_reads)
+    if num_left_lines != num_right_lines:
+        raise IgSimulatorError("Numbers of left and right simulated reads are different")
+    StitchChunkAlignments(options, chunk_prefixes, output_prefix)
+    shutil.rmtree(chunks_dir)
 
-    options.left_reads = os.path.join(options.output_dir, "paired_reads1.fq")
-    options.right_reads = os.path.join(options.output_dir, "paired_reads2.fq")
+def RunReadSimulator(options, log):
+    log.info('\n==== Read Simulator (ART) starts')
+
+    output_prefix = os.path.join(IntermediateDir(options), "paired_reads")
+    options.left_reads = ArtifactFname(options, output_prefix + "1.fq")
+    options.right_reads = ArtifactFname(options, output_prefix + "2.fq")
+    art_binary = ig_tools_init.PathToBins.art_illumina
+    if options.technology == "454":
+        art_binary = ig_tools_init.PathToBins.art_454
+    stage_key = options.stage_cache.StageKey("read_simulation", [options.technology, options.compact_repertoire, options.seed,
+                                                                 KeepIntermediates(options), IntermediateDir(options)],
+                                             [art_binary], [options.repertoire_fasta])
+    stage_skipped = StageIsUpToDate(options, "read_simulation", stage_key, log)
+    if stage_skipped:
+        pass
+    elif options.num_threads > 1 or options.compact_repertoire or options.compression != "" or options.seed != -1:
+        # ART reads its input twice, so it gets plain chunks of compressed repertoire
+        RunChunkedReadSimulator(options, output_prefix, log)
+    else:
+        command_line = GetARTCommandLine(options, options.repertoire_fasta, output_prefix)
+        log.info("ART's command line: " + command_line)
+        error_code = RunStageCommand(options, "read_simulation", command_line, log)
+
+        if error_code != 0:
+            raise ToolFailedError("ART")
 
     if not os.path.exists(options.left_reads) or not os.path.exists(options.right_reads):
-        log.info("ERROR: Simulated paired-end reads were not found")
-        sys.exit(1)
+        raise IgSimulatorError("Simulated paired-end reads were not found")
+    if not stage_skipped:
+        options.stage_cache.Update("read_simulation", stage_key, [options.left_reads, options.right_reads])
 
     log.info("* Simulated paired-end reads were written to " + options.left_reads + " and " + options.right_reads)
 
@@ -356,69 +836,304 @@ def RunReadSimulator(options, log):
 
 def RunPairedReadMerger(options, path_to_binary, log):
     log.info('\n==== Paired reads merging')
-    command_line = path_to_binary + " " + options.left_reads + " " + options.right_reads + " " + os.path.join(options.output_dir, "merged_reads") + " --min-overlap=" + str(options.min_overlap) + " --max-mismatch=" + str(options.max_mismatch)
-    #if options.sim_mode:
-    #    command_line = command_line + " --simulated-mode"
-    error_code = os.system(command_line + " 2>&1 | tee -a " + options.log)
-
-    if error_code != 0:
-        AbnormalFinishMsg(log, "paired_read_merged")
-        sys.exit(1)
-
-    options.merged_reads = os.path.join(options.output_dir, "merged_reads.fastq")
+    stage_key = options.stage_cache.StageKey("paired_read_merging", [options.min_overlap, options.max_mismatch],
+                                             [path_to_binary], [options.left_reads, options.right_reads])
+    stage_skipped = StageIsUpToDate(options, "paired_read_merging", stage_key, log)
+    if not stage_skipped:
+        command_line = path_to_binary + " " + compression_utils.PlainFname(options.left_reads) + " " + compression_utils.PlainFname(options.right_reads) + " " + os.path.join(options.output_dir, "merged_reads") + " --min-overlap=" + str(options.min_overlap) + " --max-mismatch=" + str(options.max_mismatch)
+        #if options.sim_mode:
+        #    command_line = command_line + " --simulated-mode"
+        compressed_inputs = list()
+        compressed_outputs = list()
+        if options.compression != "":
+            compressed_inputs = [options.left_reads, options.right_reads]
+            compressed_outputs = [ArtifactFname(options, os.path.join(options.output_dir, "merged_reads.fastq"))]
+        error_code = RunStageCommand(options, "paired_read_merging", command_line, log, compressed_inputs, compressed_outputs)
+
+        if error_code != 0:
+            raise ToolFailedError("paired_read_merged")
+
+    options.merged_reads = ArtifactFname(options, os.path.join(options.output_dir, "merged_reads.fastq"))
     if os.path.exists(options.merged_reads):
         log.info("* Merged reads were written to " + options.merged_reads)
     else:
-        log.info("ERROR: FASTQ file with merged reads was not found")
-        sys.exit(1)
+        raise IgSimulatorError("FASTQ file with merged reads was not found")
+    if not stage_skipped:
+        options.stage_cache.Update("paired_read_merging", stage_key, [options.merged_reads])
 
 # -------------------------- IdealRepertoireConstruction -----------------------------------
-def CreateReadVDJRecombination(options, log):
-    read_antibody = dict()
-    antibody_vdj = dict()
-    rcm_fhandler = open(options.ideal_repertoire_rcm, "r")
-    for l in rcm_fhandler.readlines():
+def AntibodyIdFromVDJName(antibody_name):
+    # antibody names look like antibody_1
+    return int(antibody_name.split("_")[1])
+
+def ReadRCMNames(rcm_fname):
+    rcm_fhandler = compression_utils.OpenFile(rcm_fname, "r")
+    for l in rcm_fhandler:
         splits = l.strip().split()
-        splits1 = splits[0].split("_")
-        antibody_name = splits1[3] + "_" + splits1[4]
-        read_antibody[splits[0]] = antibody_name
+        if len(splits) != 0:
+            yield splits[0]
     rcm_fhandler.close()
-    vdj_fhandler = open(options.repertoire_vdj, "r")
-    for l in vdj_fhandler.readlines():
+
+def ReadRepertoireVDJ(repertoire_vdj_fname):
+    vdj_fhandler = open(repertoire_vdj_fname, "r")
+    for l in vdj_fhandler:
         splits = l.strip().split()
-        vdj = splits[1]
-        for i in range(2, len(splits)):
-            vdj += " " + splits[i]
-        antibody_vdj[splits[0]] = vdj
+        if len(splits) != 0:
+            yield AntibodyIdFromVDJName(splits[0]), " ".join(splits[1:])
     vdj_fhandler.close()
+
+def ReadAntibodyVDJIndex(repertoire_vdj_fname, max_index_size):
+    # returns None if the repertoire has more than max_index_size antibodies
+    antibody_vdj = dict()
+    vdj_strings = dict()
+    for antibody_id, vdj in ReadRepertoireVDJ(repertoire_vdj_fname):
+        if len(antibody_vdj) >= max_index_size:
+            return None
+        # many antibodies share the same recombination, so keep one copy of each string
+        antibody_vdj[antibody_id] = vdj_strings.setdefault(vdj, vdj)
+    return antibody_vdj
+
+def JoinReadVDJInMemory(antibody_vdj, rcm_fname, read_vdj_fhandler):
+    for read in ReadRCMNames(rcm_fname):
+        read_vdj_fhandler.write(read + "\t" + antibody_vdj[repertoire_utils.AntibodyIdFromReadName(read)] + "\n")
+
+def JoinReadVDJExternally(rcm_fname, repertoire_vdj_fname, read_vdj_fhandler, tmp_dir, run_size):
+    def ReadRecords():
+        for read_number, read in enumerate(ReadRCMNames(rcm_fname)):
+            yield repertoire_utils.AntibodyIdFromReadName(read), read_number, read
+
+    def JoinedRecords():
+        sorted_vdj = files_utils.ExternalSort(ReadRepertoireVDJ(repertoire_vdj_fname), 1, tmp_dir, run_size)
+        vdj_record = next(sorted_vdj, None)
+        for antibody_id, read_number, read in files_utils.ExternalSort(ReadRecords(), 2, tmp_dir, run_size):
+            while vdj_record is not None and vdj_record[0] < antibody_id:
+                vdj_record = next(sorted_vdj, None)
+            if vdj_record is None or vdj_record[0] != antibody_id:
+                raise KeyError("antibody_" + str(antibody_id))
+            yield read_number, read, vdj_record[1]
+
+    # restore the order of reads in RCM
+    for _, read, vdj in files_utils.ExternalSort(JoinedRecords(), 1, tmp_dir, run_size):
+        read_vdj_fhandler.write(read + "\t" + vdj + "\n")
+
+def CreateReadVDJRecombination(options, log):
     options.reads_vdj = os.path.join(options.output_dir, "reads_vdj_recombination.txt")
     read_vdj_fhandler = open(options.reads_vdj, "w")
-    for read in read_antibody:
-        antibody = read_antibody[read]
-        vdj = antibody_vdj[antibody]
-        read_vdj_fhandler.write(read + "\t" + vdj + "\n")
+    antibody_vdj = ReadAntibodyVDJIndex(options.repertoire_vdj, options.max_vdj_index_size)
+    if antibody_vdj is not None:
+        JoinReadVDJInMemory(antibody_vdj, options.ideal_repertoire_rcm, read_vdj_fhandler)
+    else:
+        log.info("Repertoire has more than " + str(options.max_vdj_index_size) + " antibodies, V(D)J recombination for reads will be computed using external sort")
+        tmp_dir = tempfile.mkdtemp(prefix = "reads_vdj_", dir = options.output_dir)
+        try:
+            JoinReadVDJExternally(options.ideal_repertoire_rcm, options.repertoire_vdj, read_vdj_fhandler, tmp_dir, options.external_sort_run_size)
+        finally:
+            shutil.rmtree(tmp_dir)
     read_vdj_fhandler.close()
     log.info("* V(D)J recombination for the merged reads was written to " + options.reads_vdj)
 
 def RunIdealRepertoireConstruction(options, path_to_binary, log):
     log.info("\n==== Ideal repertoire construction")
-    command_line = path_to_binary + " " + options.merged_reads + " " + os.path.join(options.output_dir, "ideal_repertoire")
-    error_code = os.system(command_line + " 2>&1 | tee -a " + options.log)
-
-    if error_code != 0:
-        AbnormalFinishMsg(log, "ideal_repertoire_constructor")
-        sys.exit(1)
-    
-    options.ideal_repertoire_fa = os.path.join(options.output_dir, "ideal_repertoire.clusters.fa")
-    options.ideal_repertoire_rcm = os.path.join(options.output_dir, "ideal_repertoire.rcm")
+    stage_key = options.stage_cache.StageKey("ideal_repertoire_construction", [options.build_ground_truth_db, options.build_read_index], [path_to_binary],
+                                             [options.merged_reads, options.repertoire_vdj, options.shm_numbers])
+    stage_skipped = StageIsUpToDate(options, "ideal_repertoire_construction", stage_key, log)
+    if not stage_skipped:
+        command_line = path_to_binary + " " + compression_utils.PlainFname(options.merged_reads) + " " + os.path.join(options.output_dir, "ideal_repertoire")
+        compressed_inputs = list()
+        compressed_outputs = list()
+        if options.compression != "":
+            compressed_inputs = [options.merged_reads]
+            compressed_outputs = IdealRepertoireOutputs(options)
+        error_code = RunStageCommand(options, "ideal_repertoire_construction", command_line, log, compressed_inputs, compressed_outputs)
+
+        if error_code != 0:
+            raise ToolFailedError("ideal_repertoire_constructor")
+    FinishIdealRepertoireConstruction(options, "ideal_repertoire_construction", stage_key, stage_skipped, [], log)
+
+def IdealRepertoireOutputs(options):
+    return [ArtifactFname(options, os.path.join(options.output_dir, fname))
+            for fname in ["ideal_repertoire.rcm", "ideal_repertoire.clusters.fa"]]
+
+def FinishIdealRepertoireConstruction(options, stage_name, stage_key, stage_skipped, other_outputs, log):
+    # checks results of ideal repertoire construction, computes V(D)J recombination for reads
+    # and updates cache of the stage (other_outputs are also results of the stage)
+    options.ideal_repertoire_rcm, options.ideal_repertoire_fa = IdealRepertoireOutputs(options)
     if os.path.exists(options.ideal_repertoire_fa) and os.path.exists(options.ideal_repertoire_rcm):
         log.info("Ideal repertoire was successfully created:")
         log.info("* CLUSTERS.FASTA for simulated repertoire was written to " + options.ideal_repertoire_fa)
         log.info("* RCM for simulated repertoire was written to " + options.ideal_repertoire_rcm)
     else:
-        log.info("ERROR: CLUSTERS.FASTA and RCM for simulated repertoire were not found")
-        sys.exit(1)
-    CreateReadVDJRecombination(options, log)
+        raise IgSimulatorError("CLUSTERS.FASTA and RCM for simulated repertoire were not found")
+    if stage_skipped:
+        options.reads_vdj = os.path.join(options.output_dir, "reads_vdj_recombination.txt")
+        log.info("* V(D)J recombination for the merged reads was written to " + options.reads_vdj)
+        options.read_index = ReadIndexFname(options)
+        if not os.path.exists(options.read_index):
+            options.read_index = ""
+        options.ground_truth_db = GroundTruthDatabaseFname(options)
+        if not os.path.exists(options.ground_truth_db):
+            options.ground_truth_db = ""
+    else:
+        options.run_metrics.RunPythonStep("reads_vdj_recombination", CreateReadVDJRecombination, options, log)
+        options.read_index = ""
+        if options.build_read_index:
+            options.run_metrics.RunPythonStep("read_index", CreateReadIndex, options, log)
+        elif os.path.exists(ReadIndexFname(options)):
+            # index of a previous run does not correspond to the new reads
+            os.remove(ReadIndexFname(options))
+        options.ground_truth_db = ""
+        if options.build_ground_truth_db:
+            options.run_metrics.RunPythonStep("ground_truth_db", CreateGroundTruthDatabase, options, log)
+        elif os.path.exists(GroundTruthDatabaseFname(options)):
+            # database of a previous run does not correspond to the new reads
+            os.remove(GroundTruthDatabaseFname(options))
+        outputs = [options.ideal_repertoire_fa, options.ideal_repertoire_rcm, options.reads_vdj]
+        if options.read_index != "":
+            outputs.append(options.read_index)
+        if options.ground_truth_db != "":
+            outputs.append(options.ground_truth_db)
+        options.stage_cache.Update(stage_name, stage_key, other_outputs + outputs)
+
+def ReadIndexFname(options):
+    return os.path.join(options.output_dir, "ideal_repertoire.idx")
+
+def CreateReadIndex(options, log):
+    # records are read from the indexed files through mmap, so they should not be compressed
+    if options.compression != "":
+        log.info("Index of merged reads and clusters is not built for compressed files")
+        return
+    tmp_dir = tempfile.mkdtemp(prefix = "read_index_", dir = options.output_dir)
+    try:
+        num_reads, num_antibodies, num_clusters = read_index.BuildReadIndex(options.merged_reads, options.ideal_repertoire_fa,
+                                                                            options.ideal_repertoire_rcm, ReadIndexFname(options), tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+    options.read_index = ReadIndexFname(options)
+    log.info("* Index of " + str(num_reads) + " merged reads, " + str(num_antibodies) + " antibodies and " +
+             str(num_clusters) + " clusters was written to " + options.read_index)
+
+def GroundTruthDatabaseFname(options):
+    return os.path.join(options.output_dir, "ground_truth.sqlite")
+
+def CreateGroundTruthDatabase(options, log):
+    files = ground_truth_db.GroundTruthFiles(options.base_sequences, options.base_multiplicities, options.mutated_sequences,
+                                             options.mutated_multiplicities, options.shm_positions, options.shm_numbers,
+                                             options.repertoire_vdj, options.ideal_repertoire_rcm, options.ideal_repertoire_fa)
+    num_records = ground_truth_db.BuildGroundTruthDatabase(files, GroundTruthDatabaseFname(options))
+    options.ground_truth_db = GroundTruthDatabaseFname(options)
+    log.info("* Ground truth of " + str(num_records["antibodies"]) + " antibodies, " + str(num_records["shms"]) + " SHMs, " +
+             str(num_records["reads"]) + " reads and " + str(num_records["clusters"]) + " clusters was written to " +
+             options.ground_truth_db)
+
+# -------------------------- Streaming of reads --------------------------------------------
+# ART chunks -> paired_read_merger -> ideal_repertoire_constructor run concurrently and are
+# connected by named pipes: reads of every finished chunk are streamed to the merger, merged reads
+# are relayed to the ideal repertoire constructor. Reads are stored only with --keep-reads.
+
+def RunReadStreams(options, output_prefix, merger_binary, ideal_binary, log):
+    streams_dir = os.path.join(IntermediateDir(options), "read_streams")
+    if os.path.exists(streams_dir):
+        shutil.rmtree(streams_dir)
+    os.makedirs(streams_dir)
+    # smaller chunks let the merger start earlier
+    chunks_dir = os.path.join(IntermediateDir(options), "art_chunks")
+    chunks, chunk_prefixes = PrepareARTChunks(options, chunks_dir, log, NumReadShards(options, options.num_threads * options.stream_chunks_per_thread))
+
+    chunk_ready = [threading.Event() for _ in chunks]
+    chunk_results = [None] * len(chunks)
+    def RunChunk(i):
+        try:
+            chunk_results[i] = RunARTChunk(chunks[i])
+        finally:
+            chunk_ready[i].set()
+    def ChunkFailed(i):
+        return chunk_results[i] is None or chunk_results[i][0] != 0
+
+    left_fifo = os.path.join(streams_dir, "paired_reads1.fq")
+    right_fifo = os.path.join(streams_dir, "paired_reads2.fq")
+    streamers = [stream_utils.ChunkStreamer(left_fifo, [prefix + "1.fq" for prefix in chunk_prefixes], chunk_ready, ChunkFailed,
+                                            options.left_reads if options.left_reads != "" else None),
+                 stream_utils.ChunkStreamer(right_fifo, [prefix + "2.fq" for prefix in chunk_prefixes], chunk_ready, ChunkFailed,
+                                            options.right_reads if options.right_reads != "" else None)]
+    # merger writes <prefix>.fastq
+    relay = stream_utils.FifoRelay(os.path.join(streams_dir, "merged_reads.fastq"), os.path.join(streams_dir, "merged_reads_to_clustering.fastq"),
+                                   options.merged_reads if options.keep_reads else None)
+
+    merger_command_line = merger_binary + " " + left_fifo + " " + right_fifo + " " + os.path.join(streams_dir, "merged_reads") + " --min-overlap=" + str(options.min_overlap) + " --max-mismatch=" + str(options.max_mismatch)
+    ideal_command_line = ideal_binary + " " + relay.output_fifo_fname + " " + os.path.join(options.output_dir, "ideal_repertoire")
+    log.info("Paired read merger command line: " + merger_command_line)
+    log.info("Ideal repertoire constructor command line: " + ideal_command_line)
+    compressed_outputs = list()
+    if options.compression != "":
+        compressed_outputs = IdealRepertoireOutputs(options)
+
+    stage_pool = ThreadPool(2)
+    ideal_result = stage_pool.apply_async(RunStageCommandWithPipes, (options, "ideal_repertoire_construction", ideal_command_line, log, [], compressed_outputs))
+    merger_result = stage_pool.apply_async(RunStageCommandWithPipes, (options, "paired_read_merging", merger_command_line, log))
+    for stream in streamers + [relay]:
+        stream.start()
+    # chunks are removed once they are streamed, so reads of removed chunks are counted only if they were sampled
+    progress = options.progress.Start("read_simulation", [(prefix + "1.fq", "fastq") for prefix in chunk_prefixes], options.repertoire_size)
+    art_pool = ThreadPool(options.num_threads)
+    art_pool.map(RunChunk, range(0, len(chunks)))
+    art_pool.close()
+    art_pool.join()
+    options.progress.Finish(progress)
+
+    # pipes are released in the order of the stream, so that no stage waits for a pipe forever
+    merger_error_code, _ = merger_result.get()
+    stream_errors = [stream.Finish() for stream in streamers]
+    relay.ReleaseInput()
+    ideal_error_code, pipe_errors = ideal_result.get()
+    stream_errors.append(relay.Finish())
+    stage_pool.close()
+    stage_pool.join()
+
+    ReportARTChunks(options, chunks, chunk_results, log)
+    if merger_error_code != 0:
+        raise ToolFailedError("paired_read_merged")
+    if ideal_error_code != 0:
+        raise ToolFailedError("ideal_repertoire_constructor")
+    errors = [error for error in stream_errors if error is not None] + pipe_errors
+    if len(errors) != 0:
+        raise IgSimulatorError("Streaming of reads failed: " + "; ".join(errors))
+    if options.left_reads != "":
+        StitchChunkAlignments(options, chunk_prefixes, output_prefix)
+    shutil.rmtree(chunks_dir)
+    shutil.rmtree(streams_dir)
+
+def RunStreamingReadPipeline(options, merger_binary, ideal_binary, log):
+    log.info("\n==== Streaming of reads: read simulator (ART) -> paired reads merging -> ideal repertoire construction")
+    output_prefix = os.path.join(IntermediateDir(options), "paired_reads")
+    kept_reads = list()
+    options.left_reads = ""
+    options.right_reads = ""
+    if options.keep_reads:
+        # paired reads are intermediate, they are not stored unless all files are kept
+        if KeepIntermediates(options):
+            options.left_reads = ArtifactFname(options, output_prefix + "1.fq")
+            options.right_reads = ArtifactFname(options, output_prefix + "2.fq")
+            kept_reads = [options.left_reads, options.right_reads]
+        options.merged_reads = ArtifactFname(options, os.path.join(options.output_dir, "merged_reads.fastq"))
+        kept_reads.append(options.merged_reads)
+    art_binary = ig_tools_init.PathToBins.art_illumina
+    if options.technology == "454":
+        art_binary = ig_tools_init.PathToBins.art_454
+    stage_key = options.stage_cache.StageKey("streamed_reads",
+                                             [options.technology, options.compact_repertoire, options.compression,
+                                              options.min_overlap, options.max_mismatch, options.keep_reads, options.seed,
+                                              options.build_ground_truth_db, options.build_read_index, KeepIntermediates(options),
+                                              IntermediateDir(options)],
+                                             [art_binary, merger_binary, ideal_binary],
+                                             [options.repertoire_fasta, options.repertoire_vdj, options.shm_numbers])
+    stage_skipped = StageIsUpToDate(options, "streamed_reads", stage_key, log)
+    if not stage_skipped:
+        RunReadStreams(options, output_prefix, merger_binary, ideal_binary, log)
+    for fname in kept_reads:
+        if not os.path.exists(fname):
+            raise IgSimulatorError(fname + " was not found")
+        log.info("* Reads were written to " + fname)
+    FinishIdealRepertoireConstruction(options, "streamed_reads", stage_key, stage_skipped, kept_reads, log)
 
 #--------------------------- Cleanup --------------------------------------------
 
@@ -436,54 +1151,560 @@ def DetermineErrorType(options, arg):
     else:
         options.sim_mode = True
 
-def CheckOptionsCorrectness(options, log):
-    if options.output_dir == "":
-        log.info("ERROR: Output directory (-o/--output-dir) is missing")
-        usage(log)
-        sys.exit(1)
+def CheckOptionsCorrectness(options):
+    if options.output_dir == "" and not options.estimate:
+        raise OptionsError("Output directory (-o/--output-dir) is missing")
     if options.chain_type != 'HC' and options.chain_type != 'LC':
-        log.info("ERROR: Incorrect type of chain (--chain-type) should be equal HC or LC")
-        usage(log)
-        sys.exit(1) 
+        raise OptionsError("Incorrect type of chain (--chain-type) should be equal HC or LC")
     if options.num_bases == 0:
-        log.info("ERROR: Number of base sequences (--num-bases) is a mandatory parameter!")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Number of base sequences (--num-bases) is a mandatory parameter!")
     if options.num_mutated == 0:
-        log.info("ERROR: Number of mutated sequences (--num-mutated) is a mandatory parameter!")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Number of mutated sequences (--num-mutated) is a mandatory parameter!")
     if options.repertoire_size == 0:
-        log.info("ERROR: Expected repertoire size (--repertoire-size) is a mandatory parameter!")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Expected repertoire size (--repertoire-size) is a mandatory parameter!")
     if options.num_bases >= options.num_mutated:
-        log.info("ERROR: Number of mutated sequences (--num-mutated) should be greater than number of base sequences (--num-bases)")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Number of mutated sequences (--num-mutated) should be greater than number of base sequences (--num-bases)")
     if options.num_mutated >= options.repertoire_size:
-        log.info("ERROR: Repertoire size (--repertoire-size) should be greater than number of mutated sequences (num-mutated)")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Repertoire size (--repertoire-size) should be greater than number of mutated sequences (num-mutated)")
+    if options.num_threads < 1:
+        raise OptionsError("Number of threads (--threads) should be positive")
+    if options.compression not in [""] + list(compression_utils.compression_extensions.keys()):
+        raise OptionsError("Option --compress value " + options.compression + " was not recognized. Compression should be \"gzip\" or \"zstd\"")
+    if not compression_utils.CompressorAvailable(options.compression):
+        raise IgSimulatorError(options.compression + " was not found, it is required for --compress " + options.compression)
     if options.max_mismatch < 0 or options.max_mismatch > 1:
-        log.info("ERROR: Maximal allowed mismatch rate (--max-mismatch) should be from [0, 1]")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Maximal allowed mismatch rate (--max-mismatch) should be from [0, 1]")
     if options.technology != "illumina" and options.technology != "454":
-        log.info("ERROR: Option value " + options.technology + " was not recognized. Technology for NGS read simulation should be \"illumina\" or \"454\"")
-        usage(log)
-        sys.exit(1)
+        raise OptionsError("Option value " + options.technology + " was not recognized. Technology for NGS read simulation should be \"illumina\" or \"454\"")
     if options.database_type != 'imgt' and options.database_type != 'reg':
-        log.info("ERROR: Option --db-type value " + options.database_type + " was not recognized. Database type should be \"imgt\" or \"reg\"")
-        usage(log)
-        sys.exit(1) 
+        raise OptionsError("Option --db-type value " + options.database_type + " was not recognized. Database type should be \"imgt\" or \"reg\"")
+    if options.seed != -1 and (options.seed < 0 or options.seed >= 2 ** 32):
+        raise OptionsError("Seed (--seed) should be from [0, 4294967295]")
+    if options.retention not in retention_policies:
+        raise OptionsError("Option --retention value " + options.retention + " was not recognized. Retention policy should be one of " + ", ".join(retention_policies))
+    if options.progress_interval < 0:
+        raise OptionsError("Interval of progress reports (--progress-interval) should be non-negative")
 
 def PrintMainOutputFiles(options, log):
     log.info("\nMain output files:")
     log.info("* Sequences of simulated repertoire were written to " + options.repertoire_fasta) 
-    log.info("* Simulated merged reads were written to " + options.merged_reads)
+    if options.merged_reads != "":
+        log.info("* Simulated merged reads were written to " + options.merged_reads)
     log.info("* CLUSTERS.FA for simulated repertoire were written to " + options.ideal_repertoire_fa)
     log.info("* RCM for simulated repertoire were written to " + options.ideal_repertoire_rcm)
+    if options.read_index != "":
+        log.info("* Index of merged reads and clusters was written to " + options.read_index)
+    if options.ground_truth_db != "":
+        log.info("* Ground truth database was written to " + options.ground_truth_db)
+
+# -------------------------- Python API -----------------------------------
+# IgSimulator runs stages of the pipeline from other Python code, e.g. many simulations in one process:
+#   simulator = IgSimulator(Options(output_dir = "out", num_bases = 10, num_mutated = 50, repertoire_size = 100))
+#   for name, seq in simulator.BuildIdealRepertoire().Clusters():
+#       ...
+#   simulator.Close()
+# Stages raise IgSimulatorError instead of exiting, run preceding stages if needed and return handles
+# of their results: names of files and iterators over records that read the files on demand.
+# Statistics of the repertoire are drawn in background after SimulateRepertoire until BuildIdealRepertoire,
+# WaitForBackgroundStages or Close.
+
+class RepertoireResult:
+    def __init__(self, options):
+        self.fasta = options.repertoire_fasta
+        self.compact = options.compact_repertoire
+        self.base_sequences = options.base_sequences
+        self.base_multiplicities = options.base_multiplicities
+        self.mutated_sequences = options.mutated_sequences
+        self.mutated_multiplicities = options.mutated_multiplicities
+        self.shm_positions = options.shm_positions
+        self.shm_numbers = options.shm_numbers
+        self.cdr_positions = options.cdr_positions
+        self.vdj_recombination = options.repertoire_vdj
+
+    def Sequences(self):
+        # (name, sequence) of every copy of repertoire sequences, names are the same for compact repertoire
+        if not self.compact:
+            for record in files_utils.IterateFastaRecords(self.fasta):
+                yield record
+            return
+        for _, name, multiplicity, seq in repertoire_utils.IterateCompactRecords(self.fasta):
+            for i in range(0, multiplicity):
+                yield repertoire_utils.CopyName(name, i), seq
+
+    def VDJRecombination(self):
+        # (antibody id, V(D)J genes separated by space)
+        return ReadRepertoireVDJ(self.vdj_recombination)
+
+class ReadsResult:
+    def __init__(self, left_reads, right_reads):
+        self.left_reads = left_reads
+        self.right_reads = right_reads
+
+    def ReadPairs(self):
+        # pairs of (name, sequence, quality) of left and right reads
+        right_records = files_utils.IterateFastqRecords(self.right_reads)
+        for left_record in files_utils.IterateFastqRecords(self.left_reads):
+            right_record = next(right_records, None)
+            if right_record is None:
+                raise IgSimulatorError("Numbers of left and right simulated reads are different")
+            yield left_record, right_record
+
+class MergedReadsResult:
+    def __init__(self, merged_reads):
+        self.merged_reads = merged_reads
+
+    def Reads(self):
+        # (name, sequence, quality)
+        return files_utils.IterateFastqRecords(self.merged_reads)
+
+class IdealRepertoireResult:
+    def __init__(self, options):
+        self.clusters_fa = options.ideal_repertoire_fa
+        self.rcm = options.ideal_repertoire_rcm
+        self.reads_vdj = options.reads_vdj
+        self.read_index = options.read_index
+        self.ground_truth_db = options.ground_truth_db
+        self.merged_reads = options.merged_reads
+
+    def Index(self):
+        # ReadIndex gives reads of a read name, antibody or cluster without scanning the files, should be closed
+        if self.read_index == "":
+            raise IgSimulatorError("Index of merged reads and clusters was not built")
+        return read_index.ReadIndex(self.read_index, self.merged_reads, self.clusters_fa)
+
+    def GroundTruth(self):
+        # sqlite3 connection to the ground truth database (see ground_truth_db for tables), should be closed
+        if self.ground_truth_db == "":
+            raise IgSimulatorError("Ground truth database was not built")
+        return ground_truth_db.OpenGroundTruthDatabase(self.ground_truth_db)
+
+    def Clusters(self):
+        # (name, sequence)
+        return files_utils.IterateFastaRecords(self.clusters_fa)
+
+    def ReadClusters(self):
+        # (read name, cluster id)
+        rcm_fhandler = compression_utils.OpenFile(self.rcm, "r")
+        for l in rcm_fhandler:
+            splits = l.strip().split()
+            if len(splits) != 0:
+                yield splits[0], int(splits[1])
+        rcm_fhandler.close()
+
+    def ReadsVDJ(self):
+        # (read name, V(D)J genes)
+        vdj_fhandler = open(self.reads_vdj, "r")
+        for l in vdj_fhandler:
+            splits = l.strip().split("\t")
+            if len(splits) == 2:
+                yield splits[0], splits[1]
+        vdj_fhandler.close()
+
+class IgSimulator:
+    def __init__(self, options, log = None):
+        # options are copied, so the same Options can be used for several simulations
+        # log is the module logger by default; simulations running concurrently should have their own loggers,
+        # since ig_simulator.log of the output directory is attached to it until Close()
+        CheckBinaries()
+        CheckOptionsCorrectness(options)
+        self.options = copy.copy(options)
+        self.log = log
+        if log is None:
+            self.log = logging.getLogger('ig_simulator')
+        self.options.output_dir = os.path.abspath(self.options.output_dir)
+        if self.options.num_reads == 0:
+            self.options.num_reads = self.options.repertoire_size * 2
+        PrepareOutputDir(self.options.output_dir, self.options.resume)
+        if self.options.scratch_dir != "":
+            self.options.scratch_dir = os.path.abspath(self.options.scratch_dir)
+            PrepareOutputDir(IntermediateDir(self.options), self.options.resume)
+        self.options.stage_cache = stage_cache.StageCache(os.path.join(self.options.output_dir, "stage_cache.json"), self.options.resume)
+
+        self.options.log = os.path.join(self.options.output_dir, "ig_simulator.log")
+        if os.path.exists(self.options.log):
+            os.remove(self.options.log)
+        self.log_handler = logging.FileHandler(self.options.log, mode='a')
+        self.log.addHandler(self.log_handler)
+        self.options.run_metrics = process_utils.RunMetrics(os.path.join(self.options.output_dir, "run_metrics.json"))
+        self.options.background_stages = process_utils.BackgroundStages(self.options.run_metrics, ToolFailedError)
+        if self.options.progress_textfile == "":
+            self.options.progress_textfile = os.path.join(self.options.output_dir, "ig_simulator.prom")
+        self.options.progress = progress_utils.ProgressMonitor(self.options.progress_textfile, self.log,
+                                                               self.options.progress_interval, self.options.output_dir)
+        self.log.info("Log will be written to " + self.options.log + "\n")
+
+        self.repertoire = None
+        self.reads = None
+        # reads of another simulator (UseReadsOf) are not removed by retention policy
+        self.shared_reads = False
+        self.merged_reads = None
+        self.ideal_repertoire = None
+
+    def Close(self):
+        # waits for background stages, stops progress reports, removes empty scratch directory
+        # and detaches ig_simulator.log from the logger
+        for stage in self.options.background_stages.Unreported():
+            self.log.info("ERROR: stage " + stage.name + " failed: " + str(stage.error))
+        self.options.progress.Stop()
+        RemoveEmptyIntermediateDir(self.options)
+        if self.log_handler is not None:
+            self.log.removeHandler(self.log_handler)
+            self.log_handler.close()
+            self.log_handler = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def SimulateRepertoire(self):
+        if self.repertoire is None:
+            RunRepertoireSimulation(self.options, ig_tools_init.PathToBins.run_simulate_repertoire_tool, ig_tools_init.home_directory, self.log)
+            self.repertoire = RepertoireResult(self.options)
+        return self.repertoire
+
+    def UseReadsOf(self, simulator):
+        # merging and ideal repertoire construction will use repertoire and reads of another simulator
+        reads = simulator.SimulateReads()
+        for name in ["repertoire_fasta", "base_sequences", "base_multiplicities", "mutated_sequences", "mutated_multiplicities",
+                     "shm_positions", "shm_numbers", "cdr_positions", "repertoire_vdj", "left_reads", "right_reads"]:
+            setattr(self.options, name, getattr(simulator.options, name))
+        self.repertoire = simulator.repertoire
+        self.reads = reads
+        self.shared_reads = True
+
+    def WaitForBackgroundStages(self):
+        # raises exception of a failed background stage (drawing of statistics)
+        self.options.background_stages.Wait()
+
+    def CheckReadsAreStored(self):
+        if self.options.stream_reads and not self.options.keep_reads:
+            raise IgSimulatorError("Reads are not stored in streaming mode unless keep_reads is set, ideal repertoire can be built by BuildIdealRepertoire")
+
+    def SimulateReads(self):
+        self.CheckReadsAreStored()
+        if self.options.stream_reads and not KeepIntermediates(self.options):
+            raise IgSimulatorError("Paired reads are not stored in streaming mode unless all files are kept (retention keep-all)")
+        if self.reads is None:
+            if self.options.stream_reads:
+                self.BuildIdealRepertoire()
+            else:
+                self.SimulateRepertoire()
+                self.options.background_stages.CheckFailures()
+                RunReadSimulator(self.options, self.log)
+                self.reads = ReadsResult(self.options.left_reads, self.options.right_reads)
+        return self.reads
+
+    def MergeReads(self):
+        self.CheckReadsAreStored()
+        if self.merged_reads is None:
+            if self.options.stream_reads:
+                self.BuildIdealRepertoire()
+            else:
+                self.SimulateReads()
+                self.options.background_stages.CheckFailures()
+                RunPairedReadMerger(self.options, ig_tools_init.PathToBins.run_paired_read_merger_tool, self.log)
+                self.merged_reads = MergedReadsResult(self.options.merged_reads)
+                if not KeepIntermediates(self.options) and not self.shared_reads:
+                    RemoveFiles([self.options.left_reads, self.options.right_reads], "Simulated paired-end reads", self.options, self.log)
+                    self.reads = None
+        return self.merged_reads
+
+    def BuildIdealRepertoire(self):
+        if self.ideal_repertoire is None:
+            if self.options.stream_reads:
+                # read simulation, merging and ideal repertoire construction run concurrently
+                self.SimulateRepertoire()
+                self.options.background_stages.CheckFailures()
+                RunStreamingReadPipeline(self.options, ig_tools_init.PathToBins.run_paired_read_merger_tool,
+                                         ig_tools_init.PathToBins.run_create_ideal_repertoire_tool, self.log)
+                if self.options.keep_reads:
+                    if self.options.left_reads != "":
+                        self.reads = ReadsResult(self.options.left_reads, self.options.right_reads)
+                    self.merged_reads = MergedReadsResult(self.options.merged_reads)
+            else:
+                self.MergeReads()
+                self.options.background_stages.CheckFailures()
+                RunIdealRepertoireConstruction(self.options, ig_tools_init.PathToBins.run_create_ideal_repertoire_tool, self.log)
+            # the last stage of the pipeline joins statistics drawn meanwhile
+            self.WaitForBackgroundStages()
+            self.ideal_repertoire = IdealRepertoireResult(self.options)
+        return self.ideal_repertoire
+
+    def Run(self):
+        # the whole pipeline
+        self.log.info("\n======== IgSimulator starts")
+        self.BuildIdealRepertoire()
+        if self.options.retention == "keep-main" and not self.shared_reads:
+            RemoveFiles([self.options.base_sequences, self.options.base_multiplicities, self.options.mutated_sequences,
+                         self.options.mutated_multiplicities, self.options.shm_positions, self.options.shm_numbers,
+                         self.options.cdr_positions, self.options.repertoire_vdj], "Files of the repertoire simulator", self.options, self.log)
+        self.log.info("\n======== IgSimulator ends")
+        PrintMainOutputFiles(self.options, self.log)
+        return self.ideal_repertoire
+
+# -------------------------- Batch mode -----------------------------------
+# --manifest runs many simulations described by JSON manifest, e.g.
+#   {"defaults": {"chain_type": "HC", "num_threads": 2},
+#    "runs": [{"name": "small", "num_bases": 10, "num_mutated": 50, "repertoire_size": 100}],
+#    "grid": {"min_overlap": [40, 60], "max_mismatch": [0.05, 0.1]}}
+# Every run is extended by all combinations of grid values. Fields are those of Options, "memory_mb" is
+# expected peak memory of the run. Runs with equal upstream parameters share one simulated repertoire and
+# reads (directory shared_reads_<N>), merged reads and ideal repertoire are written to directory of the run.
+
+upstream_option_names = ["chain_type", "num_bases", "num_mutated", "repertoire_size", "vgenes_path", "dgenes_path",
+                         "jgenes_path", "database_type", "technology", "compact_repertoire", "compression", "draw_hist", "seed"]
+
+batch_summary_columns = ["run", "status", "chain_type", "num_bases", "num_mutated", "repertoire_size", "min_overlap",
+                         "max_mismatch", "shared_reads_dir", "reads_wall_time_sec", "wall_time_sec", "merged_reads",
+                         "clusters_fa", "rcm", "error"]
+
+class BatchRun:
+    def __init__(self, name, options, memory_mb):
+        self.name = name
+        self.options = options
+        self.memory_mb = memory_mb
+        self.reads_group = None
+        self.job = None
+
+class SharedReadsGroup:
+    # repertoire and reads shared by runs with equal upstream parameters
+    def __init__(self, options, memory_mb):
+        self.options = options
+        self.memory_mb = memory_mb
+        self.simulator = None
+        self.job = None
+
+def ManifestValue(value):
+    # JSON strings are unicode in Python 2
+    if isinstance(value, type(u"")):
+        return str(value)
+    return value
+
+def ExpandManifest(manifest, batch_options):
+    defaults = manifest.get("defaults", dict())
+    grid = manifest.get("grid", dict())
+    combinations = [[]]
+    for name in sorted(grid.keys()):
+        combinations = [combination + [(name, value)] for combination in combinations for value in grid[name]]
+    runs = list()
+    for i, manifest_run in enumerate(manifest.get("runs", [dict()])):
+        for combination in combinations:
+            params = {"num_threads": 1}
+            for name, value in list(defaults.items()) + list(manifest_run.items()) + combination:
+                params[str(name)] = ManifestValue(value)
+            name = str(params.pop("name", "run_" + str(i + 1)))
+            if len(combination) != 0:
+                name += "_" + "_".join([param + "_" + str(value) for param, value in combination])
+            memory_mb = params.pop("memory_mb", batch_options.batch_job_memory_mb)
+            for param in ["output_dir", "manifest", "stream_reads"]:
+                if param in params:
+                    raise OptionsError("Option " + param + " of run " + name + " can not be set in manifest")
+            try:
+                run_options = Options(**params)
+                run_options.output_dir = os.path.join(batch_options.output_dir, name)
+                run_options.resume = batch_options.resume
+                # intermediate files of all runs follow options of the batch unless they are set in manifest
+                for param in ["scratch_dir", "retention"]:
+                    if param not in params:
+                        setattr(run_options, param, getattr(batch_options, param))
+                CheckOptionsCorrectness(run_options)
+            except OptionsError:
+                raise OptionsError("Run " + name + ": " + str(sys.exc_info()[1]))
+            runs.append(BatchRun(name, run_options, memory_mb))
+    if len(set([run.name for run in runs])) != len(runs):
+        raise OptionsError("Names of runs in manifest are not unique")
+    return runs
+
+def GroupRunsBySharedReads(runs, batch_dir):
+    groups = list()
+    group_index = dict()
+    for run in runs:
+        key = tuple([getattr(run.options, name) for name in upstream_option_names])
+        if key not in group_index:
+            group_index[key] = len(groups)
+            group_options = copy.copy(run.options)
+            group_options.output_dir = os.path.join(batch_dir, "shared_reads_" + str(len(groups) + 1))
+            groups.append(SharedReadsGroup(group_options, 0))
+        group = groups[group_index[key]]
+        group.options.num_threads = max(group.options.num_threads, run.options.num_threads)
+        group.memory_mb = max(group.memory_mb, run.memory_mb)
+        run.reads_group = group
+    return groups
+
+def BatchRunLogger(name):
+    # log of every simulation goes to its own ig_simulator.log only
+    log = logging.getLogger("ig_simulator.batch." + name)
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    return log
+
+def SimulateSharedReads(group):
+    group.simulator = IgSimulator(group.options, BatchRunLogger(os.path.basename(group.options.output_dir)))
+    try:
+        group.simulator.SimulateReads()
+        group.simulator.WaitForBackgroundStages()
+    finally:
+        group.simulator.Close()
+
+def RunBatchSimulation(run):
+    simulator = IgSimulator(run.options, BatchRunLogger(run.name))
+    try:
+        simulator.UseReadsOf(run.reads_group.simulator)
+        simulator.BuildIdealRepertoire()
+        run.options = simulator.options
+    finally:
+        simulator.Close()
+
+def BatchSummaryRow(run):
+    row = {"run": run.name, "status": run.job.status, "shared_reads_dir": run.reads_group.options.output_dir,
+           "reads_wall_time_sec": run.reads_group.job.wall_time_sec, "wall_time_sec": run.job.wall_time_sec,
+           "merged_reads": run.options.merged_reads, "clusters_fa": run.options.ideal_repertoire_fa,
+           "rcm": run.options.ideal_repertoire_rcm, "error": ""}
+    for name in ["chain_type", "num_bases", "num_mutated", "repertoire_size", "min_overlap", "max_mismatch"]:
+        row[name] = getattr(run.options, name)
+    if run.job.status == "failed":
+        row["error"] = run.job.error
+    elif run.job.status == "skipped":
+        row["error"] = "simulation of shared reads failed: " + str(run.reads_group.job.error)
+    return [str(row[column]) for column in batch_summary_columns]
+
+def RunBatch(options, log):
+    try:
+        manifest = json.load(open(options.manifest, "r"))
+    except (IOError, ValueError):
+        raise OptionsError("Manifest " + options.manifest + " can not be read: " + str(sys.exc_info()[1]))
+    runs = ExpandManifest(manifest, options)
+    groups = GroupRunsBySharedReads(runs, options.output_dir)
+    log.info("Manifest contains " + str(len(runs)) + " simulations sharing " + str(len(groups)) + " simulated repertoires and read sets")
+
+    memory_budget = options.batch_memory_mb
+    if memory_budget == 0:
+        memory_budget = process_utils.AvailableMemoryMb() or 0
+    log.info("Budget of the batch: " + str(options.num_threads) + " threads, " +
+             (str(memory_budget) + " MB" if memory_budget != 0 else "unlimited memory") + "\n")
+    jobs = list()
+    for group in groups:
+        group.job = batch_utils.BatchJob(os.path.basename(group.options.output_dir), functools.partial(SimulateSharedReads, group),
+                                         group.options.num_threads, group.memory_mb)
+        jobs.append(group.job)
+    for run in runs:
+        # paired read merger and ideal repertoire constructor are single-threaded
+        run.job = batch_utils.BatchJob(run.name, functools.partial(RunBatchSimulation, run), 1, run.memory_mb,
+                                       [run.reads_group.job])
+        jobs.append(run.job)
+    batch_utils.BatchScheduler(options.num_threads, memory_budget, log.info).Run(jobs)
+    for group in groups:
+        # shared reads are removed when all runs using them are finished
+        if group.simulator is not None and not KeepIntermediates(group.options):
+            RemoveFiles([group.simulator.options.left_reads, group.simulator.options.right_reads],
+                        "Shared paired-end reads of " + os.path.basename(group.options.output_dir), group.options, log)
+            RemoveEmptyIntermediateDir(group.simulator.options)
+
+    summary_fname = os.path.join(options.output_dir, "batch_summary.tsv")
+    summary_fhandler = open(summary_fname, "w")
+    summary_fhandler.write("\t".join(batch_summary_columns) + "\n")
+    log.info("\n" + "\t".join(batch_summary_columns[:6] + ["reads_wall_time_sec", "wall_time_sec"]))
+    for run in runs:
+        row = BatchSummaryRow(run)
+        summary_fhandler.write("\t".join(row) + "\n")
+        log.info("\t".join(row[:6] + row[9:11]))
+    summary_fhandler.close()
+    log.info("\n* Summary of the batch was written to " + summary_fname)
+    return len([run for run in runs if run.job.status != "done"])
+
+def RunBatchMode(options, log):
+    if options.output_dir == "":
+        log.info("ERROR: Output directory (-o/--output-dir) is missing")
+        usage(log)
+        sys.exit(1)
+    options.output_dir = os.path.join(ig_tools_init.home_directory, options.output_dir)
+    PrepareOutputDir(options.output_dir, options.resume)
+    log_filename = os.path.join(options.output_dir, "ig_simulator_batch.log")
+    log.addHandler(logging.FileHandler(log_filename, mode='w'))
+    log.info("Log will be written to " + log_filename + "\n")
+    ig_tools_init.PrintCommandLine(sys.argv, log)
+    try:
+        num_failed = RunBatch(options, log)
+    except IgSimulatorError:
+        log.info("ERROR: " + str(sys.exc_info()[1]))
+        sys.exit(1)
+    if num_failed != 0:
+        log.info("\nERROR: " + str(num_failed) + " simulations of the batch failed, see their ig_simulator.log files")
+        sys.exit(1)
+    log.info("\nThank you for using IgSimulator!")
+    log.info("\nLog was written to " + log_filename)
+
+# -------------------------- Resource estimation -----------------------------------
+
+def EstimatedStages(options):
+    # stages that would be run with the options
+    skipped = list()
+    if options.germline_cache_dir == "":
+        skipped.append("germline_cache")
+    if not options.draw_hist:
+        skipped.append("repertoire_stats_visualization")
+    if options.compression != "" or not options.build_read_index:
+        skipped.append("read_index")
+    if not options.build_ground_truth_db:
+        skipped.append("ground_truth_db")
+    return [name for name in resource_estimator.stage_order if name not in skipped]
+
+def EstimateResources(options, log):
+    CheckOptionsCorrectness(options)
+    if not os.path.exists(options.calibration):
+        raise IgSimulatorError("Benchmark results for calibration of estimates (--calibration) were not found: " + options.calibration)
+    settings = {"chain_type": options.chain_type, "technology": options.technology, "compact_repertoire": options.compact_repertoire,
+                "compression": options.compression, "stream_reads": options.stream_reads, "skip_drawing": not options.draw_hist}
+    calibration = resource_estimator.SelectCalibration(resource_estimator.LoadBenchmarkResults(options.calibration), settings)
+    if calibration is None:
+        raise IgSimulatorError("No benchmark results of the binaries were found in " + options.calibration)
+    counts = resource_estimator.ExpectedCounts(calibration, settings, options.repertoire_size)
+    estimates = resource_estimator.EstimateStages(calibration, counts, EstimatedStages(options), options.num_threads)
+
+    log.info("\n==== Estimation of resources")
+    log.info("Calibration: " + ", ".join(calibration.fnames) + " (repertoire sizes " +
+             ", ".join([str(size) for size in calibration.RepertoireSizes()]) + ")")
+    mismatched = [name + " = " + (str(calibration.settings[name]) if calibration.settings[name] != "" else "none")
+                  for name in resource_estimator.calibration_settings
+                  if calibration.settings[name] != settings[name]]
+    if len(mismatched) != 0:
+        log.info("WARNING: benchmark results with the same settings were not found, estimates are based on runs with " + ", ".join(mismatched))
+    uncalibrated = calibration.UncalibratedStages(EstimatedStages(options))
+    if len(uncalibrated) != 0:
+        log.info("WARNING: wall time of " + ", ".join(uncalibrated) + " is zero in all benchmark runs (e.g. it was skipped), " +
+                 "resources of these stages are not estimated")
+    if options.repertoire_size > 10 * max(calibration.RepertoireSizes()):
+        log.info("WARNING: repertoire size is far beyond calibrated sizes, estimates are extrapolated")
+    log.info("Expected numbers: " + str(counts["sequences"]) + " sequences of the final repertoire, " +
+             str(counts["read_pairs"]) + " read pairs, " + str(counts["merged_reads"]) + " merged reads\n")
+    log.info("stage\t\t\t\twall, s\t\tpeak RSS, MB\toutput, MB")
+    for estimate in estimates:
+        log.info(estimate.stage_name.ljust(32) + ("%.1f" % estimate.wall_time_sec).ljust(16) +
+                 ("%.1f" % (estimate.peak_rss_kb / 1024.0) if estimate.peak_rss_kb is not None else "-").ljust(16) +
+                 "%.1f" % (estimate.output_bytes / 1048576.0))
+
+    stored_stages = [estimate.stage_name for estimate in estimates]
+    temporary_stages = list()
+    if options.stream_reads and not options.keep_reads:
+        stored_stages = [name for name in stored_stages if name not in ["read_simulation", "paired_read_merging"]]
+    if not KeepIntermediates(options):
+        # paired reads are removed after merging
+        stored_stages = [name for name in stored_stages if name != "read_simulation"]
+        temporary_stages.append("read_simulation")
+    if options.stream_reads or options.num_threads > 1 or options.compact_repertoire or options.compression != "" or options.seed != -1:
+        # ART chunks are stored until they are concatenated
+        temporary_stages.append("read_simulation")
+    stored_bytes, peak_bytes = resource_estimator.DiskFootprint(estimates, stored_stages, temporary_stages)
+    wall_time_sec = resource_estimator.TotalWallTime(estimates, options.stream_reads)
+    log.info("\nEstimated wall time:\t\t" + resource_estimator.FormatDuration(wall_time_sec) + " (" + str(int(round(wall_time_sec))) + " s)")
+    peak_rss = [estimate.peak_rss_kb for estimate in estimates if estimate.peak_rss_kb is not None]
+    if len(peak_rss) != 0:
+        log.info("Estimated peak RSS:\t\t" + "%.0f MB" % (max(peak_rss) / 1024.0))
+    log.info("Estimated disk usage:\t\t" + "%.0f MB (peak %.0f MB)" % (stored_bytes / 1048576.0, peak_bytes / 1048576.0))
+    if calibration.num_threads is not None and calibration.num_threads != options.num_threads:
+        log.info("Wall time of read simulation was scaled from " + str(calibration.num_threads) + " to " + str(options.num_threads) + " threads")
 
 # -------------------------- main -----------------------------------
 
@@ -518,6 +1739,44 @@ def ParseCommandLine(options, log):
             options_dict.num_mutated = 50
             options_dict.repertoire_size = 100
             options_dict.output_dir = 'ig_simulator_test/'
+        elif opt == '--threads':
+            options_dict.num_threads = int(arg)
+        elif opt == '--resume':
+            options_dict.resume = True
+        elif opt == '--compact-repertoire':
+            options_dict.compact_repertoire = True
+        elif opt == '--compress':
+            options_dict.compression = arg
+        elif opt == '--seed':
+            options_dict.seed = int(arg)
+        elif opt == '--stream':
+            options_dict.stream_reads = True
+        elif opt == '--keep-reads':
+            options_dict.keep_reads = True
+        elif opt == '--manifest':
+            options_dict.manifest = arg
+        elif opt == '--batch-memory':
+            options_dict.batch_memory_mb = int(arg)
+        elif opt == '--germline-cache':
+            options_dict.germline_cache_dir = os.path.abspath(arg)
+        elif opt == '--skip-germline-cache':
+            options_dict.germline_cache_dir = ""
+        elif opt == '--skip-ground-truth-db':
+            options_dict.build_ground_truth_db = False
+        elif opt == '--skip-read-index':
+            options_dict.build_read_index = False
+        elif opt == '--progress-interval':
+            options_dict.progress_interval = int(arg)
+        elif opt == '--progress-textfile':
+            options_dict.progress_textfile = os.path.abspath(arg)
+        elif opt == '--estimate':
+            options_dict.estimate = True
+        elif opt == '--calibration':
+            options_dict.calibration = os.path.abspath(arg)
+        elif opt == '--scratch-dir':
+            options_dict.scratch_dir = os.path.abspath(arg)
+        elif opt == '--retention':
+            options_dict.retention = arg
         elif opt == '--skip-drawing':
             options_dict.draw_hist = False
         elif opt == '--db-type':
@@ -527,23 +1786,6 @@ def ParseCommandLine(options, log):
             sys.exit(0)
     return options_dict
 
-def RunIgSimulator(options_dict, log):
-    log.info("\n======== IgSimulator starts")
-    # run repertoire simulator
-    RunRepertoireSimulation(options_dict, ig_tools_init.PathToBins.run_simulate_repertoire_tool, ig_tools_init.home_directory, log)
-    # run read simulator
-    RunReadSimulator(options_dict, log)
-    # splitting paired reads
-    #RunSplittingPairedFastq(options_dict, ig_tools_init.PathToBins.run_split_paired_fastq_reads_tool, log)
-    # merging splitted reads
-    RunPairedReadMerger(options_dict, ig_tools_init.PathToBins.run_paired_read_merger_tool, log)
-    # ideal repertoire construction
-    RunIdealRepertoireConstruction(options_dict, ig_tools_init.PathToBins.run_create_ideal_repertoire_tool, log)
-    # cleanup
-    #Cleanup(options_dict)
-    log.info("\n======== IgSimulator ends")
-    PrintMainOutputFiles(options_dict, log)
-
 def main():
     # prepare log
     log = logging.getLogger('ig_simulator')
@@ -553,10 +1795,14 @@ def main():
     console.setLevel(logging.DEBUG)
     log.addHandler(console)
 
-    CheckBinaries(log)
+    try:
+        CheckBinaries()
+    except IgSimulatorError:
+        log.info("ERROR: " + str(sys.exc_info()[1]))
+        sys.exit(1)
 
     # all options
-    all_long_options = list(set(BaseOptions.long_options + RepertoireSimulatorOptions.long_options))
+    all_long_options = list(set(BaseOptions.long_options + RepertoireSimulatorOptions.long_options + PairedReadMerger.long_options))
     all_short_options = BaseOptions.short_options + RepertoireSimulatorOptions.short_options
 
     # preparing command line arguments
@@ -575,31 +1821,44 @@ def main():
 
     # parsing input params
     options_dict = ParseCommandLine(options, log)
-    CheckOptionsCorrectness(options_dict, log)
+    if options_dict.estimate:
+        try:
+            EstimateResources(options_dict, log)
+        except IgSimulatorError:
+            log.info("ERROR: " + str(sys.exc_info()[1]))
+            sys.exit(1)
+        return
+    if options_dict.manifest != "":
+        RunBatchMode(options_dict, log)
+        return
 
-    # preparation of directory
+    # preparation of directory and log
     options_dict.output_dir = os.path.join(ig_tools_init.home_directory, options_dict.output_dir)
-    PrepareOutputDir(options_dict.output_dir)
-
-    # preparation log
-    log_filename = os.path.join(options_dict.output_dir, "ig_simulator.log")
-    if os.path.exists(log_filename):
-        os.remove(log_filename)
-    log_handler = logging.FileHandler(log_filename, mode='a')
-    log.addHandler(log_handler)
-    options_dict.log = log_filename
-    log.info("Log will be written to " + log_filename + "\n")
+    try:
+        simulator = IgSimulator(options_dict, log)
+    except IgSimulatorError:
+        _, exc, _ = sys.exc_info()
+        log.info("ERROR: " + str(exc))
+        if isinstance(exc, OptionsError):
+            usage(log)
+        sys.exit(1)
 
     # printing input params
     ig_tools_init.PrintCommandLine(sys.argv, log)
-    PrintOptions(options_dict, log)
+    PrintOptions(simulator.options, log)
 
     # run of simulator
     try:
-        RunIgSimulator(options_dict, log)
+        simulator.Run()
         log.info("\nThank you for using IgSimulator!")
     except (KeyboardInterrupt):
-        log.info("\nIgSimulator was interrupted!")  
+        log.info("\nIgSimulator was interrupted!")
+    except ToolFailedError:
+        ig_tools_init.AbnormalFinishMsg(log, sys.exc_info()[1].tool_name)
+        sys.exit(1)
+    except IgSimulatorError:
+        log.info("ERROR: " + str(sys.exc_info()[1]))
+        sys.exit(1)
     except BaseException:
         exc_type, exc_value, _ = sys.exc_info()
         if exc_type == SystemExit:
@@ -608,7 +1867,8 @@ def main():
             log.exception(exc_value)
             log.info("\nERROR: Exception caught. Please contact us and send .log file")
 
-    log.info("\nLog was written to " + log_filename)
+    log.info("\nLog was written to " + simulator.options.log)
+    simulator.Close()
 
 
 if __name__ == '__main__':
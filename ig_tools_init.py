@@ -13,7 +13,6 @@ import logging
 import shutil
 import datetime
 from time import gmtime, strftime
-from matplotlib.font_manager import home
 
 home_directory = os.path.abspath(os.path.dirname(os.path.realpath(__file__))) + '/'
 ig_bin_directory = os.path.join(home_directory, "bin/")
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Runs ig_simulator.py with all binaries replaced by stubs from stub_bins/:
+#   ig_simulator_launcher.py <ig_simulator.py options>
+
+import os
+import sys
+
+benchmark_directory = os.path.dirname(os.path.realpath(__file__))
+stub_bin_directory = os.path.join(benchmark_directory, "stub_bins")
+sys.path.insert(0, os.path.abspath(os.path.join(benchmark_directory, "../..")))
+
+import ig_tools_init
+
+def UseStubBinaries(path_to_bins):
+    for attr, tool in [("create_ideal_repertoire_tool", "ideal_repertoire_constructor"),
+                       ("paired_read_merger_tool", "paired_read_merger"),
+                       ("simulate_repertoire_tool", "ig_simulator"),
+                       ("art_illumina", "art_illumina"),
+                       ("art_454", "art_454")]:
+        setattr(path_to_bins, attr, os.path.join(stub_bin_directory, tool))
+        setattr(path_to_bins, "run_" + attr, os.path.join(stub_bin_directory, tool))
+
+UseStubBinaries(ig_tools_init.PathToBins)
+
+import ig_simulator
+
+if __name__ == '__main__':
+    ig_simulator.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Startup cost of ig_simulator.py: median wall time of fresh interpreters importing the
+# pipeline in headless mode and with plotting/Biopython modules, and heavy modules loaded.
+
+import os
+import sys
+import json
+import time
+import getopt
+import subprocess
+
+benchmark_directory = os.path.dirname(os.path.realpath(__file__))
+home_directory = os.path.abspath(os.path.join(benchmark_directory, "../.."))
+
+heavy_modules = ["matplotlib", "pylab", "numpy", "Bio"]
+
+import_prefix = "import sys; sys.path.insert(0, " + repr(home_directory) + "); "
+report_suffix = "; import json; print(json.dumps(sorted([m for m in " + repr(heavy_modules) + " if m in sys.modules])))"
+
+# scenario name -> python code run in a fresh interpreter
+scenarios = [
+    ("headless: import ig_simulator", import_prefix + "import ig_simulator" + report_suffix),
+    ("headless: ig_simulator.py --help", import_prefix + "sys.argv = ['ig_simulator.py', '--help']; import ig_simulator\n"
+                                         "try:\n    ig_simulator.main()\nexcept SystemExit:\n    pass\n" +
+                                         report_suffix[2:]),
+    ("plotting: import ig_simulator, drawing_utils, Bio.SeqIO",
+     import_prefix + "import ig_simulator, drawing_utils; from Bio import SeqIO" + report_suffix)]
+
+def usage():
+    print("./import_benchmark.py [--repeats N] [--python <interpreter>] [--output <filename.json>]")
+
+def MeasureScenario(python, code, repeats):
+    times = list()
+    loaded_modules = list()
+    for _ in range(repeats):
+        start_time = time.time()
+        output = subprocess.check_output([python, "-c", code], stderr = open(os.devnull, "w"))
+        times.append(time.time() - start_time)
+        loaded_modules = json.loads(output.decode("utf-8").strip().split("\n")[-1])
+    times.sort()
+    return {"median_sec": round(times[len(times) // 2], 4), "min_sec": round(times[0], 4),
+            "heavy_modules": loaded_modules}
+
+def main():
+    repeats = 11
+    python = sys.executable
+    output_fname = ""
+    try:
+        opts, _ = getopt.gnu_getopt(sys.argv, "", "repeats= python= output= help".split())
+    except getopt.GetoptError:
+        _, exc, _ = sys.exc_info()
+        sys.stderr.write(str(exc) + "\n")
+        usage()
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == "--repeats":
+            repeats = int(arg)
+        elif opt == "--python":
+            python = arg
+        elif opt == "--output":
+            output_fname = arg
+        elif opt == "--help":
+            usage()
+            sys.exit(0)
+
+    baseline = MeasureScenario(python, "import sys" + report_suffix, repeats)
+    results = {"interpreter_startup": baseline}
+    print("scenario\tmedian, s\tover bare interpreter, s\theavy modules")
+    print("bare interpreter\t%.4f\t0.0000\t" % baseline["median_sec"])
+    for name, code in scenarios:
+        results[name] = MeasureScenario(python, code, repeats)
+        print("%s\t%.4f\t%.4f\t%s" % (name, results[name]["median_sec"],
+                                      results[name]["median_sec"] - baseline["median_sec"],
+                                      ",".join(results[name]["heavy_modules"])))
+    if output_fname != "":
+        fhandler = open(output_fname, "w")
+        json.dump(results, fhandler, indent = 2, sort_keys = True)
+        fhandler.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Scaling benchmark of ig_simulator.py: runs the whole pipeline for a range of repertoire
+# sizes and reports throughput, peak memory and disk usage of every stage.
+
+import os
+import sys
+import json
+import getopt
+import subprocess
+import multiprocessing
+
+benchmark_directory = os.path.dirname(os.path.realpath(__file__))
+home_directory = os.path.abspath(os.path.join(benchmark_directory, "../.."))
+sys.path.append(os.path.join(home_directory, "src/python_utils"))
+
+import process_utils
+import repertoire_utils
+import compression_utils
+
+class BenchmarkOptions:
+    long_options = "sizes= stub chain-type= tech= threads= skip-drawing compact-repertoire compress= stream seed= compare= python= help".split()
+    short_options = "o:"
+
+    sizes = [100, 1000, 10000, 100000]
+    stub = False
+    chain_type = "HC"
+    technology = "illumina"
+    num_threads = 0
+    skip_drawing = False
+    compact_repertoire = False
+    compression = ""
+    stream_reads = False
+    # -1 - not specified
+    seed = -1
+    compare_fname = ""
+    python = sys.executable
+    output_dir = "ig_simulator_benchmark"
+
+# stage -> (output files, what is counted for throughput)
+stage_settings = {
+    # compiled germline database is stored outside of the run directory
+    "germline_cache": ([], "sequences"),
+    "repertoire_simulation": (["final_repertoire.fasta", "final_repertoire_compact.fasta", "base_sequences.fasta", "mutated_sequences.fasta",
+                               "base_frequencies.txt", "mutated_frequencies.txt", "shm_positions.txt", "shm_numbers.txt",
+                               "cdr_positions.txt", "repertoire_vdj_recombination.txt"], "sequences"),
+    "repertoire_stats_visualization": (["base_seq_lens.png", "base_seq_freqs.png", "mutated_seq_freqs.png",
+                                        "shm_positions.png", "shm_region_profile.png", "shm_stats.json", "repertoire_stats.json",
+                                        "repertoire_stats.html"], "sequences"),
+    "read_simulation": (["paired_reads1.fq", "paired_reads2.fq", "paired_reads1.aln", "paired_reads2.aln"], "read_pairs"),
+    "paired_read_merging": (["merged_reads.fastq"], "read_pairs"),
+    "ideal_repertoire_construction": (["ideal_repertoire.clusters.fa", "ideal_repertoire.rcm"], "merged_reads"),
+    "reads_vdj_recombination": (["reads_vdj_recombination.txt"], "merged_reads"),
+    "read_index": (["ideal_repertoire.idx"], "merged_reads"),
+    "ground_truth_db": (["ground_truth.sqlite"], "merged_reads")}
+
+stage_order = ["germline_cache", "repertoire_simulation", "repertoire_stats_visualization", "read_simulation",
+               "paired_read_merging", "ideal_repertoire_construction", "reads_vdj_recombination", "read_index",
+               "ground_truth_db"]
+
+def usage():
+    print("./run_benchmark.py [options] -o <output-dir>")
+    print("  -o\t\t\t<output_dir>\t\tdirectory for simulations and results [default: ig_simulator_benchmark]")
+    print("  --sizes\t\t<int,int,...>\t\trepertoire sizes to simulate [default: 100,1000,10000,100000]")
+    print("  --stub\t\t\t\t\treplaces all binaries by stubs from stub_bins/ to benchmark Python stages only")
+    print("  --chain-type\t\tHC or LC\t\tchain type [default: HC]")
+    print("  --tech\t\t<illumina/454>\t\tNGS technology for read simulation [default: illumina]")
+    print("  --threads\t\t<int>\t\t\tnumber of threads passed to ig_simulator.py [default: ig_simulator.py default]")
+    print("  --skip-drawing\t\t\t\tskips visualization of repertoire statistics")
+    print("  --compact-repertoire\t\t\t\tpasses --compact-repertoire to ig_simulator.py")
+    print("  --compress\t\tgzip or zstd\t\tpasses --compress to ig_simulator.py")
+    print("  --stream\t\t\t\t\tpasses --stream --keep-reads to ig_simulator.py (reads are kept to be counted)")
+    print("  --seed\t\t<int>\t\t\tpasses --seed to ig_simulator.py, so that runs are reproduced exactly")
+    print("  --compare\t\t<filename>\t\tbenchmark_results.json of a previous run to compare with")
+    print("  --python\t\t<filename>\t\tPython interpreter for ig_simulator.py [default: current interpreter]")
+
+def CountLines(fname, block_size = 1 << 20):
+    num_lines = 0
+    fhandler = compression_utils.OpenFile(fname, "rb")
+    block = fhandler.read(block_size)
+    while block:
+        num_lines += block.count(b"\n")
+        block = fhandler.read(block_size)
+    fhandler.close()
+    return num_lines
+
+def CountFastaRecords(fname):
+    num_records = 0
+    fhandler = compression_utils.OpenFile(fname, "r")
+    for line in fhandler:
+        if line.startswith(">"):
+            num_records += 1
+    fhandler.close()
+    return num_records
+
+def CurrentCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd = home_directory,
+                                       stderr = open(os.devnull, "w")).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def RepertoireParams(repertoire_size):
+    # the same proportions as in ig_simulator.py --test (10/50/100)
+    return max(1, repertoire_size // 10), max(2, repertoire_size // 2), repertoire_size
+
+def GetRunCommandLine(options, run_dir, repertoire_size):
+    num_bases, num_mutated, repertoire_size = RepertoireParams(repertoire_size)
+    script = os.path.join(home_directory, "ig_simulator.py")
+    if options.stub:
+        script = os.path.join(benchmark_directory, "ig_simulator_launcher.py")
+    command_line = options.python + " " + script + " -o " + run_dir + " --num-bases " + str(num_bases) + \
+                   " --num-mutated " + str(num_mutated) + " --repertoire-size " + str(repertoire_size) + \
+                   " --chain-type " + options.chain_type + " --tech " + options.technology
+    if options.num_threads > 0:
+        command_line += " --threads " + str(options.num_threads)
+    if options.skip_drawing:
+        command_line += " --skip-drawing"
+    if options.compact_repertoire:
+        command_line += " --compact-repertoire"
+    if options.compression != "":
+        command_line += " --compress " + options.compression
+    if options.stream_reads:
+        command_line += " --stream --keep-reads"
+    if options.seed != -1:
+        command_line += " --seed " + str(options.seed)
+    return command_line
+
+def MaxPeakRSS(values):
+    # peak RSS is None for processes that were too short to be sampled
+    values = [value for value in values if value is not None]
+    if len(values) == 0:
+        return None
+    return max(values)
+
+def AggregateStageMetrics(metrics_stages):
+    # ART chunks run in parallel: wall time is the longest chunk, CPU time and I/O are summed
+    stages = dict()
+    for record in metrics_stages:
+        name = record["stage"]
+        if name.startswith("read_simulation_chunk_"):
+            name = "read_simulation"
+        if name not in stages:
+            stages[name] = {"wall_time_sec": 0.0, "user_cpu_sec": 0.0, "sys_cpu_sec": 0.0,
+                            "peak_rss_kb": None, "read_bytes": 0, "write_bytes": 0}
+        stage = stages[name]
+        stage["wall_time_sec"] = max(stage["wall_time_sec"], record["wall_time_sec"])
+        stage["peak_rss_kb"] = MaxPeakRSS([stage["peak_rss_kb"], record["peak_rss_kb"]])
+        for key in ["user_cpu_sec", "sys_cpu_sec"]:
+            stage[key] += record[key]
+        for key, proc_key in [("read_bytes", "read_chars"), ("write_bytes", "write_chars")]:
+            stage[key] += record.get(proc_key, record.get(key, 0))
+    return stages
+
+def RunBenchmark(options, repertoire_size):
+    run_dir = os.path.join(options.output_dir, "repertoire_" + str(repertoire_size))
+    command_line = GetRunCommandLine(options, run_dir, repertoire_size)
+    print("Running " + command_line)
+    run_output = open(os.path.join(options.output_dir, "repertoire_" + str(repertoire_size) + ".out"), "w")
+    exit_code, usage = process_utils.RunCommand(command_line, lambda line: run_output.write(line + "\n"))
+    run_output.close()
+    if exit_code != 0:
+        print("ERROR: ig_simulator.py finished with code " + str(exit_code) + ", see " + run_output.name)
+        sys.exit(1)
+
+    def Artifact(fname):
+        # compressed version of the file if it exists (statistics and plots are not compressed)
+        compressed_fname = compression_utils.CompressedFname(os.path.join(run_dir, fname), options.compression)
+        if os.path.exists(compressed_fname):
+            return compressed_fname
+        return os.path.join(run_dir, fname)
+
+    if options.compact_repertoire:
+        num_sequences = repertoire_utils.CountRepertoireCopies(Artifact("final_repertoire_compact.fasta"))
+    else:
+        num_sequences = CountFastaRecords(Artifact("final_repertoire.fasta"))
+    counts = {"sequences": num_sequences,
+              "read_pairs": CountLines(Artifact("paired_reads1.fq")) // 4,
+              "merged_reads": CountLines(Artifact("merged_reads.fastq")) // 4}
+    stages = AggregateStageMetrics(json.load(open(os.path.join(run_dir, "run_metrics.json")))["stages"])
+    for name in stages:
+        output_fnames, count_name = stage_settings[name]
+        stage = stages[name]
+        stage["output_bytes"] = sum([os.path.getsize(fname) for fname in [Artifact(fname) for fname in output_fnames]
+                                     if os.path.exists(fname)])
+        stage["items"] = count_name
+        stage["items_per_sec"] = round(counts[count_name] / max(stage["wall_time_sec"], 1e-3), 1)
+    num_bases, num_mutated, repertoire_size = RepertoireParams(repertoire_size)
+    return {"repertoire_size": repertoire_size, "num_bases": num_bases, "num_mutated": num_mutated,
+            "counts": counts, "total_wall_time_sec": usage["wall_time_sec"],
+            "total_peak_rss_kb": MaxPeakRSS([usage["peak_rss_kb"]] + [stages[name]["peak_rss_kb"] for name in stages]),
+            "stages": stages}
+
+def PrintResults(results, previous_results):
+    previous = dict()
+    if previous_results is not None:
+        for run in previous_results["runs"]:
+            for name in run["stages"]:
+                previous[(run["repertoire_size"], name)] = run["stages"][name]["wall_time_sec"]
+    header = ["size", "stage", "wall, s", "items/s", "peak RSS, MB", "output, MB"]
+    if previous_results is not None:
+        header.append("wall vs " + previous_results["commit"][:8])
+    print("\t".join(header))
+    for run in results["runs"]:
+        for name in stage_order:
+            if name not in run["stages"]:
+                continue
+            stage = run["stages"][name]
+            row = [str(run["repertoire_size"]), name, "%.3f" % stage["wall_time_sec"],
+                   "%.1f %s" % (stage["items_per_sec"], stage["items"]),
+                   "%.1f" % (stage["peak_rss_kb"] / 1024.0) if stage["peak_rss_kb"] is not None else "-",
+                   "%.2f" % (stage["output_bytes"] / 1048576.0)]
+            key = (run["repertoire_size"], name)
+            if key in previous:
+                row.append("%.2fx" % (stage["wall_time_sec"] / max(previous[key], 1e-3)))
+            print("\t".join(row))
+
+def ParseCommandLine(argv):
+    options = BenchmarkOptions()
+    try:
+        opts, _ = getopt.gnu_getopt(argv, BenchmarkOptions.short_options, BenchmarkOptions.long_options)
+    except getopt.GetoptError:
+        _, exc, _ = sys.exc_info()
+        sys.stderr.write(str(exc) + "\n")
+        usage()
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == "-o":
+            options.output_dir = arg
+        elif opt == "--sizes":
+            options.sizes = [int(size) for size in arg.split(",")]
+        elif opt == "--stub":
+            options.stub = True
+        elif opt == "--chain-type":
+            options.chain_type = arg
+        elif opt == "--tech":
+            options.technology = arg
+        elif opt == "--threads":
+            options.num_threads = int(arg)
+        elif opt == "--skip-drawing":
+            options.skip_drawing = True
+        elif opt == "--compact-repertoire":
+            options.compact_repertoire = True
+        elif opt == "--compress":
+            options.compression = arg
+        elif opt == "--stream":
+            options.stream_reads = True
+        elif opt == "--seed":
+            options.seed = int(arg)
+        elif opt == "--compare":
+            options.compare_fname = arg
+        elif opt == "--python":
+            options.python = arg
+        elif opt == "--help":
+            usage()
+            sys.exit(0)
+    options.output_dir = os.path.abspath(options.output_dir)
+    return options
+
+def main():
+    options = ParseCommandLine(sys.argv)
+    if min(options.sizes) < 10:
+        print("ERROR: Repertoire sizes should be at least 10")
+        sys.exit(1)
+    if not os.path.exists(options.output_dir):
+        os.makedirs(options.output_dir)
+    previous_results = None
+    if options.compare_fname != "":
+        previous_results = json.load(open(options.compare_fname, "r"))
+
+    results = {"commit": CurrentCommit(), "stub": options.stub, "chain_type": options.chain_type,
+               "compact_repertoire": options.compact_repertoire, "compression": options.compression,
+               "stream_reads": options.stream_reads, "skip_drawing": options.skip_drawing, "seed": options.seed,
+               "technology": options.technology, "num_threads": options.num_threads if options.num_threads > 0 else multiprocessing.cpu_count(), "runs": list()}
+    for size in options.sizes:
+        results["runs"].append(RunBenchmark(options, size))
+    results_fname = os.path.join(options.output_dir, "benchmark_results.json")
+    fhandler = open(results_fname, "w")
+    json.dump(results, fhandler, indent = 2, sort_keys = True)
+    fhandler.close()
+
+    PrintResults(results, previous_results)
+    print("Benchmark results were written to " + results_fname)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Fast fake versions of ig_simulator, ART, paired_read_merger and ideal_repertoire_constructor.
+# They accept the same command lines and write files of the same formats and sizes
+# (one read pair per repertoire sequence), so Python stages of the pipeline can be
+# benchmarked without the real binaries.
+
+import sys
+import os
+import bisect
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_utils"))
+import germline_cache
+import files_utils
+
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+
+# relative boundaries of CDRs labeled by cdr_labeler.hpp
+cdr_relative_positions = {"HC": [.25, .3, .41, .54, .79, .86],
+                          "LC": [.23, .29, .41, .49, .77, .86]}
+
+def RandomSequence(rand, length):
+    return "".join([rand.choice("ACGT") for _ in range(length)])
+
+def ReadGeneNames(fasta_fname, gene_type):
+    # short names are stored in compiled germline database
+    if germline_cache.IsGermlineCache(fasta_fname):
+        database = germline_cache.GermlineDatabase(fasta_fname)
+        names = [gene.short_name for gene in database.Genes(gene_type)]
+        database.Close()
+        return names
+    names = list()
+    for line in open(fasta_fname, "r"):
+        if line.startswith(">"):
+            splits = line[1:].strip().split("|")
+            names.append(splits[1] if len(splits) > 1 else splits[0])
+    return names
+
+def PowerLawMultiplicities(rand, num_clusters, total_size):
+    # every cluster gets one copy, the rest are distributed proportionally to Pareto weights
+    multiplicities = [1] * num_clusters
+    cumulative_weights = list()
+    total_weight = 0.0
+    for _ in range(num_clusters):
+        total_weight += rand.paretovariate(1.5)
+        cumulative_weights.append(total_weight)
+    for _ in range(max(0, total_size - num_clusters)):
+        ind = bisect.bisect_left(cumulative_weights, rand.random() * total_weight)
+        multiplicities[min(ind, num_clusters - 1)] += 1
+    return multiplicities
+
+def WriteFasta(fname, names, sequences):
+    fhandler = open(fname, "w")
+    for name, seq in zip(names, sequences):
+        fhandler.write(">" + name + "\n" + seq + "\n")
+    fhandler.close()
+
+def WriteList(fname, values):
+    fhandler = open(fname, "w")
+    for value in values:
+        fhandler.write(str(value) + "\n")
+    fhandler.close()
+
+def IgSimulator(argv):
+    # ig_simulator HC output_dir base mutated final V.fa D.fa J.fa db_type [compact] [seed=N]
+    # ig_simulator LC output_dir base mutated final V.fa J.fa db_type [compact] [seed=N]
+    seed = 1
+    compact = False
+    while argv[-1] == "compact" or argv[-1].startswith("seed="):
+        if argv[-1] == "compact":
+            compact = True
+        else:
+            seed = int(argv[-1][len("seed="):])
+        argv = argv[:-1]
+    rand = random.Random(seed)
+    chain_type = argv[1]
+    output_dir = argv[2]
+    num_bases, num_mutated, final_size = int(argv[3]), int(argv[4]), int(argv[5])
+    gene_fnames = argv[6:-1]
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    gene_types = ["V", "D", "J"] if chain_type == "HC" else ["V", "J"]
+    gene_names = [ReadGeneNames(fname, gene_type) for fname, gene_type in zip(gene_fnames, gene_types)]
+
+    base_seqs = [RandomSequence(rand, rand.randint(340, 400)) for _ in range(num_bases)]
+    base_vdj = [";".join([rand.choice(names) for names in gene_names]) for _ in range(num_bases)]
+    base_mults = PowerLawMultiplicities(rand, num_bases, num_mutated)
+    WriteFasta(os.path.join(output_dir, "base_sequences.fasta"),
+               ["antibody_" + str(i + 1) for i in range(num_bases)], base_seqs)
+    WriteList(os.path.join(output_dir, "base_frequencies.txt"), base_mults)
+
+    mutated_seqs = list()
+    mutated_vdj = list()
+    shm_positions = list()
+    shm_numbers = list()
+    cdr_positions = list()
+    for i in range(num_bases):
+        for _ in range(base_mults[i]):
+            seq = list(base_seqs[i])
+            positions = sorted(rand.sample(range(len(seq)), rand.randint(0, 8)))
+            for pos in positions:
+                seq[pos] = rand.choice("ACGT")
+                shm_positions.append(str(pos) + "\t" + str(len(seq)))
+            shm_numbers.append(len(positions))
+            cdr_positions.append("\t".join([str(int(len(seq) * boundary)) for boundary in cdr_relative_positions[chain_type]] +
+                                           [str(len(seq))]))
+            mutated_seqs.append("".join(seq))
+            mutated_vdj.append(base_vdj[i])
+    mutated_mults = PowerLawMultiplicities(rand, len(mutated_seqs), final_size)
+    WriteFasta(os.path.join(output_dir, "mutated_sequences.fasta"),
+               ["antibody_" + str(i + 1) for i in range(len(mutated_seqs))], mutated_seqs)
+    WriteList(os.path.join(output_dir, "mutated_frequencies.txt"), mutated_mults)
+    WriteList(os.path.join(output_dir, "shm_positions.txt"), shm_positions)
+    WriteList(os.path.join(output_dir, "shm_numbers.txt"), shm_numbers)
+    WriteList(os.path.join(output_dir, "cdr_positions.txt"), cdr_positions)
+    WriteList(os.path.join(output_dir, "repertoire_vdj_recombination.txt"),
+              ["antibody_" + str(i + 1) + "\t" + mutated_vdj[i] for i in range(len(mutated_vdj))])
+
+    if compact:
+        WriteFasta(os.path.join(output_dir, "final_repertoire_compact.fasta"),
+                   ["antibody_" + str(i + 1) + "_multiplicity_" + str(mutated_mults[i]) for i in range(len(mutated_seqs))],
+                   mutated_seqs)
+    else:
+        fhandler = open(os.path.join(output_dir, "final_repertoire.fasta"), "w")
+        for i in range(len(mutated_seqs)):
+            for copy in range(mutated_mults[i]):
+                fhandler.write(">antibody_" + str(i + 1) + "_multiplicity_" + str(mutated_mults[i]) +
+                               "_copy_" + str(copy + 1) + "\n" + mutated_seqs[i] + "\n")
+        fhandler.close()
+    print("Stub repertoire of " + str(sum(mutated_mults)) + " sequences was written to " + output_dir)
+
+def ReadFasta(fname):
+    name = None
+    seq = list()
+    for line in open(fname, "r"):
+        line = line.strip()
+        if line.startswith(">"):
+            if name is not None:
+                yield name, "".join(seq)
+            name = line[1:]
+            seq = list()
+        else:
+            seq.append(line)
+    if name is not None:
+        yield name, "".join(seq)
+
+def ReadFastq(fname):
+    fhandler = open(fname, "r")
+    while True:
+        name = fhandler.readline().strip()
+        if not name:
+            break
+        seq = fhandler.readline().strip()
+        fhandler.readline()
+        qual = fhandler.readline().strip()
+        yield name[1:], seq, qual
+    fhandler.close()
+
+def Art(input_fasta, output_prefix, read_length = 250):
+    left_writer = files_utils.FastqWriter(output_prefix + "1.fq")
+    right_writer = files_utils.FastqWriter(output_prefix + "2.fq")
+    num_pairs = 0
+    for name, seq in ReadFasta(input_fasta):
+        left = seq[:read_length]
+        right = seq[-read_length:]
+        left_writer.Write(name + "-1/1", left, "I" * len(left))
+        right_writer.Write(name + "-1/2", right, "I" * len(right), reverse = True)
+        num_pairs += 1
+    left_writer.Close()
+    right_writer.Close()
+    print(str(num_pairs) + " stub read pairs were written to " + output_prefix + "1.fq and " + output_prefix + "2.fq")
+
+def ArtIllumina(argv):
+    # art_illumina -i input.fa -p -l 250 -f 1 -m 350 -s 50 -o prefix [-rs seed]
+    Art(argv[argv.index("-i") + 1], argv[argv.index("-o") + 1])
+
+def Art454(argv):
+    # art_454 [-r seed] input.fa prefix fold_coverage [mean_frag_len std_dev]
+    positional = list()
+    i = 1
+    while i < len(argv):
+        if argv[i] in ["-r", "-p", "-c"]:
+            i += 2
+            continue
+        if not argv[i].startswith("-"):
+            positional.append(argv[i])
+        i += 1
+    Art(positional[0], positional[1])
+
+def PairedReadMerger(argv):
+    # paired_read_merger left.fq right.fq output_prefix --min-overlap=N --max-mismatch=F
+    left_fname, right_fname, output_prefix = argv[1], argv[2], argv[3]
+    merged_writer = files_utils.FastqWriter(output_prefix + ".fastq")
+    num_merged = 0
+    for left, right in zip(ReadFastq(left_fname), ReadFastq(right_fname)):
+        right_seq = files_utils.ReverseComplement(right[1])
+        overlap = max(0, len(left[1]) + len(right_seq) - 400)
+        seq = left[1] + right_seq[overlap:]
+        qual = left[2] + right[2][::-1][overlap:]
+        merged_writer.Write(str(num_merged) + "_merged_read_" + left[0], seq, qual)
+        num_merged += 1
+    merged_writer.Close()
+    print(str(num_merged) + " read from " + str(num_merged) + " were successfully merged")
+
+def IdealRepertoireConstructor(argv):
+    # ideal_repertoire_constructor merged_reads.fastq output_prefix
+    merged_fname, output_prefix = argv[1], argv[2]
+    cluster_ids = dict()
+    cluster_seqs = list()
+    cluster_sizes = list()
+    rcm_fhandler = open(output_prefix + ".rcm", "w")
+    for name, seq, _ in ReadFastq(merged_fname):
+        antibody = name.split("_")[4]
+        if antibody not in cluster_ids:
+            cluster_ids[antibody] = len(cluster_seqs) + 1
+            cluster_seqs.append(seq)
+            cluster_sizes.append(0)
+        cluster_id = cluster_ids[antibody]
+        cluster_sizes[cluster_id - 1] += 1
+        rcm_fhandler.write(name + "\t" + str(cluster_id) + "\n")
+    rcm_fhandler.close()
+    WriteFasta(output_prefix + ".clusters.fa",
+               ["cluster___" + str(i + 1) + "___size___" + str(cluster_sizes[i]) for i in range(len(cluster_seqs))],
+               cluster_seqs)
+    print(str(sum(cluster_sizes)) + " reads were extracted from " + merged_fname)
+
+stub_tools = {"ig_simulator": IgSimulator,
+              "art_illumina": ArtIllumina,
+              "art_454": Art454,
+              "paired_read_merger": PairedReadMerger,
+              "ideal_repertoire_constructor": IdealRepertoireConstructor}
+
+def main(tool_name):
+    stub_tools[tool_name](sys.argv)
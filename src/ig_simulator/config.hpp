@@ -77,8 +77,15 @@ struct OutputParams {
     string mutated_sequence_fname;
     string mutated_multiplicity_fname;
     string mutated_positions;
+    // number of SHMs of every mutated sequence, SHMs of consecutive sequences follow each other in mutated_positions
+    string mutated_shm_numbers;
+    // CDR1, CDR2 and CDR3 of every mutated sequence: start and end (exclusive) of each CDR and length of the sequence
+    string mutated_cdr_positions;
     string final_repertoire_fname;
+    string compact_repertoire_fname;
     string vdj_recombination_fname;
+    // if true, every sequence of the final repertoire is written once with its multiplicity
+    bool compact_repertoire;
 
     OutputParams() :
             base_sequence_fname(),
@@ -86,23 +93,34 @@ struct OutputParams {
             mutated_sequence_fname(),
             mutated_multiplicity_fname(),
             mutated_positions(),
+            mutated_shm_numbers(),
+            mutated_cdr_positions(),
             final_repertoire_fname(),
-            vdj_recombination_fname() { }
+            compact_repertoire_fname(),
+            vdj_recombination_fname(),
+            compact_repertoire(false) { }
 
     OutputParams(string base_sequence_fname,
         string base_multiplicity_fname,
         string mutated_sequence_fname,
         string mutated_multiplicity_fname,
         string mutated_positions,
+        string mutated_shm_numbers,
+        string mutated_cdr_positions,
         string final_repertoire_fname,
+        string compact_repertoire_fname,
         string vdj_recombination_fname) :
             base_sequence_fname(base_sequence_fname),
             base_multiplicity_fname(base_multiplicity_fname),
             mutated_sequence_fname(mutated_sequence_fname),
             mutated_multiplicity_fname(mutated_multiplicity_fname),
             mutated_positions(mutated_positions),
+            mutated_shm_numbers(mutated_shm_numbers),
+            mutated_cdr_positions(mutated_cdr_positions),
             final_repertoire_fname(final_repertoire_fname),
-            vdj_recombination_fname(vdj_recombination_fname) { }
+            compact_repertoire_fname(compact_repertoire_fname),
+            vdj_recombination_fname(vdj_recombination_fname),
+            compact_repertoire(false) { }
 
     static OutputParams CreateStandardParams() {
         return OutputParams("base_sequences.fasta",
@@ -110,7 +128,10 @@ struct OutputParams {
                             "mutated_sequences.fasta",
                             "mutated_frequencies.txt",
                             "shm_positions.txt",
+                            "shm_numbers.txt",
+                            "cdr_positions.txt",
                             "final_repertoire.fasta",
+                            "final_repertoire_compact.fasta",
                             "repertoire_vdj_recombination.txt");
     }
 
@@ -120,7 +141,10 @@ struct OutputParams {
         mutated_sequence_fname = prefix + mutated_sequence_fname;
         mutated_multiplicity_fname = prefix + mutated_multiplicity_fname;
         mutated_positions = prefix + mutated_positions;
+        mutated_shm_numbers = prefix + mutated_shm_numbers;
+        mutated_cdr_positions = prefix + mutated_cdr_positions;
         final_repertoire_fname = prefix + final_repertoire_fname;
+        compact_repertoire_fname = prefix + compact_repertoire_fname;
         vdj_recombination_fname = prefix + vdj_recombination_fname;
     }
 };
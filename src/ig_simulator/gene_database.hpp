@@ -3,6 +3,7 @@
 #include "include_me.hpp"
 #include "../utils/fasta_reader.hpp"
 #include "../utils/string_tools.hpp"
+#include "germline_cache.hpp"
 
 
 enum IgGeneType {variable_gene, diversity_gene, join_gene};
@@ -89,12 +90,24 @@ public:
             gene_name_extractor_ptr_(gene_name_extractor_ptr) { }
 
     void AddGenesFromFile(string filename) {
+        if(IsGermlineCache(filename)) {
+            AddGenesFromCache(filename);
+            return;
+        }
         SingleFastaReader fasta_reader(filename);
         auto reads = fasta_reader.Read();
         for(auto read = reads.begin(); read != reads.end(); read++)
             ig_genes_.push_back(IgGene(read->name, gene_name_extractor_ptr_->ExtractShortName(read->name), read->seq));
     }
 
+    // short names are precomputed in the cache
+    void AddGenesFromCache(string filename) {
+        GermlineCache cache(filename);
+        auto genes = cache.Genes(gene_type_);
+        for(auto gene = genes.begin(); gene != genes.end(); gene++)
+            ig_genes_.push_back(IgGene(gene->name, gene->short_name, gene->seq));
+    }
+
     void Print(ostream &out) const {
         out << "Ig genes database. Gene type: " << IgGeneTypeToString(gene_type_) <<
                 ". # records: " << ig_genes_.size() << endl;
@@ -0,0 +1,100 @@
+#pragma once
+
+#include "include_me.hpp"
+#include <fcntl.h>
+#include <string.h>
+#include <stdint.h>
+#include <sys/mman.h>
+
+/*
+ * Indexed germline database compiled by src/python_utils/germline_cache.py (see layout there).
+ * File is memory-mapped, so genes are loaded without parsing FASTA and extracting short names.
+ * Numbers are little-endian, as on all supported platforms.
+ */
+
+const string germline_cache_magic = "IGGERMDB";
+const uint32_t germline_cache_version = 1;
+
+struct GermlineCacheGene {
+    string name;
+    string short_name;
+    string seq;
+    uint32_t functionality;
+};
+
+bool IsGermlineCache(string filename) {
+    ifstream in(filename.c_str(), ios::binary);
+    char prefix[8];
+    in.read(prefix, 8);
+    return in.gcount() == 8 && string(prefix, 8) == germline_cache_magic;
+}
+
+class GermlineCache {
+    int fd_;
+    const char *data_;
+    size_t size_;
+
+    template<typename T>
+    T ReadNumber(size_t offset) const {
+        assert(offset + sizeof(T) <= size_);
+        T value;
+        memcpy(&value, data_ + offset, sizeof(T));
+        return value;
+    }
+
+    string ReadString(size_t record_offset) const {
+        uint64_t offset = ReadNumber<uint64_t>(record_offset);
+        uint32_t length = ReadNumber<uint32_t>(record_offset + 8);
+        assert(offset + length <= size_);
+        return string(data_ + offset, length);
+    }
+
+public:
+    GermlineCache(string filename) : fd_(-1), data_(NULL), size_(0) {
+        fd_ = open(filename.c_str(), O_RDONLY);
+        if(fd_ == -1) {
+            cout << "Germline cache " << filename << " was not found" << endl;
+            assert(fd_ != -1);
+        }
+        struct stat st;
+        fstat(fd_, &st);
+        size_ = st.st_size;
+        void *data = mmap(NULL, size_, PROT_READ, MAP_PRIVATE, fd_, 0);
+        assert(data != MAP_FAILED);
+        data_ = static_cast<const char*>(data);
+        assert(size_ >= 20 && string(data_, 8) == germline_cache_magic);
+        assert(ReadNumber<uint32_t>(8) == germline_cache_version);
+    }
+
+    // header: magic, version, database type, number of gene sets (uint32 each)
+    // gene set: gene type, number of genes (uint32), offset of records (uint64)
+    // gene record: name, short name, sequence (uint64 offset + uint32 length each), functionality (uint32)
+    vector<GermlineCacheGene> Genes(size_t gene_type) const {
+        vector<GermlineCacheGene> genes;
+        uint32_t num_sets = ReadNumber<uint32_t>(16);
+        for(size_t i = 0; i < num_sets; i++) {
+            size_t set_offset = 20 + i * 16;
+            if(ReadNumber<uint32_t>(set_offset) != gene_type)
+                continue;
+            uint32_t num_genes = ReadNumber<uint32_t>(set_offset + 4);
+            uint64_t records_offset = ReadNumber<uint64_t>(set_offset + 8);
+            for(size_t j = 0; j < num_genes; j++) {
+                size_t record_offset = records_offset + j * 40;
+                GermlineCacheGene gene;
+                gene.name = ReadString(record_offset);
+                gene.short_name = ReadString(record_offset + 12);
+                gene.seq = ReadString(record_offset + 24);
+                gene.functionality = ReadNumber<uint32_t>(record_offset + 36);
+                genes.push_back(gene);
+            }
+        }
+        return genes;
+    }
+
+    ~GermlineCache() {
+        if(data_ != NULL)
+            munmap(const_cast<char*>(data_), size_);
+        if(fd_ != -1)
+            close(fd_);
+    }
+};
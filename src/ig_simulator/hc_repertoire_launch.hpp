@@ -137,18 +137,29 @@ void CreateHCRepertoire(HC_InputParams params) {
             " sequences with total multiplicities " << mutated_repertoire->NumberAntibodies() << endl;
     mutated_repertoire->OutputSequences(params.output_params.mutated_sequence_fname);
     mutated_repertoire->OutputMultiplicities(params.output_params.mutated_multiplicity_fname);
-    mutated_repertoire->OutputSHMPositions(params.output_params.mutated_positions);
+    mutated_repertoire->OutputSHMPositions(params.output_params.mutated_positions,
+                                           params.output_params.mutated_shm_numbers);
     cout << "Mutated antibody sequences were written to " << params.output_params.mutated_sequence_fname << endl;
     cout << "Mutated antibody multiplicities were written to " <<
             params.output_params.mutated_multiplicity_fname << endl;
     cout << "Positions of SHM were written to " << params.output_params.mutated_positions << endl;
+    cout << "Numbers of SHM were written to " << params.output_params.mutated_shm_numbers << endl;
+    mutated_repertoire->OutputCDRPositions(params.output_params.mutated_cdr_positions);
+    cout << "Positions of CDRs were written to " << params.output_params.mutated_cdr_positions << endl;
     mutated_repertoire->OutputVDJRecombination(params.output_params.vdj_recombination_fname);
     cout << "VDJ recombination of the final repertoire was written to " <<
     params.output_params.vdj_recombination_fname << endl;
     cout << endl;
 
-    mutated_repertoire->OutputRepertoire(params.output_params.final_repertoire_fname);
-    cout << "Final repertoire was written to " << params.output_params.final_repertoire_fname << endl << endl;
+    if(params.output_params.compact_repertoire) {
+        mutated_repertoire->OutputCompactRepertoire(params.output_params.compact_repertoire_fname);
+        cout << "Final repertoire was written to " << params.output_params.compact_repertoire_fname <<
+                " (compact format)" << endl << endl;
+    }
+    else {
+        mutated_repertoire->OutputRepertoire(params.output_params.final_repertoire_fname);
+        cout << "Final repertoire was written to " << params.output_params.final_repertoire_fname << endl << endl;
+    }
 
     cout << "======== Simulation of heavy chain repertoire ends" << endl;
 }
\ No newline at end of file
@@ -4,18 +4,21 @@
 
 
 /*
- * ./ig_simulator HC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Dgene.fa Jgene.fa
- * ./ig_simulator LC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Jgene.fa
+ * ./ig_simulator HC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Dgene.fa Jgene.fa db_type [compact] [seed=N]
+ * ./ig_simulator LC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Jgene.fa db_type [compact] [seed=N]
+ * compact: every sequence of the final repertoire is written once with its multiplicity
+ * seed=N: seed of the random generator (otherwise rand() is used unseeded)
+ * germline cache compiled by germline_cache.py can be given instead of every FASTA file of genes
  */
 
 void HCUsage() {
     cout << "Usage for simulation heavy chain repertoire:" << endl;
-    cout << "./ig_simulator HC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Dgene.fa Jgene.fa" << endl;
+    cout << "./ig_simulator HC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Dgene.fa Jgene.fa db_type [compact] [seed=N]" << endl;
 }
 
 void LCUsage() {
     cout << "Usage for simulation light chain repertoire:" << endl;
-    cout << "./ig_simulator LC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Jgene.fa" << endl;
+    cout << "./ig_simulator LC output_dir base_rep_size mutated_rep_size final_rep_size Vgene.fa Jgene.fa db_type [compact] [seed=N]" << endl;
 }
 
 void Usage() {
@@ -41,6 +44,35 @@ void PrepareOutputDir(string output_dir) {
     }
 }
 
+const string compact_repertoire_arg = "compact";
+const string seed_arg_prefix = "seed=";
+
+struct OptionalParams {
+    bool compact_repertoire;
+    bool seed_specified;
+    unsigned seed;
+
+    OptionalParams() : compact_repertoire(false), seed_specified(false), seed(0) { }
+};
+
+// optional parameters follow the required ones in any order
+bool ParseOptionalParams(int argc, char* argv[], int num_params, OptionalParams &params) {
+    if(argc < num_params)
+        return false;
+    for(int i = num_params; i < argc; i++) {
+        string arg = string(argv[i]);
+        if(arg == compact_repertoire_arg)
+            params.compact_repertoire = true;
+        else if(arg.substr(0, seed_arg_prefix.size()) == seed_arg_prefix && arg.size() > seed_arg_prefix.size()) {
+            params.seed_specified = true;
+            params.seed = StringToType<unsigned>(arg.substr(seed_arg_prefix.size()));
+        }
+        else
+            return false;
+    }
+    return true;
+}
+
 struct HCParamsIndices {
     static const int output_dir_ind = 2;
     static const int base_size_ind = 3;
@@ -59,7 +91,7 @@ DatabaseType ParseDatabaseType(string database_type_str) {
     return regular_db;
 }
 
-HC_InputParams ParseHCInputParams(int argc, char* argv[]) {
+HC_InputParams ParseHCInputParams(char* argv[], const OptionalParams &optional_params) {
     HC_InputParams input_params;
     input_params.output_dir = string(argv[HCParamsIndices::output_dir_ind]);
     if(input_params.output_dir[input_params.output_dir.size() - 1] != '/')
@@ -77,6 +109,7 @@ HC_InputParams ParseHCInputParams(int argc, char* argv[]) {
 
     input_params.output_params = OutputParams::CreateStandardParams();
     input_params.output_params.AddPrefix(input_params.output_dir);
+    input_params.output_params.compact_repertoire = optional_params.compact_repertoire;
 
     input_params.pattern_shm_params = PatternSHMParams::CreateStandardParams();
     input_params.cdr_shm_params = CDR_SHMParams::CreateStandardParams();
@@ -94,7 +127,7 @@ struct LCParamsIndices {
     static const int num_params = 9;
 };
 
-LC_InputParams ParseLCInputParams(int argc, char* argv[]) {
+LC_InputParams ParseLCInputParams(char* argv[], const OptionalParams &optional_params) {
     LC_InputParams input_params;
     input_params.output_dir = string(argv[LCParamsIndices::output_dir_ind]);
     if(input_params.output_dir[input_params.output_dir.size() - 1] != '/')
@@ -111,6 +144,7 @@ LC_InputParams ParseLCInputParams(int argc, char* argv[]) {
 
     input_params.output_params = OutputParams::CreateStandardParams();
     input_params.output_params.AddPrefix(input_params.output_dir);
+    input_params.output_params.compact_repertoire = optional_params.compact_repertoire;
 
     input_params.pattern_shm_params = PatternSHMParams::CreateStandardParams();
     input_params.cdr_shm_params = CDR_SHMParams::CreateStandardParams();
@@ -136,22 +170,27 @@ int main(int argc, char *argv[]) {
     PrepareOutputDir(output_dir);
     cout << "Repertoire and statistics will written be to " << output_dir << endl << endl;
 
+    OptionalParams optional_params;
     if(chain_type == Heavy_chain) {
-        if(argc != HCParamsIndices::num_params) {
+        if(!ParseOptionalParams(argc, argv, HCParamsIndices::num_params, optional_params)) {
             cout << "ERROR: Invalid number of input parameters" << endl;
             HCUsage();
             return 1;
         }
-        HC_InputParams input_params = ParseHCInputParams(argc, argv);
+        if(optional_params.seed_specified)
+            srand(optional_params.seed);
+        HC_InputParams input_params = ParseHCInputParams(argv, optional_params);
         CreateHCRepertoire(input_params);
     }
     else {
-        if(argc != LCParamsIndices::num_params) {
+        if(!ParseOptionalParams(argc, argv, LCParamsIndices::num_params, optional_params)) {
             cout << "ERROR: Invalid number of input parameters" << endl;
             LCUsage();
             return 1;
         }
-        LC_InputParams input_params = ParseLCInputParams(argc, argv);
+        if(optional_params.seed_specified)
+            srand(optional_params.seed);
+        LC_InputParams input_params = ParseLCInputParams(argv, optional_params);
         CreateLCRepertoire(input_params);
     }
 }
\ No newline at end of file
@@ -175,6 +175,17 @@ public:
         out.close();
     }
 
+    void OutputCompactRepertoire(string output_fname) const {
+        ofstream out(output_fname.c_str());
+        size_t id = 1;
+        for(auto it = begin(); it != end(); it++) {
+            out << ">antibody_" << id << "_multiplicity_" << it->Multiplicity() << endl;
+            out << it->Sequence() << endl;
+            id++;
+        }
+        out.close();
+    }
+
     void OutputVDJRecombination(string output_fname) const {
         ofstream out(output_fname.c_str());
         size_t id = 1;
@@ -193,18 +204,33 @@ public:
         out.close();
     }
 
-    void OutputSHMPositions(string output_fname) const {
+    void OutputSHMPositions(string output_fname, string numbers_fname) const {
         ofstream out(output_fname.c_str());
+        ofstream numbers_out(numbers_fname.c_str());
         for(auto it = begin(); it != end(); it++) {
             auto shm_settings = it->IgVariableRegion()->GetSHMSettings();
             size_t seq_length = it->Sequence().size();
+            size_t num_shms = 0;
             for(auto shm = shm_settings.begin(); shm != shm_settings.end(); shm++) {
                 if(shm->first > seq_length)
                     continue;
                 out << shm->first << "\t" << seq_length << endl;
+                num_shms++;
             }
+            numbers_out << num_shms << endl;
+        }
+    }
 
+    void OutputCDRPositions(string output_fname) const {
+        ofstream out(output_fname.c_str());
+        for(auto it = begin(); it != end(); it++) {
+            const CDRSettings &cdr_settings = it->IgVariableRegion()->GetCDRSettings();
+            out << cdr_settings.CDR1().Start() << "\t" << cdr_settings.CDR1().End() << "\t" <<
+                    cdr_settings.CDR2().Start() << "\t" << cdr_settings.CDR2().End() << "\t" <<
+                    cdr_settings.CDR3().Start() << "\t" << cdr_settings.CDR3().End() << "\t" <<
+                    it->Sequence().size() << endl;
         }
+        out.close();
     }
 };
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Jobs of a batch run concurrently in threads (heavy work is done by binaries they launch)
+# under a common budget of threads and memory. A job starts when all jobs it depends on
+# have finished successfully; jobs depending on failed ones are skipped.
+
+import sys
+import time
+import threading
+
+class BatchJob:
+    def __init__(self, name, function, num_threads, memory_mb, dependencies = []):
+        self.name = name
+        self.function = function
+        self.num_threads = num_threads
+        self.memory_mb = memory_mb
+        self.dependencies = dependencies
+        # pending, running, done, failed or skipped
+        self.status = "pending"
+        self.error = None
+        self.wall_time_sec = 0.0
+
+class BatchScheduler:
+    def __init__(self, max_threads, max_memory_mb, log_function):
+        # max_memory_mb = 0 means unlimited memory
+        self.max_threads = max_threads
+        self.max_memory_mb = max_memory_mb
+        self.log_function = log_function
+        self.condition = threading.Condition()
+        self.used_threads = 0
+        self.used_memory_mb = 0
+        self.num_running = 0
+
+    def Fits(self, job):
+        # a job larger than the whole budget runs alone
+        if self.num_running == 0:
+            return True
+        if self.used_threads + job.num_threads > self.max_threads:
+            return False
+        return self.max_memory_mb == 0 or self.used_memory_mb + job.memory_mb <= self.max_memory_mb
+
+    def RunJob(self, job):
+        start_time = time.time()
+        try:
+            job.function()
+            job.status = "done"
+        except Exception:
+            job.error = str(sys.exc_info()[1])
+            job.status = "failed"
+        job.wall_time_sec = round(time.time() - start_time, 3)
+        self.condition.acquire()
+        self.used_threads -= job.num_threads
+        self.used_memory_mb -= job.memory_mb
+        self.num_running -= 1
+        self.condition.notify()
+        self.condition.release()
+        if job.status == "done":
+            self.log_function("Job " + job.name + " finished in " + str(job.wall_time_sec) + " sec")
+        else:
+            self.log_function("Job " + job.name + " failed: " + job.error)
+
+    def Start(self, job):
+        job.status = "running"
+        self.used_threads += job.num_threads
+        self.used_memory_mb += job.memory_mb
+        self.num_running += 1
+        self.log_function("Job " + job.name + " started (" + str(job.num_threads) + " threads, " + str(job.memory_mb) + " MB)")
+        thread = threading.Thread(target = self.RunJob, args = (job,))
+        thread.daemon = True
+        thread.start()
+
+    def Run(self, jobs):
+        # jobs should be listed after the jobs they depend on
+        pending = list(jobs)
+        self.condition.acquire()
+        try:
+            while len(pending) != 0 or self.num_running != 0:
+                for job in list(pending):
+                    if any([dependency.status in ["failed", "skipped"] for dependency in job.dependencies]):
+                        job.status = "skipped"
+                        pending.remove(job)
+                        self.log_function("Job " + job.name + " was skipped since the jobs it depends on failed")
+                    elif all([dependency.status == "done" for dependency in job.dependencies]) and self.Fits(job):
+                        pending.remove(job)
+                        self.Start(job)
+                if len(pending) != 0 or self.num_running != 0:
+                    # timeout keeps the main thread responsive to KeyboardInterrupt
+                    self.condition.wait(1.0)
+        finally:
+            self.condition.release()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Readers of whitespace-separated numeric tables (base_frequencies.txt, shm_positions.txt, etc.)
+# that parse data directly into typed NumPy arrays, block by block.
+
+import numpy
+
+import compression_utils
+
+default_block_size = 16 << 20
+
+def IterateColumnChunks(filename, num_columns, dtype = numpy.int64, block_size = default_block_size):
+    # yields 2D arrays (rows x num_columns) for consecutive blocks of the file
+    fhandler = compression_utils.OpenFile(filename, "rb")
+    tail = b""
+    while True:
+        block = fhandler.read(block_size)
+        if not block:
+            break
+        block = tail + block
+        last_newline = block.rfind(b"\n")
+        if last_newline == -1:
+            tail = block
+            continue
+        tail = block[last_newline + 1:]
+        chunk = ParseColumns(block[:last_newline + 1], num_columns, dtype, filename)
+        if len(chunk) != 0:
+            yield chunk
+    fhandler.close()
+    if tail.strip():
+        yield ParseColumns(tail, num_columns, dtype, filename)
+
+def ParseColumns(data, num_columns, dtype, filename):
+    if not data.strip():
+        return numpy.zeros((0, num_columns), dtype = dtype)
+    # numpy.fromstring treats any whitespace (tabs, newlines) as separator in text mode
+    values = numpy.fromstring(data, dtype = dtype, sep = " ")
+    if len(values) % num_columns != 0:
+        raise ValueError("File " + filename + " does not consist of " + str(num_columns) + "-column rows")
+    return values.reshape((-1, num_columns))
+
+def ReadColumn(filename, dtype):
+    chunks = list(IterateColumnChunks(filename, 1, dtype))
+    if len(chunks) == 0:
+        return numpy.zeros(0, dtype = dtype)
+    return numpy.concatenate(chunks)[:, 0]
+
+class RowReader:
+    # reads tables row by row in chunks of requested sizes, e.g. to align rows of files
+    # with records of different granularity (sequences and their SHMs)
+    def __init__(self, filename, num_columns, dtype = numpy.int64, block_size = default_block_size):
+        self.num_columns = num_columns
+        self.dtype = dtype
+        self.chunks = IterateColumnChunks(filename, num_columns, dtype, block_size)
+        self.buffer = numpy.zeros((0, num_columns), dtype = dtype)
+
+    def Read(self, num_rows):
+        # returns next num_rows rows or less at the end of the file
+        parts = list()
+        while num_rows > 0:
+            if len(self.buffer) == 0:
+                self.buffer = next(self.chunks, None)
+                if self.buffer is None:
+                    self.buffer = numpy.zeros((0, self.num_columns), dtype = self.dtype)
+                    break
+            parts.append(self.buffer[:num_rows])
+            self.buffer = self.buffer[num_rows:]
+            num_rows -= len(parts[-1])
+        if len(parts) == 0:
+            return numpy.zeros((0, self.num_columns), dtype = self.dtype)
+        if len(parts) == 1:
+            return parts[0]
+        return numpy.concatenate(parts)
+
+def ReadIntColumn(filename):
+    return ReadColumn(filename, numpy.int64)
+
+def ReadFloatColumn(filename):
+    return ReadColumn(filename, numpy.float64)
+
+# ----------------------------------------------------------------------------
+# Histograms accumulated chunk by chunk, so that memory does not depend on the number of values
+
+class IntegerHistogram:
+    # exact counts of non-negative integer values
+    def __init__(self):
+        self.counts = numpy.zeros(0, dtype = numpy.int64)
+
+    def Add(self, values):
+        if len(values) == 0:
+            return
+        chunk_counts = numpy.bincount(values)
+        if len(chunk_counts) > len(self.counts):
+            self.counts = numpy.concatenate([self.counts, numpy.zeros(len(chunk_counts) - len(self.counts), dtype = numpy.int64)])
+        self.counts[:len(chunk_counts)] += chunk_counts
+
+    def NumValues(self, min_value = 0):
+        return int(self.counts[min_value:].sum())
+
+    def Binned(self, bins, min_value = 0):
+        # counts and edges of equal-width bins over [min, max] of values >= min_value,
+        # the same as numpy.histogram of the values themselves
+        values = numpy.nonzero(self.counts)[0]
+        values = values[values >= min_value]
+        if len(values) == 0:
+            return numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0)
+        return numpy.histogram(values, bins = bins, weights = self.counts[values])
+
+class FixedRangeHistogram:
+    def __init__(self, bins, low, high):
+        self.bins = bins
+        self.low = low
+        self.high = high
+        self.counts = numpy.zeros(bins, dtype = numpy.int64)
+        self.edges = numpy.linspace(low, high, bins + 1)
+
+    def Add(self, values):
+        self.counts += numpy.histogram(values, bins = self.bins, range = (self.low, self.high))[0]
+
+    def Binned(self):
+        return self.counts, self.edges
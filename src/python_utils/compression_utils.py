@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Transparent gzip/zstd compression of pipeline artifacts.
+# Compression is detected by extension (.gz, .zst). gzip is handled by the gzip module,
+# zstd by the zstd command line tool. Binaries that read and write plain files get
+# compressed artifacts through named pipes (FifoDecompressor, FifoCompressor).
+
+import os
+import io
+import sys
+import gzip
+import errno
+import threading
+import subprocess
+
+compression_extensions = {"gzip": ".gz", "zstd": ".zst"}
+gzip_level = 6
+zstd_level = 3
+copy_block_size = 1 << 20
+
+def CompressedFname(fname, compression):
+    if compression == "":
+        return fname
+    return fname + compression_extensions[compression]
+
+def FileCompression(fname):
+    for compression in compression_extensions:
+        if fname.endswith(compression_extensions[compression]):
+            return compression
+    return ""
+
+def PlainFname(fname):
+    compression = FileCompression(fname)
+    if compression == "":
+        return fname
+    return fname[:-len(compression_extensions[compression])]
+
+def FindExecutable(name):
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        fname = os.path.join(path, name)
+        if os.path.isfile(fname) and os.access(fname, os.X_OK):
+            return fname
+    return None
+
+def CompressorAvailable(compression):
+    if compression == "zstd":
+        return FindExecutable("zstd") is not None
+    return compression in ["", "gzip"]
+
+class ProcessFile:
+    # file object over stdout (reading) or stdin (writing) of zstd process
+    def __init__(self, fname, mode):
+        self.reading = mode.startswith("r")
+        self.output = None
+        if self.reading:
+            self.process = subprocess.Popen(["zstd", "-d", "-c", "-q", fname], stdout = subprocess.PIPE, close_fds = True)
+            stream = self.process.stdout
+        else:
+            self.output = open(fname, mode[0] + "b")
+            self.process = subprocess.Popen(["zstd", "-" + str(zstd_level), "-c", "-q"], stdin = subprocess.PIPE,
+                                            stdout = self.output, close_fds = True)
+            stream = self.process.stdin
+        if "b" not in mode and sys.version_info[0] >= 3:
+            stream = io.TextIOWrapper(stream)
+        self.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        try:
+            self.stream.close()
+        except IOError:
+            # reader stopped before the end of file
+            pass
+        exit_code = self.process.wait()
+        if self.output is not None:
+            self.output.close()
+        # reader closed early gets SIGPIPE, it is not an error
+        if exit_code != 0 and not (self.reading and exit_code == -13):
+            raise IOError("zstd finished with code " + str(exit_code))
+
+def OpenFile(fname, mode = "r"):
+    # mode: r, w, a with optional b; text mode is used if b is not specified
+    compression = FileCompression(fname)
+    if compression == "gzip":
+        if "b" not in mode and sys.version_info[0] >= 3:
+            return gzip.open(fname, mode[0] + "t")
+        if mode[0] == "r":
+            return gzip.open(fname, "rb")
+        return gzip.open(fname, mode[0] + "b", gzip_level)
+    if compression == "zstd":
+        return ProcessFile(fname, mode)
+    return open(fname, mode)
+
+def CopyStream(input_fhandler, output_fhandler):
+    block = input_fhandler.read(copy_block_size)
+    while block:
+        output_fhandler.write(block)
+        block = input_fhandler.read(copy_block_size)
+
+def CopyFile(input_fname, output_fname):
+    # (de)compresses according to extensions of file names
+    input_fhandler = OpenFile(input_fname, "rb")
+    output_fhandler = OpenFile(output_fname, "wb")
+    CopyStream(input_fhandler, output_fhandler)
+    output_fhandler.close()
+    input_fhandler.close()
+
+def UncompressedSize(fname):
+    if FileCompression(fname) == "":
+        return os.path.getsize(fname)
+    size = 0
+    fhandler = OpenFile(fname, "rb")
+    block = fhandler.read(copy_block_size)
+    while block:
+        size += len(block)
+        block = fhandler.read(copy_block_size)
+    fhandler.close()
+    return size
+
+# ----------------------------------------------------------------------------
+# Named pipes between compressed artifacts and binaries
+
+class FifoThread(threading.Thread):
+    def __init__(self, fifo_fname):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fifo_fname = fifo_fname
+        self.error = None
+        if os.path.exists(fifo_fname):
+            os.remove(fifo_fname)
+        os.mkfifo(fifo_fname)
+
+    def run(self):
+        try:
+            self.Copy()
+        except (IOError, OSError):
+            _, exc, _ = sys.exc_info()
+            self.error = str(exc)
+
+    def UnblockOpen(self):
+        # opens the other end of the pipe if the binary did not do it (e.g. it failed earlier)
+        pass
+
+    def Finish(self):
+        # should be called after the binary exits, returns error message or None
+        while self.is_alive():
+            self.UnblockOpen()
+            self.join(0.05)
+        os.remove(self.fifo_fname)
+        return self.error
+
+class FifoDecompressor(FifoThread):
+    # compressed input_fname is decompressed into named pipe fifo_fname read by binary
+    def __init__(self, input_fname, fifo_fname):
+        FifoThread.__init__(self, fifo_fname)
+        self.input_fname = input_fname
+
+    def Copy(self):
+        input_fhandler = OpenFile(self.input_fname, "rb")
+        fifo_fd = os.open(self.fifo_fname, os.O_WRONLY)
+        try:
+            block = input_fhandler.read(copy_block_size)
+            while block:
+                while block:
+                    block = block[os.write(fifo_fd, block):]
+                block = input_fhandler.read(copy_block_size)
+        except OSError:
+            _, exc, _ = sys.exc_info()
+            # binary closed the pipe before the end of file
+            if exc.errno != errno.EPIPE:
+                raise
+            self.error = "pipe " + self.fifo_fname + " was closed before the end of " + self.input_fname
+        os.close(fifo_fd)
+        input_fhandler.close()
+
+    def UnblockOpen(self):
+        fd = os.open(self.fifo_fname, os.O_RDONLY | os.O_NONBLOCK)
+        os.close(fd)
+
+class FifoCompressor(FifoThread):
+    # data written by binary to named pipe fifo_fname is compressed to output_fname
+    def __init__(self, fifo_fname, output_fname):
+        FifoThread.__init__(self, fifo_fname)
+        self.output_fname = output_fname
+
+    def Copy(self):
+        fifo_fhandler = open(self.fifo_fname, "rb")
+        output_fhandler = OpenFile(self.output_fname, "wb")
+        CopyStream(fifo_fhandler, output_fhandler)
+        output_fhandler.close()
+        fifo_fhandler.close()
+
+    def UnblockOpen(self):
+        try:
+            fd = os.open(self.fifo_fname, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            # reader has not opened the pipe yet
+            pass
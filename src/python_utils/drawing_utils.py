@@ -15,6 +15,8 @@ import pylab
 import numpy 
 import matplotlib.pyplot as plt
 
+import columnar_utils
+
 class GraphicalData:
     all_keys = list()
     nt_keys = list()
@@ -44,35 +46,20 @@ class GraphicalSetting:
     marker = ""
     linestyle = ""
 
-def ReadIntGraphicalData(filename):
-    src = open(filename, "r")
+def GraphicalDataFromArray(values):
     data = GraphicalData()
-    data.all_keys = list()
-    data.nt_keys = list()
-    for line in src.readlines():
-        new_size = int(line.strip('\n'))
-        data.max_cluster = max(data.max_cluster, new_size)
-        data.min_cluster = min(data.min_cluster, new_size)
-        data.all_keys.append(new_size)
-        if new_size > 1:
-            data.nt_keys.append(new_size)
-    src.close()
+    data.all_keys = values
+    data.nt_keys = values[values > 1]
+    if len(values) != 0:
+        data.max_cluster = values.max().item()
+        data.min_cluster = values.min().item()
     return data
 
+def ReadIntGraphicalData(filename):
+    return GraphicalDataFromArray(columnar_utils.ReadIntColumn(filename))
+
 def ReadFloatGraphicalData(filename):
-    src = open(filename, "r")
-    data = GraphicalData()
-    data.all_keys = list()
-    data.nt_keys = list()
-    for line in src.readlines():
-        new_size = float(line)
-        data.max_cluster = max(data.max_cluster, new_size)
-        data.min_cluster = min(data.min_cluster, new_size)
-        data.all_keys.append(new_size)
-        if new_size > 1:
-            data.nt_keys.append(new_size)
-    src.close()
-    return data
+    return GraphicalDataFromArray(columnar_utils.ReadFloatColumn(filename))
 
 def GetGraphicalSettings(xlabel = "", ylabel = "", title = "", output_filename = "figure.png", bins = 100, label = "", histtype = "bar", xlog_scale = False, ylog_scale = False, draw_legend = False, colors = "", legend_loc = 'upper right', show_xaxis = True, show_yaxis = True, xmin_shift = 0, xmax_shift = 0, ymin_shift = 0, ymax_shift = 0, align = "mid", marker = ".", linestyle = ""):
     setting = GraphicalSetting()
@@ -118,7 +105,28 @@ def DrawHistogram(keys, histogram_setting):
         n, bins, patches = pylab.hist(keys, histtype = histogram_setting.histtype, bins = histogram_setting.bins, label = histogram_setting.label, color = histogram_setting.colors, cumulative=False, linewidth=1)
     else:
         n, bins, patches = pylab.hist(keys, histtype = histogram_setting.histtype, bins = histogram_setting.bins, label = histogram_setting.label, cumulative=False, linewidth=1)
-    
+    SaveHistogram(histogram_setting)
+
+    return n, bins, patches
+
+def DrawBinnedHistogram(counts, edges, histogram_setting):
+    # draws histogram from precomputed bin counts (see columnar_utils.IntegerHistogram)
+    if len(counts) == 0 or counts.sum() == 0:
+        print("Histogram is empty!")
+        return
+
+    matplotlib.rc('xtick', labelsize=14) 
+    matplotlib.rc('ytick', labelsize=14) 
+
+    if histogram_setting.colors != "":
+        n, bins, patches = pylab.hist(edges[:-1], weights = counts, histtype = histogram_setting.histtype, bins = edges, label = histogram_setting.label, color = histogram_setting.colors, cumulative=False, linewidth=1)
+    else:
+        n, bins, patches = pylab.hist(edges[:-1], weights = counts, histtype = histogram_setting.histtype, bins = edges, label = histogram_setting.label, cumulative=False, linewidth=1)
+    SaveHistogram(histogram_setting)
+
+    return n, bins, patches
+
+def SaveHistogram(histogram_setting):
     if histogram_setting.xlog_scale:
         pylab.gca().set_xscale("log")    
     if histogram_setting.ylog_scale:
@@ -131,8 +139,6 @@ def DrawHistogram(keys, histogram_setting):
     plt.savefig(histogram_setting.output_filename)
     plt.gcf().clear()    
 
-    return n, bins, patches
-
 def DrawClusterSizesHist(histograms, histlabel, basename):
     max_cluster = 0
     nt_keys = list()
@@ -299,29 +305,16 @@ def DrawSomaticMutations(X, Y, cdrs, settings):
     
     DrawMultiplePlot(X, Y, settings)
 
-def DrawMutationHistogram(pos, settings, chain_type = "HC"):
-    cdr1_start = 0.25
-    cdr1_end = 0.3
-    cdr2_start = 0.41
-    cdr2_end = 0.54
-    cdr3_start = 0.79
-    cdr3_end = .86
-
-    if chain_type == 'LC':
-        cdr1_start = 0.23
-        cdr1_end = 0.29
-        cdr2_start = 0.41
-        cdr2_end = 0.49
-        cdr3_start = 0.77
-        cdr3_end = .86
-
-    n, bins, patches = DrawHistogram(pos, settings)
-    from pylab import *
+def DrawBinnedMutationHistogram(counts, edges, settings, cdr_positions):
+    # cdr_positions: (start, end) of CDRs in units of edges
+    if len(counts) == 0 or counts.sum() == 0:
+        print("Histogram is empty!")
+        return
+    from matplotlib.patches import Rectangle
     cdr_color = "#EFBEBE"
-    plt.gca().add_patch(Rectangle((cdr1_start, 0), cdr1_end - cdr1_start, MaxValue(n) + 2, facecolor= cdr_color, lw = 0))
-    plt.gca().add_patch(Rectangle((cdr2_start, 0), cdr2_end - cdr2_start, MaxValue(n) + 2, facecolor= cdr_color, lw = 0))
-    plt.gca().add_patch(Rectangle((cdr3_start, 0), cdr3_end - cdr3_start, MaxValue(n) + 2, facecolor= cdr_color, lw = 0))
-    DrawHistogram(pos, settings)
+    for cdr_start, cdr_end in cdr_positions:
+        plt.gca().add_patch(Rectangle((cdr_start, 0), cdr_end - cdr_start, counts.max() * 1.05, facecolor= cdr_color, lw = 0))
+    DrawBinnedHistogram(counts, edges, settings)
 
 def DrawIdentityPercentageDistribution(histogram, histname):
     if not histogram:
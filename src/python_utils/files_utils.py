@@ -9,15 +9,18 @@
 import sys
 import getopt
 import os
+import array
 import logging
 import shutil
+import heapq
+import tempfile
+import multiprocessing
+
+import compression_utils
 
-from Bio.Seq import Seq, translate
 from os.path import isfile, isdir, join
 from os import listdir, curdir
 
-from Bio import SeqIO
-
 def GetFilenameAndExtension(filename):
     splits = filename.split('.')
     fname = ""
@@ -28,8 +31,9 @@ def GetFilenameAndExtension(filename):
     return [fname, ext]
 
 class DataFrame:
-    data = dict()
-    colnames = list()
+    def __init__(self):
+        self.data = dict()
+        self.colnames = list()
 
 def PrintDataFrame(data_frame):
     print(data_frame.colnames)
@@ -48,19 +52,15 @@ def ReadData(filename):
     first_line = True
     for line in file_handler.readlines():
         splits = line.strip().split()
-        #print("Splits: " + str(splits))
         if first_line:
             for i in range(0, len(splits)):
                 new_name = "col" + str(i + 1)
                 data_frame.colnames.append(new_name)
                 data_frame.data[new_name] = list()
-                data_frame.data[new_name].append(splits[i])
-            #print(data_frame.colnames)
             first_line = False
         for i in range(0, len(splits)):
-            #print(str(i) + " " + str(range(0, len(splits))))
             data_frame.data[data_frame.colnames[i]].append(splits[i])
-    #print(data_frame.colnames)
+    file_handler.close()
 
     return data_frame
 
@@ -84,24 +84,317 @@ def remove_extension(s):
     s += arr[-2]
     return s
 
+# IUPAC nucleotide codes and their complements, the case is kept
+complement_source = "ACGTUNRYSWKMBDHVacgtunryswkmbdhv"
+complement_target = "TGCAANYRSWMKVHDBtgcaanyrswmkvhdb"
+if sys.version_info[0] < 3:
+    import string
+    complement_table = string.maketrans(complement_source, complement_target)
+else:
+    complement_table = str.maketrans(complement_source, complement_target)
+
+def ReverseComplement(seq):
+    return seq.translate(complement_table)[::-1]
+
+class FastqWriter:
+    # keeps one handle (compressed according to extension of the file) and writes records in large blocks:
+    #   with FastqWriter("reads.fastq") as writer:
+    #       writer.WriteBatch([(name, seq, qual, reverse), ...])
+    # reverse records are written as reverse complement with reversed quality
+    def __init__(self, fastq_fname, mode = "w", buffer_size = 1 << 20):
+        self.fhandler = compression_utils.OpenFile(fastq_fname, mode)
+        self.buffer_size = buffer_size
+        self.buffer = list()
+        self.buffered_size = 0
+
+    def Write(self, name, seq, qual, reverse = False):
+        if reverse:
+            seq = ReverseComplement(seq)
+            qual = qual[::-1]
+        record = "@" + name + "\n" + seq + "\n+\n" + qual + "\n"
+        self.buffer.append(record)
+        self.buffered_size += len(record)
+        if self.buffered_size >= self.buffer_size:
+            self.Flush()
+
+    def WriteBatch(self, records):
+        for name, seq, qual, reverse in records:
+            self.Write(name, seq, qual, reverse)
+
+    def Flush(self):
+        if len(self.buffer) != 0:
+            self.fhandler.write("".join(self.buffer))
+            self.buffer = list()
+            self.buffered_size = 0
+
+    def Close(self):
+        self.Flush()
+        self.fhandler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+        return False
+
 def WriteReadInFastqFile(name, seq, qual, reverse, fastq_fname):
-    fastq_file = open(fastq_fname, 'a')
-    fastq_file.write("@" + name + "\n")
-    seq_to_write = seq
-    if reverse:
-        seq_to_write = str(Seq(seq).reverse_complement())
-    fastq_file.write(seq_to_write + "\n")
-    fastq_file.write("+\n")
-    qual_to_write = qual
-    if reverse:
-        qual_to_write = qual[::-1]
-    fastq_file.write(qual_to_write + "\n")
-
-def FastqToFasta(infile, outfile):
-    SeqIO.convert(infile, "fastq", outfile, "fasta")
+    # appends one read, FastqWriter should be used for many reads
+    writer = FastqWriter(fastq_fname, "a")
+    writer.Write(name, seq, qual, reverse)
+    writer.Close()
+
+fastq_block_size = 1 << 22
+
+def _FastaRecords(fastq_lines, line_width):
+    # fastq_lines: lines of complete 4-line FASTQ records without line ends
+    # output is the same as of Biopython: titles are kept, sequences are wrapped
+    records = list()
+    for i in range(0, len(fastq_lines), 4):
+        if not fastq_lines[i].startswith(b"@"):
+            raise ValueError("Record of FASTQ file should start with '@': " + repr(fastq_lines[i]))
+        seq = fastq_lines[i + 1].rstrip()
+        records.append(b">" + fastq_lines[i][1:].rstrip() + b"\n")
+        if line_width == 0:
+            if seq:
+                records.append(seq + b"\n")
+            continue
+        for j in range(0, len(seq), line_width):
+            records.append(seq[j : j + line_width] + b"\n")
+    return b"".join(records)
+
+def _ConvertFastqStream(input_fhandler, output_fhandler, line_width, num_bytes = None):
+    # converts FASTQ read as raw blocks of bytes, at most num_bytes are read if it is given
+    rest = b""
+    while num_bytes is None or num_bytes > 0:
+        block_size = fastq_block_size if num_bytes is None else min(fastq_block_size, num_bytes)
+        block = input_fhandler.read(block_size)
+        if not block:
+            break
+        if num_bytes is not None:
+            num_bytes -= len(block)
+        lines = (rest + block).split(b"\n")
+        # the last line is incomplete, only complete records are converted
+        num_complete_lines = (len(lines) - 1) // 4 * 4
+        rest = b"\n".join(lines[num_complete_lines:])
+        output_fhandler.write(_FastaRecords(lines[:num_complete_lines], line_width))
+    lines = rest.rstrip(b"\r\n").split(b"\n") if rest.strip() else []
+    if len(lines) % 4 != 0:
+        raise ValueError("FASTQ file ends with incomplete record")
+    output_fhandler.write(_FastaRecords(lines, line_width))
+
+def _FastqRecordStart(fhandler, offset):
+    # offset of the first FASTQ record that starts at the given offset or after it
+    # (quality line may start with '@', but then the line after the next one is sequence, not '+')
+    if offset == 0:
+        return 0
+    fhandler.seek(offset - 1)
+    # the line containing offset - 1 is skipped: a record starts at offset only if it is the start of a line
+    offset += len(fhandler.readline()) - 1
+    while True:
+        fhandler.seek(offset)
+        lines = [fhandler.readline() for _ in range(3)]
+        if not lines[0]:
+            return offset
+        if lines[0].startswith(b"@") and lines[2].startswith(b"+"):
+            return offset
+        offset += len(lines[0])
+
+def _ConvertFastqChunk(chunk):
+    fastq_fname, start, end, fasta_fname, line_width = chunk
+    input_fhandler = open(fastq_fname, "rb")
+    input_fhandler.seek(start)
+    output_fhandler = open(fasta_fname, "wb")
+    _ConvertFastqStream(input_fhandler, output_fhandler, line_width, end - start)
+    output_fhandler.close()
+    input_fhandler.close()
+    return fasta_fname
+
+def FastqToFasta(infile, outfile, num_processes = 1, line_width = 60):
+    # converts 4-line FASTQ to FASTA with the same output as Bio.SeqIO.convert
+    # compressed files are (de)compressed on the fly according to their extensions
+    # uncompressed input is split into chunks at record boundaries, which are converted in num_processes processes;
+    # compressed input is converted sequentially, since it cannot be split without decompression
+    file_size = os.path.getsize(infile)
+    if num_processes <= 1 or compression_utils.FileCompression(infile) != "" or file_size < num_processes * fastq_block_size:
+        input_fhandler = compression_utils.OpenFile(infile, "rb")
+        output_fhandler = compression_utils.OpenFile(outfile, "wb")
+        _ConvertFastqStream(input_fhandler, output_fhandler, line_width)
+        output_fhandler.close()
+        input_fhandler.close()
+        return outfile
+
+    fastq_fhandler = open(infile, "rb")
+    starts = sorted(set([_FastqRecordStart(fastq_fhandler, file_size * i // num_processes) for i in range(num_processes)]))
+    fastq_fhandler.close()
+    tmp_dir = tempfile.mkdtemp(prefix = "fastq_to_fasta_", dir = os.path.dirname(os.path.abspath(outfile)))
+    chunks = [(infile, start, end, os.path.join(tmp_dir, "chunk_" + str(i) + ".fasta"), line_width)
+              for i, (start, end) in enumerate(zip(starts, starts[1:] + [file_size]))]
+    pool = multiprocessing.Pool(num_processes)
+    try:
+        chunk_fnames = pool.map(_ConvertFastqChunk, chunks)
+        pool.close()
+    finally:
+        pool.terminate()
+    output_fhandler = compression_utils.OpenFile(outfile, "wb")
+    for fname in chunk_fnames:
+        chunk_fhandler = open(fname, "rb")
+        compression_utils.CopyStream(chunk_fhandler, output_fhandler)
+        chunk_fhandler.close()
+    output_fhandler.close()
+    shutil.rmtree(tmp_dir)
     return outfile
 
 def WriteListToFile(data_list, fname):
     fhandler = open(fname, "w")
     for item in data_list:
         fhandler.write(str(item) + "\n")
+
+def _WriteSortedRun(records, tmp_dir):
+    records.sort()
+    run_fhandler = tempfile.NamedTemporaryFile(mode = "w", dir = tmp_dir, suffix = ".run", delete = False)
+    for record in records:
+        run_fhandler.write("\t".join([str(field) for field in record]) + "\n")
+    run_fhandler.close()
+    return run_fhandler.name
+
+def _ReadSortedRun(run_fname, num_int_keys):
+    run_fhandler = open(run_fname, "r")
+    for line in run_fhandler:
+        splits = line.rstrip("\n").split("\t")
+        yield tuple([int(key) for key in splits[:num_int_keys]]) + tuple(splits[num_int_keys:])
+    run_fhandler.close()
+
+def ExternalSort(records, num_int_keys, tmp_dir, run_size = 1000000):
+    # records are tuples starting with num_int_keys integer keys followed by tab-free strings
+    # at most run_size records are kept in memory, the rest is spilled to sorted runs in tmp_dir
+    run = list()
+    run_fnames = list()
+    for record in records:
+        run.append(record)
+        if len(run) == run_size:
+            run_fnames.append(_WriteSortedRun(run, tmp_dir))
+            run = list()
+    if len(run_fnames) == 0:
+        run.sort()
+        for record in run:
+            yield record
+        return
+    if len(run) != 0:
+        run_fnames.append(_WriteSortedRun(run, tmp_dir))
+        run = list()
+    for record in heapq.merge(*[_ReadSortedRun(fname, num_int_keys) for fname in run_fnames]):
+        yield record
+    for fname in run_fnames:
+        os.remove(fname)
+
+# 64-bit unsigned typecode of array, "Q" is not available in python 2
+uint64_typecode = "L" if array.array("L").itemsize == 8 else "Q"
+
+def _WriteSortedIntegerRun(values, tmp_dir):
+    run_fhandler = tempfile.NamedTemporaryFile(mode = "wb", dir = tmp_dir, suffix = ".run", delete = False)
+    run = array.array(uint64_typecode, sorted(values))
+    run_fhandler.write(run.tostring() if sys.version_info[0] < 3 else run.tobytes())
+    run_fhandler.close()
+    return run_fhandler.name
+
+def _ReadSortedIntegerRun(run_fname, block_size):
+    run_fhandler = open(run_fname, "rb")
+    num_values = os.path.getsize(run_fname) // array.array(uint64_typecode).itemsize
+    while num_values > 0:
+        block = array.array(uint64_typecode)
+        block.fromfile(run_fhandler, min(block_size, num_values))
+        num_values -= len(block)
+        for value in block:
+            yield value
+    run_fhandler.close()
+
+def ExternalSortIntegers(values, tmp_dir, run_size = 1000000, block_size = 1 << 13):
+    # the same as ExternalSort for non-negative integers below 2 ^ 64 (e.g. several keys packed into one integer),
+    # runs are stored as binary arrays
+    run = array.array(uint64_typecode)
+    run_fnames = list()
+    for value in values:
+        run.append(value)
+        if len(run) == run_size:
+            run_fnames.append(_WriteSortedIntegerRun(run, tmp_dir))
+            run = array.array(uint64_typecode)
+    if len(run_fnames) == 0:
+        for value in sorted(run):
+            yield value
+        return
+    if len(run) != 0:
+        run_fnames.append(_WriteSortedIntegerRun(run, tmp_dir))
+        run = None
+    for value in heapq.merge(*[_ReadSortedIntegerRun(fname, block_size) for fname in run_fnames]):
+        yield value
+    for fname in run_fnames:
+        os.remove(fname)
+
+def SplitFastaByRecords(fasta_fname, num_chunks, chunk_prefix):
+    # splits FASTA into at most num_chunks consecutive chunks of similar size in bytes
+    # records are never broken, empty chunks are not created
+    # compressed FASTA is decompressed on the fly, chunks are not compressed
+    chunk_size = max(1, compression_utils.UncompressedSize(fasta_fname) // num_chunks)
+    chunk_fnames = list()
+    chunk_fhandler = None
+    bytes_read = 0
+    fasta_fhandler = compression_utils.OpenFile(fasta_fname, "r")
+    for line in fasta_fhandler:
+        if line.startswith(">") and (chunk_fhandler is None or
+                (bytes_read >= len(chunk_fnames) * chunk_size and len(chunk_fnames) < num_chunks)):
+            if chunk_fhandler is not None:
+                chunk_fhandler.close()
+            chunk_fnames.append(chunk_prefix + str(len(chunk_fnames) + 1) + ".fasta")
+            chunk_fhandler = open(chunk_fnames[-1], "w")
+        if chunk_fhandler is not None:
+            chunk_fhandler.write(line)
+        bytes_read += len(line)
+    fasta_fhandler.close()
+    if chunk_fhandler is not None:
+        chunk_fhandler.close()
+    return chunk_fnames
+
+def ConcatenateFiles(input_fnames, output_fname, block_size = 1 << 20):
+    # returns number of lines written, output is compressed according to its extension
+    num_lines = 0
+    output_fhandler = compression_utils.OpenFile(output_fname, "w")
+    for fname in input_fnames:
+        input_fhandler = open(fname, "r")
+        block = input_fhandler.read(block_size)
+        while block:
+            num_lines += block.count("\n")
+            output_fhandler.write(block)
+            block = input_fhandler.read(block_size)
+        input_fhandler.close()
+    output_fhandler.close()
+    return num_lines
+
+def IterateFastaRecords(fasta_fname):
+    # yields (name, sequence) of (possibly multi-line) FASTA records
+    fasta_fhandler = compression_utils.OpenFile(fasta_fname, "r")
+    name = None
+    seq_lines = list()
+    for line in fasta_fhandler:
+        if line.startswith(">"):
+            if name is not None:
+                yield name, "".join(seq_lines)
+            name = line[1:].strip()
+            seq_lines = list()
+        else:
+            seq_lines.append(line.strip())
+    fasta_fhandler.close()
+    if name is not None:
+        yield name, "".join(seq_lines)
+
+def IterateFastqRecords(fastq_fname):
+    # yields (name, sequence, quality) of 4-line FASTQ records
+    fastq_fhandler = compression_utils.OpenFile(fastq_fname, "r")
+    header = fastq_fhandler.readline()
+    while header.strip():
+        seq = fastq_fhandler.readline().strip()
+        fastq_fhandler.readline()
+        qual = fastq_fhandler.readline().strip()
+        yield header[1:].strip(), seq, qual
+        header = fastq_fhandler.readline()
+    fastq_fhandler.close()
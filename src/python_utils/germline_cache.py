@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Germline V/D/J genes compiled into an indexed binary file (<cache key>.igdb), which is memory-mapped
+# by ig_simulator (src/ig_simulator/germline_cache.hpp) and GermlineDatabase below instead of parsing FASTA.
+# Cache key depends on contents of FASTA files, database type and format version. Layout (little-endian):
+#   header:      magic "IGGERMDB", uint32 format version, uint32 database type (0 - reg, 1 - imgt), uint32 number of gene sets
+#   gene sets:   uint32 gene type (0 - V, 1 - D, 2 - J), uint32 number of genes, uint64 offset of gene records
+#   gene record: (uint64 offset, uint32 length) of name, short name and sequence, uint32 functionality
+#   strings of all genes follow the records
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+
+import files_utils
+import stage_cache
+
+magic = b"IGGERMDB"
+format_version = 1
+header_format = "<8sIII"
+gene_set_format = "<IIQ"
+gene_record_format = "<QIQIQII"
+
+gene_types = {"V": 0, "D": 1, "J": 2}
+database_types = {"reg": 0, "imgt": 1}
+# functionality field of IMGT headers, 0 if it is unknown
+functionality_flags = {"F": 1, "ORF": 2, "P": 4}
+
+class GermlineGene:
+    def __init__(self, name, short_name, seq, functionality):
+        self.name = name
+        self.short_name = short_name
+        self.seq = seq
+        self.length = len(seq)
+        self.functionality = functionality
+
+def ShortGeneName(name, database_type):
+    # the same as ShortGeneNameExtractor of ig_simulator
+    if database_type == "imgt":
+        splits = name.split("|")
+        if len(splits) < 2:
+            raise ValueError("Header " + name + " is not in IMGT format")
+        return splits[1]
+    return name
+
+def GeneFunctionality(name, database_type):
+    if database_type != "imgt":
+        return 0
+    splits = name.split("|")
+    if len(splits) < 4:
+        return 0
+    return functionality_flags.get(splits[3].strip("()[] "), 0)
+
+def CacheKey(gene_sets, database_type):
+    # gene_sets: list of (gene type, FASTA file)
+    key = hashlib.sha1(("igdb " + str(format_version) + " " + database_type).encode("utf-8"))
+    for gene_type, fasta_fname in gene_sets:
+        key.update((" " + gene_type + " " + stage_cache.FileDigest(fasta_fname)).encode("utf-8"))
+    return key.hexdigest()
+
+def ReadGenes(fasta_fname, database_type):
+    genes = list()
+    for name, seq in files_utils.IterateFastaRecords(fasta_fname):
+        # ig_simulator skips records without sequence
+        if seq != "":
+            genes.append(GermlineGene(name, ShortGeneName(name, database_type), seq, GeneFunctionality(name, database_type)))
+    return genes
+
+def CompileGermlineCache(gene_sets, database_type, cache_fname):
+    genes = [(gene_types[gene_type], ReadGenes(fasta_fname, database_type)) for gene_type, fasta_fname in gene_sets]
+    records_offset = struct.calcsize(header_format) + len(genes) * struct.calcsize(gene_set_format)
+    strings_offset = records_offset + sum([len(set_genes) for _, set_genes in genes]) * struct.calcsize(gene_record_format)
+    header = [struct.pack(header_format, magic, format_version, database_types[database_type], len(genes))]
+    records = list()
+    strings = list()
+    for gene_type, set_genes in genes:
+        header.append(struct.pack(gene_set_format, gene_type, len(set_genes),
+                                  records_offset + len(records) * struct.calcsize(gene_record_format)))
+        for gene in set_genes:
+            fields = list()
+            for value in [gene.name, gene.short_name, gene.seq]:
+                value = value.encode("utf-8")
+                fields += [strings_offset, len(value)]
+                strings.append(value)
+                strings_offset += len(value)
+            records.append(struct.pack(gene_record_format, *(fields + [gene.functionality])))
+    # concurrent simulations may compile the same cache, so it is written to a temporary file and renamed
+    fd, tmp_fname = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(cache_fname))
+    fhandler = os.fdopen(fd, "wb")
+    fhandler.write(b"".join(header + records + strings))
+    fhandler.close()
+    os.chmod(tmp_fname, 0o644)
+    os.rename(tmp_fname, cache_fname)
+
+def DefaultCacheDir():
+    # installation directory may be read-only or shared, so the cache is kept in the cache directory of the user
+    cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    if cache_home == "":
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "ig_simulator", "germline_cache")
+
+def PrepareGermlineCache(cache_dir, gene_sets, database_type):
+    # returns name of the cache file and whether it was compiled now
+    cache_fname = os.path.join(cache_dir, CacheKey(gene_sets, database_type) + ".igdb")
+    if os.path.exists(cache_fname):
+        return cache_fname, False
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # created by a concurrent simulation
+            pass
+    CompileGermlineCache(gene_sets, database_type, cache_fname)
+    return cache_fname, True
+
+def IsGermlineCache(fname):
+    fhandler = open(fname, "rb")
+    prefix = fhandler.read(len(magic))
+    fhandler.close()
+    return prefix == magic
+
+class GermlineDatabase:
+    # genes are decoded from the memory-mapped file on demand
+    def __init__(self, cache_fname):
+        fhandler = open(cache_fname, "rb")
+        self.data = mmap.mmap(fhandler.fileno(), 0, access = mmap.ACCESS_READ)
+        fhandler.close()
+        file_magic, version, database_type, num_sets = struct.unpack_from(header_format, self.data, 0)
+        if file_magic != magic or version != format_version:
+            raise ValueError(cache_fname + " is not a germline cache of version " + str(format_version))
+        self.database_type = [name for name in database_types if database_types[name] == database_type][0]
+        self.gene_sets = dict()
+        for i in range(0, num_sets):
+            gene_type, num_genes, offset = struct.unpack_from(gene_set_format, self.data, struct.calcsize(header_format) +
+                                                              i * struct.calcsize(gene_set_format))
+            self.gene_sets[gene_type] = (num_genes, offset)
+
+    def NumGenes(self, gene_type):
+        if gene_types[gene_type] not in self.gene_sets:
+            return 0
+        return self.gene_sets[gene_types[gene_type]][0]
+
+    def String(self, offset, length):
+        value = self.data[offset : offset + length]
+        if not isinstance(value, str):
+            value = value.decode("utf-8")
+        return value
+
+    def Gene(self, gene_type, index):
+        num_genes, offset = self.gene_sets[gene_types[gene_type]]
+        if index >= num_genes:
+            raise IndexError("Gene set " + gene_type + " has " + str(num_genes) + " genes")
+        fields = struct.unpack_from(gene_record_format, self.data, offset + index * struct.calcsize(gene_record_format))
+        return GermlineGene(self.String(fields[0], fields[1]), self.String(fields[2], fields[3]),
+                            self.String(fields[4], fields[5]), fields[6])
+
+    def Genes(self, gene_type):
+        for i in range(0, self.NumGenes(gene_type)):
+            yield self.Gene(gene_type, i)
+
+    def Close(self):
+        self.data.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Ground truth of a simulation in one indexed SQLite database (ground_truth.sqlite).
+# Text files of the repertoire simulator and the ideal repertoire are linked by order of records
+# and by names of reads; here they are joined once and loaded by batched inserts:
+#   genes(gene_id, gene_type, name)                     V, D and J genes used by antibodies
+#   base_sequences(base_id, sequence, num_mutated)      base_sequences.fasta, base_frequencies.txt
+#   antibodies(antibody_id, base_id, sequence, length, multiplicity, num_shms, v_gene_id, d_gene_id, j_gene_id)
+#                                                       mutated_sequences.fasta, mutated_frequencies.txt, shm_numbers.txt,
+#                                                       repertoire_vdj_recombination.txt (d_gene_id is NULL for light chains)
+#   shms(antibody_id, position)                         shm_positions.txt
+#   clusters(cluster_id, size, sequence)                ideal_repertoire.clusters.fa
+#   reads(read_id, name, antibody_id, copy, cluster_id) ideal_repertoire.rcm
+#   antibody_genes(antibody_id, v_gene, d_gene, j_gene) view with names of genes
+# Mutated antibodies of every base sequence are consecutive, base_frequencies.txt gives their numbers.
+# Example: reads of IGHV3-23 clones with more than 10 SHMs
+#   SELECT reads.name FROM reads JOIN antibodies USING (antibody_id) JOIN genes ON genes.gene_id = antibodies.v_gene_id
+#   WHERE genes.name LIKE 'IGHV3-23*%' AND antibodies.num_shms > 10
+
+import os
+import sqlite3
+import itertools
+
+import files_utils
+import compression_utils
+import repertoire_utils
+
+try:
+    from itertools import izip_longest as zip_longest
+except ImportError:
+    from itertools import zip_longest
+
+insert_batch_size = 50000
+
+schema = ["CREATE TABLE genes (gene_id INTEGER PRIMARY KEY, gene_type TEXT NOT NULL, name TEXT NOT NULL)",
+          "CREATE TABLE base_sequences (base_id INTEGER PRIMARY KEY, sequence TEXT NOT NULL, num_mutated INTEGER NOT NULL)",
+          "CREATE TABLE antibodies (antibody_id INTEGER PRIMARY KEY, base_id INTEGER NOT NULL, sequence TEXT NOT NULL, "
+          "length INTEGER NOT NULL, multiplicity INTEGER NOT NULL, num_shms INTEGER NOT NULL, "
+          "v_gene_id INTEGER, d_gene_id INTEGER, j_gene_id INTEGER)",
+          "CREATE TABLE shms (antibody_id INTEGER NOT NULL, position INTEGER NOT NULL)",
+          "CREATE TABLE clusters (cluster_id INTEGER PRIMARY KEY, size INTEGER NOT NULL, sequence TEXT NOT NULL)",
+          "CREATE TABLE reads (read_id INTEGER PRIMARY KEY, name TEXT NOT NULL, antibody_id INTEGER NOT NULL, "
+          "copy INTEGER NOT NULL, cluster_id INTEGER NOT NULL)",
+          "CREATE VIEW antibody_genes AS SELECT antibody_id, v.name AS v_gene, d.name AS d_gene, j.name AS j_gene "
+          "FROM antibodies LEFT JOIN genes v ON v.gene_id = v_gene_id LEFT JOIN genes d ON d.gene_id = d_gene_id "
+          "LEFT JOIN genes j ON j.gene_id = j_gene_id"]
+
+# indices are created after loading, which is faster than updating them on every insert
+indices = ["CREATE UNIQUE INDEX genes_name ON genes (name, gene_type)",
+           "CREATE INDEX antibodies_base ON antibodies (base_id)",
+           "CREATE INDEX antibodies_v_gene ON antibodies (v_gene_id)",
+           "CREATE INDEX antibodies_d_gene ON antibodies (d_gene_id)",
+           "CREATE INDEX antibodies_j_gene ON antibodies (j_gene_id)",
+           "CREATE INDEX antibodies_num_shms ON antibodies (num_shms)",
+           "CREATE INDEX shms_antibody ON shms (antibody_id)",
+           "CREATE UNIQUE INDEX reads_name ON reads (name)",
+           "CREATE INDEX reads_antibody ON reads (antibody_id)",
+           "CREATE INDEX reads_cluster ON reads (cluster_id)"]
+
+class GroundTruthFiles:
+    def __init__(self, base_sequences, base_multiplicities, mutated_sequences, mutated_multiplicities,
+                 shm_positions, shm_numbers, repertoire_vdj, rcm, clusters_fa):
+        self.base_sequences = base_sequences
+        self.base_multiplicities = base_multiplicities
+        self.mutated_sequences = mutated_sequences
+        self.mutated_multiplicities = mutated_multiplicities
+        self.shm_positions = shm_positions
+        self.shm_numbers = shm_numbers
+        self.repertoire_vdj = repertoire_vdj
+        self.rcm = rcm
+        self.clusters_fa = clusters_fa
+
+def IterateColumns(fname):
+    # whitespace-separated columns of non-empty lines
+    fhandler = compression_utils.OpenFile(fname, "r")
+    for line in fhandler:
+        splits = line.split()
+        if len(splits) != 0:
+            yield splits
+    fhandler.close()
+
+def IterateInts(fname):
+    for splits in IterateColumns(fname):
+        yield int(splits[0])
+
+def IterateVDJGenes(repertoire_vdj):
+    # genes of antibodies: (V, D, J) for heavy chains, (V, None, J) for light chains
+    fhandler = compression_utils.OpenFile(repertoire_vdj, "r")
+    for line in fhandler:
+        splits = line.rstrip("\n").split("\t", 1)
+        if len(splits) != 2:
+            continue
+        genes = splits[1].split(";")
+        if len(genes) == 2:
+            genes = [genes[0], None, genes[1]]
+        yield genes
+    fhandler.close()
+
+def InsertBatches(connection, table, num_columns, records):
+    statement = "INSERT INTO " + table + " VALUES (" + ", ".join(["?"] * num_columns) + ")"
+    num_records = 0
+    while True:
+        batch = list(itertools.islice(records, insert_batch_size))
+        if len(batch) == 0:
+            return num_records
+        connection.executemany(statement, batch)
+        num_records += len(batch)
+
+def JoinRecords(records, fnames):
+    # records of parallel files, raises ValueError if numbers of records are different
+    for joined_records in zip_longest(*records):
+        if None in joined_records:
+            fname = fnames[joined_records.index(None)]
+            other_fname = [fnames[i] for i in range(len(fnames)) if joined_records[i] is not None][0]
+            raise ValueError("Numbers of records in " + fname + " and " + other_fname + " are different")
+        yield joined_records
+
+def BaseSequenceRecords(files):
+    records = JoinRecords([files_utils.IterateFastaRecords(files.base_sequences), IterateInts(files.base_multiplicities)],
+                          [files.base_sequences, files.base_multiplicities])
+    for (_, seq), num_mutated in records:
+        yield seq, num_mutated
+
+def AntibodyRecords(files, gene_ids):
+    # gene_ids: (gene type, name) -> id, filled by new genes
+    def GeneId(gene_type, name):
+        if name is None:
+            return None
+        return gene_ids.setdefault((gene_type, name), len(gene_ids) + 1)
+
+    base_ids = itertools.chain.from_iterable(itertools.repeat(base_id + 1, num_mutated) for base_id, num_mutated in
+                                             enumerate(IterateInts(files.base_multiplicities)))
+    records = JoinRecords([files_utils.IterateFastaRecords(files.mutated_sequences), IterateInts(files.mutated_multiplicities),
+                           IterateInts(files.shm_numbers), IterateVDJGenes(files.repertoire_vdj), base_ids],
+                          [files.mutated_sequences, files.mutated_multiplicities, files.shm_numbers, files.repertoire_vdj,
+                           files.base_multiplicities])
+    for antibody_id, ((_, seq), multiplicity, num_shms, genes, base_id) in enumerate(records):
+        yield (antibody_id + 1, base_id, seq, len(seq), multiplicity, num_shms,
+               GeneId("V", genes[0]), GeneId("D", genes[1]), GeneId("J", genes[2]))
+
+def SHMRecords(files):
+    positions = IterateColumns(files.shm_positions)
+    for antibody_id, num_shms in enumerate(IterateInts(files.shm_numbers)):
+        for splits in itertools.islice(positions, num_shms):
+            yield antibody_id + 1, int(splits[0])
+
+def ClusterRecords(files):
+    for name, seq in files_utils.IterateFastaRecords(files.clusters_fa):
+        yield repertoire_utils.ClusterIdFromName(name), repertoire_utils.ClusterSizeFromName(name), seq
+
+def ReadRecords(files):
+    for read_id, splits in enumerate(IterateColumns(files.rcm)):
+        yield (read_id + 1, splits[0], repertoire_utils.AntibodyIdFromReadName(splits[0]),
+               repertoire_utils.CopyIndexFromReadName(splits[0]), int(splits[1]))
+
+def BuildGroundTruthDatabase(files, db_fname):
+    # returns numbers of records of tables
+    tmp_fname = db_fname + ".tmp"
+    if os.path.exists(tmp_fname):
+        os.remove(tmp_fname)
+    connection = sqlite3.connect(tmp_fname)
+    # the database is written to a temporary file and renamed, so journal is not needed
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    for statement in schema:
+        connection.execute(statement)
+    gene_ids = dict()
+    num_records = dict()
+    num_records["base_sequences"] = InsertBatches(connection, "base_sequences", 3,
+                                                  ((i + 1,) + record for i, record in enumerate(BaseSequenceRecords(files))))
+    num_records["antibodies"] = InsertBatches(connection, "antibodies", 9, AntibodyRecords(files, gene_ids))
+    num_records["genes"] = InsertBatches(connection, "genes", 3, ((gene_ids[key], key[0], key[1]) for key in gene_ids))
+    num_records["shms"] = InsertBatches(connection, "shms", 2, SHMRecords(files))
+    num_records["clusters"] = InsertBatches(connection, "clusters", 3, ClusterRecords(files))
+    num_records["reads"] = InsertBatches(connection, "reads", 5, ReadRecords(files))
+    for statement in indices:
+        connection.execute(statement)
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+    os.rename(tmp_fname, db_fname)
+    return num_records
+
+def OpenGroundTruthDatabase(db_fname):
+    if not os.path.exists(db_fname):
+        raise IOError("Ground truth database " + db_fname + " was not found")
+    return sqlite3.connect(db_fname)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+import os
+import sys
+import time
+import json
+import shlex
+import resource
+import threading
+import subprocess
+
+def ReadProcIO(pid):
+    # returns None if /proc/<pid>/io is not available (e.g. not Linux)
+    io_fname = "/proc/" + str(pid) + "/io"
+    if not os.path.exists(io_fname):
+        return None
+    io = dict()
+    try:
+        for line in open(io_fname, "r"):
+            splits = line.split(":")
+            io[splits[0].strip()] = int(splits[1])
+    except (IOError, OSError):
+        return None
+    return io
+
+def ReadPeakRSS(pid):
+    # VmHWM of the running process in kB, None if it is not available
+    try:
+        for line in open("/proc/" + str(pid) + "/status", "r"):
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+# python steps of all simulations of this process share its VmHWM: it is reset only when no step is running,
+# and its value before the reset is kept, as ru_maxrss of the process does not include it after the reset
+python_steps_lock = threading.Lock()
+num_python_steps = 0
+peak_rss_before_reset = 0
+
+def StartPeakRSSWindow():
+    # returns True if VmHWM of this process is not larger than the peak since the start of the earliest running step
+    # (it cannot be reset e.g. if /proc/self/clear_refs is not available)
+    global num_python_steps, peak_rss_before_reset
+    python_steps_lock.acquire()
+    try:
+        num_python_steps += 1
+        if num_python_steps > 1:
+            return True
+        peak_rss = ReadPeakRSS(os.getpid())
+        try:
+            fhandler = open("/proc/self/clear_refs", "w")
+            fhandler.write("5")
+            fhandler.close()
+        except (IOError, OSError):
+            return False
+        if peak_rss is not None:
+            peak_rss_before_reset = max(peak_rss_before_reset, peak_rss)
+        return True
+    finally:
+        python_steps_lock.release()
+
+def FinishPeakRSSWindow():
+    global num_python_steps
+    python_steps_lock.acquire()
+    num_python_steps -= 1
+    python_steps_lock.release()
+
+def ProcessPeakRSS():
+    # peak RSS of this process in kB since its start
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, peak_rss_before_reset)
+
+def AvailableMemoryMb():
+    # MemAvailable from /proc/meminfo, None if it is not available
+    try:
+        for line in open("/proc/meminfo", "r"):
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+def ReadMemoryLayout(pid):
+    # addresses of code, stack, arguments and environment of the process from /proc/<pid>/stat,
+    # None if they are not available
+    try:
+        fields = open("/proc/" + str(pid) + "/stat", "r").read().rsplit(")", 1)[1].split()
+    except (IOError, OSError, IndexError):
+        return None
+    # fields[0] is the state (field 3): startcode, endcode, startstack are fields 26-28,
+    # arg_start, arg_end, env_start, env_end are fields 48-51
+    return tuple(fields[23:26] + fields[45:49])
+
+class PeakRSSSampler(threading.Thread):
+    # ru_maxrss of a child also counts memory of the python process it was forked from,
+    # so peak RSS of a binary is sampled from /proc while it is running. Until exec is completed the child
+    # is a copy of this process with the same memory layout, so samples are taken only after its layout changes,
+    # and not during the startup time when the program may still be loaded
+    # (processes that exit earlier have no samples at all)
+    def __init__(self, pid, interval = 0.02, startup_time = 0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pid = pid
+        self.parent_layout = ReadMemoryLayout(os.getpid())
+        self.exec_time = None
+        self.startup_time = startup_time
+        self.interval = interval
+        self.peak_rss = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.Sample()
+            self.stopped.wait(self.interval)
+
+    def Loaded(self):
+        layout = ReadMemoryLayout(self.pid)
+        # addresses are zero while exec sets up the new memory map and after the process exits
+        return layout is not None and layout != self.parent_layout and "0" not in layout
+
+    def Sample(self):
+        # exec happens only once, so VmHWM read after the check belongs to the executed program
+        if self.exec_time is None:
+            if not self.Loaded():
+                return
+            self.exec_time = time.time()
+        if time.time() - self.exec_time < self.startup_time:
+            return
+        rss = ReadPeakRSS(self.pid)
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss, rss) if self.peak_rss is not None else rss
+
+    def Stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak_rss
+
+def ExactPeakRSS(rusage_maxrss, parent_peak_rss):
+    # ru_maxrss of a child is the maximum of its own peak and of the copy of this process it was forked from;
+    # the copy is not larger than this process (parent_peak_rss: VmHWM of this process before and after the child),
+    # so a larger value (with a margin for pages touched before exec) is the peak of the executed program itself
+    parent_peak_rss = [rss for rss in parent_peak_rss if rss is not None]
+    if len(parent_peak_rss) != 0 and rusage_maxrss > max(parent_peak_rss) + 1024:
+        return rusage_maxrss
+    return None
+
+def WaitForExit(pid, sampler = None):
+    # waits until process becomes a zombie without reaping it, so that its /proc entry is still readable
+    stat_fname = "/proc/" + str(pid) + "/stat"
+    while os.path.exists(stat_fname):
+        try:
+            state = open(stat_fname, "r").read().rsplit(")", 1)[1].split()[0]
+        except (IOError, OSError, IndexError):
+            return
+        if state in ["Z", "X"]:
+            return
+        if sampler is not None:
+            sampler.Sample()
+        time.sleep(0.01)
+
+def IOUsage(proc_io, rusage):
+    if proc_io is not None:
+        return {"read_chars": proc_io.get("rchar", 0),
+                "write_chars": proc_io.get("wchar", 0),
+                "read_bytes": proc_io.get("read_bytes", 0),
+                "write_bytes": proc_io.get("write_bytes", 0)}
+    # block counters are in 512-byte units
+    return {"read_bytes": rusage.ru_inblock * 512,
+            "write_bytes": rusage.ru_oublock * 512}
+
+def ReapChild(pid, start_time):
+    # the child must have exited (see WaitForExit), its /proc entry is read before it is reaped
+    # returns exit code (negative signal number if killed by signal) and resource usage of the child
+    proc_io = ReadProcIO(pid)
+    _, status, rusage = os.wait4(pid, 0)
+    wall_time = time.time() - start_time
+    if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    usage = {"exit_code": exit_code,
+             "wall_time_sec": round(wall_time, 3),
+             "user_cpu_sec": round(rusage.ru_utime, 3),
+             "sys_cpu_sec": round(rusage.ru_stime, 3),
+             "rusage_maxrss_kb": rusage.ru_maxrss}
+    usage.update(IOUsage(proc_io, rusage))
+    return exit_code, usage
+
+def RunCommand(command_line, output_handler):
+    # runs command (string or list of arguments) without shell, passes every line of its stdout and stderr to output_handler
+    # returns exit code (negative signal number if killed by signal) and resource usage of the process,
+    # peak_rss_kb is None if the process was too short to be sampled
+    start_time = time.time()
+    parent_peak_rss = ReadPeakRSS(os.getpid())
+    # close_fds: children must not hold ends of pipes opened by other threads
+    args = command_line if isinstance(command_line, list) else shlex.split(command_line)
+    process = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                               close_fds = True)
+    sampler = PeakRSSSampler(process.pid)
+    sampler.start()
+    for line in iter(process.stdout.readline, b""):
+        if not isinstance(line, str):
+            line = line.decode("utf-8", "replace")
+        output_handler(line.rstrip("\n"))
+    process.stdout.close()
+    WaitForExit(process.pid, sampler)
+    peak_rss = sampler.Stop()
+    exit_code, usage = ReapChild(process.pid, start_time)
+    process.returncode = exit_code
+    exact_peak_rss = ExactPeakRSS(usage["rusage_maxrss_kb"], [parent_peak_rss, ReadPeakRSS(os.getpid()), ProcessPeakRSS()])
+    usage["peak_rss_kb"] = exact_peak_rss if exact_peak_rss is not None else peak_rss
+    return exit_code, usage
+
+class BackgroundStage:
+    # command runs in a separate process started by RunCommand, so the child gets only its command line
+    # and nothing of the state or threads of the pipeline; a thread waits for the child and passes its output to output_handler
+    def __init__(self, name, command, output_handler, run_metrics, error_type):
+        self.name = name
+        self.command = command
+        self.output_handler = output_handler
+        self.run_metrics = run_metrics
+        self.error_type = error_type
+        self.error = None
+        self.reported = False
+        self.thread = threading.Thread(target = self.Run)
+        self.thread.daemon = True
+
+    def Run(self):
+        try:
+            exit_code, usage = RunCommand(self.command, self.output_handler)
+        except Exception:
+            # e.g. the interpreter could not be started
+            self.error = sys.exc_info()[1]
+            return
+        self.run_metrics.Add(self.name, " ".join(self.command), usage)
+        if exit_code != 0:
+            self.error = self.error_type(self.name)
+
+class BackgroundStages:
+    # stages whose outputs are not needed by the following stages (e.g. drawing of statistics) run as separate processes
+    # concurrently with them; the pipeline waits for them before it uses or removes their inputs and outputs.
+    # error_type(stage name) of a failed background stage is raised in the pipeline by the next CheckFailures() or Wait(),
+    # the reason of the failure is in the output of the stage. Resource usage of a stage is added to run_metrics when it finishes
+    def __init__(self, run_metrics, error_type = RuntimeError):
+        self.run_metrics = run_metrics
+        self.error_type = error_type
+        self.stages = list()
+
+    def Start(self, name, command, output_handler):
+        # command: list of arguments of the program, every line of its stdout and stderr is passed to output_handler
+        stage = BackgroundStage(name, command, output_handler, self.run_metrics, self.error_type)
+        self.stages.append(stage)
+        stage.thread.start()
+        return stage
+
+    def CheckFailures(self):
+        for stage in self.stages:
+            if stage.error is not None and not stage.reported:
+                stage.reported = True
+                raise stage.error
+
+    def Join(self):
+        for stage in self.stages:
+            # timeout keeps the main thread responsive to KeyboardInterrupt
+            while stage.thread.is_alive():
+                stage.thread.join(1.0)
+
+    def Wait(self):
+        self.Join()
+        self.CheckFailures()
+
+    def Unreported(self):
+        # waits for all stages and returns failed ones whose exceptions were not raised
+        self.Join()
+        return [stage for stage in self.stages if stage.error is not None and not stage.reported]
+
+class RunMetrics:
+    # resource usage of pipeline stages, written to JSON after every stage
+    def __init__(self, metrics_fname):
+        self.metrics_fname = metrics_fname
+        self.stages = list()
+        # stages may run concurrently
+        self.lock = threading.Lock()
+
+    def Add(self, stage_name, command_line, usage):
+        record = {"stage": stage_name, "command_line": command_line}
+        record.update(usage)
+        self.lock.acquire()
+        try:
+            self.stages.append(record)
+            self.Save()
+        finally:
+            self.lock.release()
+
+    def RunPythonStep(self, stage_name, function, *args):
+        # peak RSS of a python step is VmHWM of the python process reset at the start of the step
+        # (None if it cannot be reset), rusage_maxrss_kb is the peak of the process since its start
+        start_time = time.time()
+        start_rusage = resource.getrusage(resource.RUSAGE_SELF)
+        start_io = ReadProcIO(os.getpid())
+        peak_rss_reset = StartPeakRSSWindow()
+        try:
+            result = function(*args)
+            peak_rss = ReadPeakRSS(os.getpid()) if peak_rss_reset else None
+        finally:
+            FinishPeakRSSWindow()
+        end_rusage = resource.getrusage(resource.RUSAGE_SELF)
+        end_io = ReadProcIO(os.getpid())
+        usage = {"exit_code": 0,
+                 "wall_time_sec": round(time.time() - start_time, 3),
+                 "user_cpu_sec": round(end_rusage.ru_utime - start_rusage.ru_utime, 3),
+                 "sys_cpu_sec": round(end_rusage.ru_stime - start_rusage.ru_stime, 3),
+                 "peak_rss_kb": peak_rss,
+                 "rusage_maxrss_kb": ProcessPeakRSS()}
+        if start_io is not None and end_io is not None:
+            for key, name in [("rchar", "read_chars"), ("wchar", "write_chars"),
+                              ("read_bytes", "read_bytes"), ("write_bytes", "write_bytes")]:
+                usage[name] = end_io.get(key, 0) - start_io.get(key, 0)
+        else:
+            usage["read_bytes"] = (end_rusage.ru_inblock - start_rusage.ru_inblock) * 512
+            usage["write_bytes"] = (end_rusage.ru_oublock - start_rusage.ru_oublock) * 512
+        self.Add(stage_name, "", usage)
+        return result
+
+    def Save(self):
+        fhandler = open(self.metrics_fname, "w")
+        json.dump({"stages": self.stages}, fhandler, indent = 2, sort_keys = True)
+        fhandler.close()
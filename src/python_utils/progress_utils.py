@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Progress of running stages. Records appended to output files of a stage are counted incrementally
+# (only new bytes are read at every sample), progress and summary lines printed by binaries are parsed.
+# Every interval ProgressMonitor logs one line per running stage:
+#   Progress: stage=read_simulation records=1200 records_per_sec=40.0 percent=31.2 eta_sec=75 elapsed_sec=30 idle_sec=0
+# and rewrites a textfile in Prometheus exposition format, which node exporter (--collector.textfile.directory)
+# can scrape. idle_sec is time since the last new record or output line, it separates stalled stages from slow ones.
+
+import os
+import re
+import time
+import threading
+
+import compression_utils
+
+# e.g. "40% reads were processed"
+percent_pattern = re.compile(r"(\d+(?:\.\d+)?)% ")
+# e.g. "Mutated repertoire consists of 42 sequences", "72 read from 74 were successfully merged"
+summary_pattern = re.compile(r"\d+ (sequences|paired reads|reads?) ")
+
+count_block_size = 1 << 20
+
+class RecordCounter:
+    # record_format: "fasta", "fastq" or "lines"
+    # compressed files and named pipes are not parsed, only bytes of regular files are counted for them
+    def __init__(self, fname, record_format):
+        self.fname = fname
+        self.record_format = record_format
+        self.parsed = compression_utils.FileCompression(fname) == ""
+        self.Reset()
+
+    def Reset(self):
+        self.offset = 0
+        self.num_bytes = 0
+        self.num_records = 0
+        self.num_lines = 0
+        # FASTA record starts with '>' at the beginning of a line
+        self.last_byte = b"\n"
+
+    def Count(self):
+        # returns number of bytes and records written so far (records are None if they are not parsed)
+        if not os.path.isfile(self.fname):
+            return self.num_bytes, self.Records()
+        size = os.path.getsize(self.fname)
+        if size < self.offset:
+            # file was rewritten
+            self.Reset()
+        self.num_bytes = size
+        if not self.parsed or size == self.offset:
+            return self.num_bytes, self.Records()
+        fhandler = open(self.fname, "rb")
+        fhandler.seek(self.offset)
+        while self.offset < size:
+            block = fhandler.read(min(count_block_size, size - self.offset))
+            if len(block) == 0:
+                break
+            self.offset += len(block)
+            if self.record_format == "fasta":
+                self.num_records += (self.last_byte + block).count(b"\n>")
+                self.last_byte = block[-1:]
+            else:
+                self.num_lines += block.count(b"\n")
+        fhandler.close()
+        return self.num_bytes, self.Records()
+
+    def Records(self):
+        if not self.parsed:
+            return None
+        if self.record_format == "fastq":
+            return self.num_lines // 4
+        if self.record_format == "lines":
+            return self.num_lines
+        return self.num_records
+
+class StageProgress:
+    def __init__(self, stage_name, outputs, expected_records = None):
+        # outputs: list of (file name, record format)
+        self.stage_name = stage_name
+        self.counters = [RecordCounter(fname, record_format) for fname, record_format in outputs]
+        self.expected_records = expected_records
+        self.start_time = time.time()
+        self.end_time = None
+        self.last_change_time = self.start_time
+        self.num_bytes = 0
+        self.num_records = None
+        self.percent = None
+        self.summary = ""
+        self.lock = threading.Lock()
+
+    def OutputHandler(self, output_handler):
+        # wraps handler of output lines of the binary
+        def HandleLine(line):
+            self.ParseLine(line)
+            output_handler(line)
+        return HandleLine
+
+    def ParseLine(self, line):
+        self.lock.acquire()
+        try:
+            self.last_change_time = time.time()
+            match = percent_pattern.search(line)
+            if match is not None:
+                self.percent = min(float(match.group(1)), 100.0)
+            elif summary_pattern.search(line) is not None:
+                self.summary = line.strip()
+        finally:
+            self.lock.release()
+
+    def Sample(self):
+        counts = [counter.Count() for counter in self.counters]
+        self.lock.acquire()
+        try:
+            num_bytes = sum([num_bytes for num_bytes, _ in counts])
+            if num_bytes != self.num_bytes:
+                self.last_change_time = time.time()
+            self.num_bytes = num_bytes
+            if len(counts) != 0 and all([records is not None for _, records in counts]):
+                self.num_records = sum([records for _, records in counts])
+        finally:
+            self.lock.release()
+
+    def Finish(self):
+        self.Sample()
+        self.end_time = time.time()
+
+    def Running(self):
+        return self.end_time is None
+
+    def Elapsed(self):
+        if self.end_time is not None:
+            return self.end_time - self.start_time
+        return time.time() - self.start_time
+
+    def Idle(self):
+        if self.end_time is not None:
+            return 0.0
+        return time.time() - self.last_change_time
+
+    def RecordsPerSec(self):
+        if self.num_records is None:
+            return None
+        return self.num_records / max(self.Elapsed(), 1e-3)
+
+    def Eta(self):
+        # seconds to the end of the stage, None if it can not be estimated
+        if not self.Running():
+            return 0.0
+        if self.percent is not None and self.percent > 0:
+            return self.Elapsed() * (100.0 - self.percent) / self.percent
+        rate = self.RecordsPerSec()
+        if self.expected_records is None or rate is None or rate == 0:
+            return None
+        return max(self.expected_records - self.num_records, 0) / rate
+
+    def Fraction(self):
+        if not self.Running():
+            return 1.0
+        if self.percent is not None:
+            return self.percent / 100.0
+        if self.expected_records is None or self.num_records is None or self.expected_records == 0:
+            return None
+        return min(float(self.num_records) / self.expected_records, 1.0)
+
+    def LogLine(self):
+        fields = [("stage", self.stage_name), ("records", self.num_records)]
+        if len(self.counters) != 0:
+            fields.append(("bytes", self.num_bytes))
+        rate = self.RecordsPerSec()
+        fields.append(("records_per_sec", round(rate, 1) if rate is not None else None))
+        fraction = self.Fraction()
+        fields.append(("percent", round(fraction * 100, 1) if fraction is not None else None))
+        eta = self.Eta()
+        fields.append(("eta_sec", int(round(eta)) if eta is not None else None))
+        fields += [("elapsed_sec", int(round(self.Elapsed()))), ("idle_sec", int(round(self.Idle())))]
+        line = "Progress: " + " ".join([name + "=" + str(value) for name, value in fields if value is not None])
+        if self.summary != "":
+            line += " last=\"" + self.summary + "\""
+        return line
+
+def PrometheusLabel(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# name, help, function of StageProgress
+prometheus_metrics = [("ig_simulator_stage_running", "1 if the stage is running", lambda progress: 1 if progress.Running() else 0),
+                      ("ig_simulator_stage_records", "records written to outputs of the stage", lambda progress: progress.num_records),
+                      ("ig_simulator_stage_output_bytes", "bytes written to outputs of the stage",
+                       lambda progress: progress.num_bytes if len(progress.counters) != 0 else None),
+                      ("ig_simulator_stage_records_per_second", "average output records per second", lambda progress: progress.RecordsPerSec()),
+                      ("ig_simulator_stage_progress_ratio", "fraction of the stage done", lambda progress: progress.Fraction()),
+                      ("ig_simulator_stage_eta_seconds", "estimated seconds to the end of the stage", lambda progress: progress.Eta()),
+                      ("ig_simulator_stage_elapsed_seconds", "seconds since the start of the stage", lambda progress: progress.Elapsed()),
+                      ("ig_simulator_stage_idle_seconds", "seconds since the last output of the stage", lambda progress: progress.Idle())]
+
+class ProgressMonitor:
+    # samples progress of running stages every interval seconds in a background thread (interval 0 disables sampling)
+    def __init__(self, textfile, log, interval, run_label):
+        self.textfile = textfile
+        self.log = log
+        self.interval = interval
+        self.run_label = run_label
+        self.stages = list()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def Start(self, stage_name, outputs, expected_records = None):
+        progress = StageProgress(stage_name, outputs, expected_records)
+        self.lock.acquire()
+        try:
+            # only the last run of a stage is reported
+            self.stages = [stage for stage in self.stages if stage.stage_name != stage_name] + [progress]
+            if self.interval > 0 and self.thread is None:
+                self.thread = threading.Thread(target = self.Run)
+                self.thread.daemon = True
+                self.thread.start()
+        finally:
+            self.lock.release()
+        return progress
+
+    def Finish(self, progress):
+        if self.interval <= 0:
+            return
+        progress.Finish()
+        self.log.info(progress.LogLine())
+        self.WriteTextfile()
+
+    def Run(self):
+        while not self.stopped.wait(self.interval):
+            self.lock.acquire()
+            running = [stage for stage in self.stages if stage.Running()]
+            self.lock.release()
+            for progress in running:
+                progress.Sample()
+                self.log.info(progress.LogLine())
+            if len(running) != 0:
+                self.WriteTextfile()
+
+    def WriteTextfile(self):
+        if self.textfile == "":
+            return
+        self.lock.acquire()
+        try:
+            lines = list()
+            for name, description, value_function in prometheus_metrics:
+                lines += ["# HELP " + name + " " + description, "# TYPE " + name + " gauge"]
+                for progress in self.stages:
+                    value = value_function(progress)
+                    if value is not None:
+                        lines.append(name + "{run=\"" + PrometheusLabel(self.run_label) + "\",stage=\"" +
+                                     PrometheusLabel(progress.stage_name) + "\"} " + repr(round(float(value), 3)))
+            # node exporter may read the file at any moment, so it is replaced atomically
+            tmp_fname = self.textfile + ".tmp"
+            fhandler = open(tmp_fname, "w")
+            fhandler.write("\n".join(lines) + "\n")
+            fhandler.close()
+            os.rename(tmp_fname, self.textfile)
+        finally:
+            self.lock.release()
+
+    def Stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Side-car index of merged reads and the ideal repertoire (ideal_repertoire.idx): reads of an antibody
+# or a cluster are found by hash tables and read from memory-mapped merged_reads.fastq and
+# ideal_repertoire.clusters.fa without scanning them. Layout (little-endian):
+#   header:      magic "IGREADIX", uint32 format version, numbers of reads, antibodies and clusters,
+#                sizes of hash tables of reads, antibodies and clusters, uint64 offsets of sections,
+#                uint64 sizes of the indexed FASTQ and CLUSTERS.FA files
+#   reads:       (uint64 offset, uint32 length) of read name in strings and of FASTQ record, uint32 antibody id,
+#                uint32 cluster id + 1 (0 - read is not in RCM)
+#   read table:  open addressing hash table on read names, uint32 read index + 1 (0 - empty slot)
+#   antibody and cluster tables: uint64 id + 1 (0 - empty slot), (uint64 offset, uint32 length) of CLUSTERS.FA record,
+#                uint32 first posting, uint32 number of postings
+#   postings:    uint32 read indices of antibodies, then of clusters
+#   strings:     read names
+# FASTQ record of a read is empty if merged reads were not stored (--stream without --keep-reads).
+# Only uncompressed files can be indexed. Reads are indexed in order of merged_reads.fastq, reads that are only
+# in RCM follow in order of RCM.
+
+import os
+import mmap
+import zlib
+import heapq
+import shutil
+import struct
+import tempfile
+try:
+    from itertools import izip_longest as zip_longest
+except ImportError:
+    from itertools import zip_longest
+
+import files_utils
+import compression_utils
+import repertoire_utils
+
+magic = b"IGREADIX"
+format_version = 1
+header_format = "<8sIIIIIIIQQQQQQQQ"
+read_record_format = "<QIQIII"
+group_slot_format = "<QQIII"
+
+# records of external sorts kept in memory, every sorted run is an open file while runs are merged.
+# Reads are sorted as integers, records only if merged reads and RCM have different orders of reads
+sort_run_size = 1 << 17
+integer_run_size = 1 << 19
+empty_slots_block = 1 << 16
+copy_block_size = 1 << 20
+
+def Text(value):
+    if not isinstance(value, str):
+        value = value.decode("utf-8")
+    return value
+
+def Bytes(value):
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return value
+
+def StringHash(value):
+    return zlib.crc32(Bytes(value)) & 0xffffffff
+
+def IntHash(value):
+    return (value * 2654435761) & 0xffffffff
+
+def TableSize(num_keys):
+    # power of two, at most half full
+    size = 1
+    while size < 2 * num_keys:
+        size *= 2
+    return size
+
+def ScanFastqRecords(fastq_fname):
+    # yields (name, offset, length) of 4-line FASTQ records
+    fhandler = open(fastq_fname, "rb")
+    offset = 0
+    header = fhandler.readline()
+    while header.strip():
+        length = len(header)
+        for _ in range(3):
+            length += len(fhandler.readline())
+        yield Text(header[1:].strip()), offset, length
+        offset += length
+        header = fhandler.readline()
+    fhandler.close()
+
+def ScanFastaRecords(fasta_fname):
+    # yields (name, offset, length) of (possibly multi-line) FASTA records
+    fhandler = open(fasta_fname, "rb")
+    offset = 0
+    name = None
+    record_offset = 0
+    for line in fhandler:
+        if line.startswith(b">"):
+            if name is not None:
+                yield name, record_offset, offset - record_offset
+            name = Text(line[1:].strip())
+            record_offset = offset
+        offset += len(line)
+    fhandler.close()
+    if name is not None:
+        yield name, record_offset, offset - record_offset
+
+def ReadRCM(rcm_fname):
+    # yields (read name, cluster id)
+    fhandler = compression_utils.OpenFile(rcm_fname, "r")
+    for l in fhandler:
+        splits = l.strip().split()
+        if len(splits) != 0:
+            yield splits[0], int(splits[1])
+    fhandler.close()
+
+def WriteEmptySlots(fhandler, empty_slot, num_slots):
+    while num_slots > 0:
+        block = min(num_slots, empty_slots_block)
+        fhandler.write(empty_slot * block)
+        num_slots -= block
+
+def WriteHashTable(entries, size, empty_slot, table_fname):
+    # entries: (home slot, packed slot) sorted by home slot. Keys are inserted in order of their home slots,
+    # so linear probing puts every key at its home slot or right after the previous key and the table
+    # is written sequentially. Keys probing past the end wrap around to the first empty slots
+    fhandler = open(table_fname, "wb")
+    wrapped = list()
+    position = 0
+    for home, slot in entries:
+        if position < home:
+            WriteEmptySlots(fhandler, empty_slot, home - position)
+            position = home
+        if position == size:
+            wrapped.append(slot)
+            continue
+        fhandler.write(slot)
+        position += 1
+    WriteEmptySlots(fhandler, empty_slot, size - position)
+    fhandler.close()
+    if len(wrapped) == 0:
+        return
+    fhandler = open(table_fname, "r+b")
+    position = 0
+    for slot in wrapped:
+        fhandler.seek(position * len(empty_slot))
+        while fhandler.read(len(empty_slot)) != empty_slot:
+            position += 1
+        fhandler.seek(position * len(empty_slot))
+        fhandler.write(slot)
+        position += 1
+    fhandler.close()
+
+class ReadOrderMismatch(Exception):
+    pass
+
+def ReadsInSameOrder(merged_reads, rcm):
+    # ideal_repertoire_constructor writes RCM in order of merged reads, so they are joined without sorting
+    # raises ReadOrderMismatch if orders of reads are different
+    for fastq_record, rcm_record in zip_longest(ScanFastqRecords(merged_reads), ReadRCM(rcm)):
+        if fastq_record is None or rcm_record is None or fastq_record[0] != rcm_record[0]:
+            raise ReadOrderMismatch()
+        yield fastq_record[1], fastq_record[2], rcm_record[1] + 1, fastq_record[0]
+
+def JoinReadsByName(merged_reads, rcm, tmp_dir, run_size):
+    # yields (FASTQ offset, FASTQ length, cluster id + 1, name) in order of read indices: reads of merged_reads in its order,
+    # then reads that are only in RCM in order of RCM. Reads of both files are joined by name after external sort by hash of name
+    def Records():
+        for order, (name, offset, length) in enumerate(ScanFastqRecords(merged_reads)):
+            yield StringHash(name), 0, order, offset, length, name
+        for order, (name, cluster_id) in enumerate(ReadRCM(rcm)):
+            yield StringHash(name), 1, order, cluster_id + 1, 0, name
+
+    def JoinCollisions(records):
+        # records with the same name have the same hash
+        clusters = dict([(name, (order, cluster)) for _, source, order, cluster, _, name in records if source == 1])
+        for _, source, order, offset, length, name in records:
+            if source == 0:
+                yield 0, order, offset, length, clusters.pop(name, (0, 0))[1], name
+        for name in clusters:
+            yield 1, clusters[name][0], 0, 0, clusters[name][1], name
+
+    def JoinedRecords():
+        collisions = list()
+        for record in files_utils.ExternalSort(Records(), 5, tmp_dir, run_size):
+            if len(collisions) != 0 and collisions[0][0] != record[0]:
+                for joined_record in JoinCollisions(collisions):
+                    yield joined_record
+                collisions = list()
+            collisions.append(record)
+        for joined_record in JoinCollisions(collisions):
+            yield joined_record
+
+    for _, _, offset, length, cluster, name in files_utils.ExternalSort(JoinedRecords(), 5, tmp_dir, run_size):
+        yield offset, length, cluster, name
+
+def WriteReadSections(reads, reads_fname, strings_fname):
+    # returns number of reads
+    reads_fhandler = open(reads_fname, "wb")
+    strings_fhandler = open(strings_fname, "wb")
+    num_reads = 0
+    strings_size = 0
+    try:
+        for offset, length, cluster, name in reads:
+            encoded_name = Bytes(name)
+            reads_fhandler.write(struct.pack(read_record_format, strings_size, len(encoded_name), offset, length,
+                                             repertoire_utils.AntibodyIdFromReadName(name), cluster))
+            strings_fhandler.write(encoded_name)
+            strings_size += len(encoded_name)
+            num_reads += 1
+    finally:
+        reads_fhandler.close()
+        strings_fhandler.close()
+    return num_reads
+
+def IterateReadSections(reads_fname, strings_fname = None):
+    # yields (read index, antibody id, cluster id + 1, name) of written sections, names are None without strings_fname
+    reads_fhandler = open(reads_fname, "rb")
+    strings_fhandler = open(strings_fname, "rb") if strings_fname is not None else None
+    record_size = struct.calcsize(read_record_format)
+    index = 0
+    record = reads_fhandler.read(record_size)
+    while len(record) == record_size:
+        fields = struct.unpack(read_record_format, record)
+        name = Text(strings_fhandler.read(fields[1])) if strings_fhandler is not None else None
+        yield index, fields[4], fields[5], name
+        index += 1
+        record = reads_fhandler.read(record_size)
+    reads_fhandler.close()
+    if strings_fhandler is not None:
+        strings_fhandler.close()
+
+def SortedClusterRecords(clusters_fa, tmp_dir, run_size):
+    # yields (cluster id, offset, length) of CLUSTERS.FA records sorted by cluster id, the constructor writes them sorted
+    records = ((repertoire_utils.ClusterIdFromName(name), offset, length) for name, offset, length in ScanFastaRecords(clusters_fa))
+    previous_id = -1
+    for record in records:
+        if record[0] <= previous_id:
+            break
+        previous_id = record[0]
+    else:
+        for name, offset, length in ScanFastaRecords(clusters_fa):
+            yield repertoire_utils.ClusterIdFromName(name), offset, length
+        return
+    records = ((repertoire_utils.ClusterIdFromName(name), offset, length) for name, offset, length in ScanFastaRecords(clusters_fa))
+    for record in files_utils.ExternalSort(records, 3, tmp_dir, run_size):
+        yield record
+
+def WriteGroups(postings, fasta_records, postings_fhandler, groups_fname, num_postings):
+    # postings: (group id << 32) | read index sorted, fasta_records: (group id, offset, length) of CLUSTERS.FA sorted by group id.
+    # Read indices are appended to postings_fhandler, groups are written as slots of the group table to groups_fname
+    # returns numbers of groups and postings
+    group_reads = heapq.merge(((group_id, -1, offset, length) for group_id, offset, length in fasta_records),
+                              ((posting >> 32, posting & 0xffffffff, 0, 0) for posting in postings))
+    groups_fhandler = open(groups_fname, "wb")
+    num_groups = 0
+    group = None
+    for group_id, read_index, fasta_offset, fasta_length in group_reads:
+        if group is None or group[0] != group_id + 1:
+            if group is not None:
+                groups_fhandler.write(struct.pack(group_slot_format, *group))
+                num_groups += 1
+            group = [group_id + 1, 0, 0, num_postings, 0]
+        if read_index == -1:
+            # CLUSTERS.FA record goes before reads of its group
+            group[1:3] = [fasta_offset, fasta_length]
+        else:
+            postings_fhandler.write(struct.pack("<I", read_index))
+            group[4] += 1
+            num_postings += 1
+    if group is not None:
+        groups_fhandler.write(struct.pack(group_slot_format, *group))
+        num_groups += 1
+    groups_fhandler.close()
+    return num_groups, num_postings
+
+def WriteGroupTable(groups_fname, num_groups, table_fname, tmp_dir):
+    # groups are sorted by home slots as (home slot << 32) | number of the group and read from groups_fname by numbers
+    # returns size of the table
+    size = TableSize(num_groups)
+    slot_size = struct.calcsize(group_slot_format)
+    def Entries():
+        fhandler = open(groups_fname, "rb")
+        number = 0
+        slot = fhandler.read(slot_size)
+        while len(slot) == slot_size:
+            yield (IntHash(struct.unpack_from("<Q", slot)[0] - 1) & (size - 1)) << 32 | number
+            number += 1
+            slot = fhandler.read(slot_size)
+        fhandler.close()
+    def Slots(entries):
+        fhandler = open(groups_fname, "rb")
+        for entry in entries:
+            fhandler.seek((entry & 0xffffffff) * slot_size)
+            yield entry >> 32, fhandler.read(slot_size)
+        fhandler.close()
+    WriteHashTable(Slots(files_utils.ExternalSortIntegers(Entries(), tmp_dir, integer_run_size)),
+                   size, struct.pack(group_slot_format, 0, 0, 0, 0, 0), table_fname)
+    return size
+
+def BuildReadIndex(merged_reads, clusters_fa, rcm, index_fname, tmp_dir, run_size = sort_run_size):
+    # merged_reads is "" if merged reads were not stored. Sections are written sequentially to files in tmp_dir,
+    # hash tables and postings are built by external sorts, so memory does not depend on the number of reads
+    # returns numbers of reads, antibodies and clusters
+    section_fnames = [os.path.join(tmp_dir, name) for name in ["reads", "read_table", "antibody_table", "cluster_table",
+                                                               "postings", "strings"]]
+    reads_fname, read_table_fname, antibody_table_fname, cluster_table_fname, postings_fname, strings_fname = section_fnames
+    if merged_reads == "":
+        reads = ((0, 0, cluster_id + 1, name) for name, cluster_id in ReadRCM(rcm))
+    else:
+        reads = ReadsInSameOrder(merged_reads, rcm)
+    try:
+        num_reads = WriteReadSections(reads, reads_fname, strings_fname)
+    except ReadOrderMismatch:
+        num_reads = WriteReadSections(JoinReadsByName(merged_reads, rcm, tmp_dir, run_size), reads_fname, strings_fname)
+
+    read_table_size = TableSize(num_reads)
+    read_entries = ((StringHash(name) & (read_table_size - 1)) << 32 | (index + 1)
+                    for index, _, _, name in IterateReadSections(reads_fname, strings_fname))
+    WriteHashTable(((entry >> 32, struct.pack("<I", entry & 0xffffffff))
+                    for entry in files_utils.ExternalSortIntegers(read_entries, tmp_dir, integer_run_size)),
+                   read_table_size, struct.pack("<I", 0), read_table_fname)
+
+    # postings of antibodies and then of clusters, both are ordered by group id and read index
+    antibody_postings = (antibody_id << 32 | index for index, antibody_id, _, _ in IterateReadSections(reads_fname))
+    cluster_postings = ((cluster - 1) << 32 | index for index, _, cluster, _ in IterateReadSections(reads_fname) if cluster != 0)
+    antibodies_fname = os.path.join(tmp_dir, "antibodies")
+    clusters_fname = os.path.join(tmp_dir, "clusters")
+    postings_fhandler = open(postings_fname, "wb")
+    num_antibodies, num_postings = WriteGroups(files_utils.ExternalSortIntegers(antibody_postings, tmp_dir, integer_run_size),
+                                               [], postings_fhandler, antibodies_fname, 0)
+    num_clusters, num_postings = WriteGroups(files_utils.ExternalSortIntegers(cluster_postings, tmp_dir, integer_run_size),
+                                             SortedClusterRecords(clusters_fa, tmp_dir, run_size), postings_fhandler,
+                                             clusters_fname, num_postings)
+    postings_fhandler.close()
+    antibody_table_size = WriteGroupTable(antibodies_fname, num_antibodies, antibody_table_fname, tmp_dir)
+    cluster_table_size = WriteGroupTable(clusters_fname, num_clusters, cluster_table_fname, tmp_dir)
+
+    offsets = list()
+    offset = struct.calcsize(header_format)
+    for fname in section_fnames:
+        offsets.append(offset)
+        offset += os.path.getsize(fname)
+    fastq_size = os.path.getsize(merged_reads) if merged_reads != "" else 0
+    header = struct.pack(header_format, magic, format_version, num_reads, num_antibodies, num_clusters,
+                         read_table_size, antibody_table_size, cluster_table_size,
+                         *(offsets + [fastq_size, os.path.getsize(clusters_fa)]))
+    fd, tmp_fname = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(os.path.abspath(index_fname)))
+    fhandler = os.fdopen(fd, "wb")
+    fhandler.write(header)
+    for fname in section_fnames:
+        section_fhandler = open(fname, "rb")
+        shutil.copyfileobj(section_fhandler, fhandler, copy_block_size)
+        section_fhandler.close()
+        os.remove(fname)
+    fhandler.close()
+    for fname in [antibodies_fname, clusters_fname]:
+        os.remove(fname)
+    os.chmod(tmp_fname, 0o644)
+    os.rename(tmp_fname, index_fname)
+    return num_reads, num_antibodies, num_clusters
+
+def MapFile(fname):
+    fhandler = open(fname, "rb")
+    data = mmap.mmap(fhandler.fileno(), 0, access = mmap.ACCESS_READ)
+    fhandler.close()
+    return data
+
+class ReadIndex:
+    # merged_reads is "" if merged reads were not stored
+    def __init__(self, index_fname, merged_reads, clusters_fa):
+        self.data = MapFile(index_fname)
+        header = struct.unpack_from(header_format, self.data, 0)
+        if header[0] != magic or header[1] != format_version:
+            raise ValueError(index_fname + " is not an index of reads of version " + str(format_version))
+        self.num_reads, self.num_antibodies, self.num_clusters = header[2:5]
+        self.read_table_size, self.antibody_table_size, self.cluster_table_size = header[5:8]
+        (self.reads_offset, self.read_table_offset, self.antibody_table_offset, self.cluster_table_offset,
+         self.postings_offset, self.strings_offset) = header[8:14]
+        fastq_size, clusters_size = header[14:16]
+        self.fastq = None
+        if merged_reads != "" and fastq_size != 0:
+            self.fastq = self.MapIndexedFile(merged_reads, fastq_size)
+        self.clusters = self.MapIndexedFile(clusters_fa, clusters_size)
+
+    def MapIndexedFile(self, fname, size):
+        if compression_utils.FileCompression(fname) != "" or os.path.getsize(fname) != size:
+            raise ValueError(fname + " was changed after it was indexed")
+        if size == 0:
+            return b""
+        return MapFile(fname)
+
+    def ReadRecord(self, index):
+        # (name offset, name length, FASTQ offset, FASTQ length, antibody id, cluster id + 1)
+        return struct.unpack_from(read_record_format, self.data, self.reads_offset + index * struct.calcsize(read_record_format))
+
+    def ReadName(self, index):
+        record = self.ReadRecord(index)
+        return Text(self.data[self.strings_offset + record[0] : self.strings_offset + record[0] + record[1]])
+
+    def FindRead(self, name):
+        # index of the read, None if it is unknown
+        if self.num_reads == 0:
+            return None
+        slot = StringHash(name) & (self.read_table_size - 1)
+        while True:
+            index = struct.unpack_from("<I", self.data, self.read_table_offset + 4 * slot)[0]
+            if index == 0:
+                return None
+            if self.ReadName(index - 1) == name:
+                return index - 1
+            slot = (slot + 1) & (self.read_table_size - 1)
+
+    def FindGroup(self, table_offset, table_size, group_id):
+        # (CLUSTERS.FA offset, CLUSTERS.FA length, first posting, number of postings), None if the group is unknown
+        slot = IntHash(group_id) & (table_size - 1)
+        while True:
+            fields = struct.unpack_from(group_slot_format, self.data, table_offset + slot * struct.calcsize(group_slot_format))
+            if fields[0] == 0:
+                return None
+            if fields[0] == group_id + 1:
+                return fields[1:]
+            slot = (slot + 1) & (table_size - 1)
+
+    def Postings(self, group):
+        if group is None:
+            return []
+        return struct.unpack_from("<" + str(group[3]) + "I", self.data, self.postings_offset + 4 * group[2])
+
+    def FastqRecord(self, index):
+        if self.fastq is None:
+            raise ValueError("Merged reads were not stored")
+        record = self.ReadRecord(index)
+        lines = Text(self.fastq[record[2] : record[2] + record[3]]).split("\n")
+        return lines[0][1:].strip(), lines[1].strip(), lines[3].strip()
+
+    def NumReads(self):
+        return self.num_reads
+
+    def Read(self, name):
+        # (name, sequence, quality), None if the read is unknown
+        index = self.FindRead(name)
+        if index is None:
+            return None
+        return self.FastqRecord(index)
+
+    def ReadAntibody(self, name):
+        index = self.FindRead(name)
+        return self.ReadRecord(index)[4] if index is not None else None
+
+    def ReadCluster(self, name):
+        # None if the read is unknown or is not in RCM
+        index = self.FindRead(name)
+        if index is None or self.ReadRecord(index)[5] == 0:
+            return None
+        return self.ReadRecord(index)[5] - 1
+
+    def AntibodyReadNames(self, antibody_id):
+        return [self.ReadName(index) for index in
+                self.Postings(self.FindGroup(self.antibody_table_offset, self.antibody_table_size, antibody_id))]
+
+    def AntibodyReads(self, antibody_id):
+        # (name, sequence, quality) of merged reads simulated from the antibody
+        return [self.FastqRecord(index) for index in
+                self.Postings(self.FindGroup(self.antibody_table_offset, self.antibody_table_size, antibody_id))]
+
+    def ClusterReadNames(self, cluster_id):
+        return [self.ReadName(index) for index in
+                self.Postings(self.FindGroup(self.cluster_table_offset, self.cluster_table_size, cluster_id))]
+
+    def ClusterReads(self, cluster_id):
+        return [self.FastqRecord(index) for index in
+                self.Postings(self.FindGroup(self.cluster_table_offset, self.cluster_table_size, cluster_id))]
+
+    def Cluster(self, cluster_id):
+        # (name, sequence) of the cluster, None if it is unknown
+        group = self.FindGroup(self.cluster_table_offset, self.cluster_table_size, cluster_id)
+        if group is None or group[1] == 0:
+            return None
+        lines = Text(self.clusters[group[0] : group[0] + group[1]]).split("\n")
+        return lines[0][1:].strip(), "".join([line.strip() for line in lines[1:]])
+
+    def Close(self):
+        for data in [self.data, self.fastq, self.clusters]:
+            if isinstance(data, mmap.mmap):
+                data.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Statistics of a simulated repertoire in one pass over outputs of the repertoire simulator.
+# Files of base sequences and files of mutated sequences are read in lockstep by chunks of records:
+#   base_sequences.fasta, base_frequencies.txt
+#   mutated_sequences.fasta, mutated_frequencies.txt, shm_numbers.txt, cdr_positions.txt, shm_positions.txt
+# Distributions are kept in sketches (sketch_utils), SHMs relative to CDRs in shm_analytics.SHMAnalytics,
+# so memory does not depend on the size of the repertoire. Lengths in the final repertoire are weighted
+# by multiplicities of mutated sequences, distinct sequences and CDR3s are estimated by HyperLogLog.
+# The report is written as repertoire_stats.json and repertoire_stats.html.
+
+import os
+import json
+import itertools
+
+import files_utils
+import columnar_utils
+import sketch_utils
+import shm_analytics
+
+# sequences of a chunk are kept as strings, so chunks are small to keep memory within a few MB
+chunk_size = 1 << 10
+# blocks of numeric files
+block_size = 1 << 16
+
+class RepertoireStatsFiles:
+    def __init__(self, base_sequences, base_multiplicities, mutated_sequences, mutated_multiplicities,
+                 shm_positions, shm_numbers, cdr_positions):
+        self.base_sequences = base_sequences
+        self.base_multiplicities = base_multiplicities
+        self.mutated_sequences = mutated_sequences
+        self.mutated_multiplicities = mutated_multiplicities
+        self.shm_positions = shm_positions
+        self.shm_numbers = shm_numbers
+        self.cdr_positions = cdr_positions
+
+class RepertoireStats:
+    def __init__(self):
+        self.base_lengths = sketch_utils.QuantileSketch()
+        self.base_multiplicities = sketch_utils.QuantileSketch()
+        self.mutated_lengths = sketch_utils.QuantileSketch()
+        self.mutated_multiplicities = sketch_utils.QuantileSketch()
+        self.final_lengths = sketch_utils.QuantileSketch()
+        self.cdr3_lengths = sketch_utils.QuantileSketch()
+        self.shms_per_sequence = sketch_utils.QuantileSketch()
+        self.distinct_sequences = sketch_utils.DistinctCounter()
+        self.distinct_cdr3s = sketch_utils.DistinctCounter()
+        self.shm_stats = shm_analytics.SHMAnalytics()
+
+    def AddBaseSequences(self, sequences, multiplicities):
+        self.base_lengths.Add([len(seq) for seq in sequences])
+        self.base_multiplicities.Add(multiplicities)
+
+    def AddMutatedSequences(self, sequences, multiplicities, shm_numbers, cdr_positions, shm_positions):
+        lengths = [len(seq) for seq in sequences]
+        self.mutated_lengths.Add(lengths)
+        self.mutated_multiplicities.Add(multiplicities)
+        self.final_lengths.Add(lengths, multiplicities)
+        self.distinct_sequences.Add(sequences)
+        cdr3s = [seq[start:end] for seq, start, end in zip(sequences, cdr_positions[:, 4], cdr_positions[:, 5])]
+        self.cdr3_lengths.Add(cdr_positions[:, 5] - cdr_positions[:, 4])
+        self.distinct_cdr3s.Add(cdr3s)
+        self.shms_per_sequence.Add(shm_numbers)
+        self.shm_stats.Add(shm_numbers, cdr_positions, shm_positions)
+
+    def Summary(self):
+        shm_summary = self.shm_stats.Summary()
+        return {"base_sequences": {"number": self.base_lengths.count,
+                                   "lengths": self.base_lengths.Summary(),
+                                   "multiplicities": self.base_multiplicities.Summary()},
+                "mutated_sequences": {"number": self.mutated_lengths.count,
+                                      "distinct": self.distinct_sequences.Estimate(),
+                                      "lengths": self.mutated_lengths.Summary(),
+                                      "multiplicities": self.mutated_multiplicities.Summary()},
+                "final_repertoire": {"size": self.final_lengths.count,
+                                     "lengths": self.final_lengths.Summary()},
+                "cdr3": {"distinct": self.distinct_cdr3s.Estimate(),
+                         "lengths": self.cdr3_lengths.Summary()},
+                "shms": {"number": shm_summary["num_shms"],
+                         "per_sequence": self.shms_per_sequence.Summary(),
+                         "fr_cdr_shm_ratio": shm_summary["fr_cdr_shm_ratio"],
+                         "cdr_fr_density_ratio": shm_summary["cdr_fr_density_ratio"],
+                         "region_densities": dict([(name, shm_summary["regions"][name]["density"])
+                                                   for name in shm_analytics.region_names])}}
+
+def IterateSequenceChunks(fasta_fname):
+    records = files_utils.IterateFastaRecords(fasta_fname)
+    while True:
+        sequences = [seq for _, seq in itertools.islice(records, chunk_size)]
+        if len(sequences) == 0:
+            return
+        yield sequences
+
+def CheckNumRows(rows, num_rows, fname, reference_fname):
+    if len(rows) != num_rows:
+        raise ValueError("Numbers of records in " + fname + " and " + reference_fname + " are different")
+
+def CollectRepertoireStats(files):
+    stats = RepertoireStats()
+    multiplicities_reader = columnar_utils.RowReader(files.base_multiplicities, 1, block_size = block_size)
+    for sequences in IterateSequenceChunks(files.base_sequences):
+        multiplicities = multiplicities_reader.Read(len(sequences))[:, 0]
+        CheckNumRows(multiplicities, len(sequences), files.base_multiplicities, files.base_sequences)
+        stats.AddBaseSequences(sequences, multiplicities)
+    CheckNumRows(multiplicities_reader.Read(1), 0, files.base_multiplicities, files.base_sequences)
+
+    readers = [columnar_utils.RowReader(fname, num_columns, block_size = block_size) for fname, num_columns in
+               [(files.mutated_multiplicities, 1), (files.shm_numbers, 1), (files.cdr_positions, 7)]]
+    positions_reader = columnar_utils.RowReader(files.shm_positions, 2, block_size = block_size)
+    for sequences in IterateSequenceChunks(files.mutated_sequences):
+        multiplicities, shm_numbers, cdr_positions = [reader.Read(len(sequences)) for reader in readers]
+        CheckNumRows(multiplicities, len(sequences), files.mutated_multiplicities, files.mutated_sequences)
+        CheckNumRows(shm_numbers, len(sequences), files.shm_numbers, files.mutated_sequences)
+        CheckNumRows(cdr_positions, len(sequences), files.cdr_positions, files.mutated_sequences)
+        num_shms = int(shm_numbers.sum())
+        shm_positions = positions_reader.Read(num_shms)
+        CheckNumRows(shm_positions, num_shms, files.shm_positions, files.shm_numbers)
+        stats.AddMutatedSequences(sequences, multiplicities[:, 0], shm_numbers[:, 0], cdr_positions, shm_positions)
+    for reader, fname in zip(readers + [positions_reader], [files.mutated_multiplicities, files.shm_numbers,
+                                                           files.cdr_positions, files.shm_positions]):
+        CheckNumRows(reader.Read(1), 0, fname, files.mutated_sequences)
+    return stats
+
+def WriteJSONReport(stats, json_fname):
+    fhandler = open(json_fname, "w")
+    json.dump(stats.Summary(), fhandler, indent = 2, sort_keys = True)
+    fhandler.close()
+
+def FormatValue(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "%.4g" % value
+    return str(value)
+
+def HTMLTable(title, rows):
+    lines = ["<h3>" + title + "</h3>", "<table>"]
+    for name, value in rows:
+        lines.append("<tr><td>" + name + "</td><td>" + FormatValue(value) + "</td></tr>")
+    lines.append("</table>")
+    return lines
+
+def DistributionRows(name, summary):
+    return [(name + ", " + stat, summary[stat]) for stat in ["min", "p5", "p25", "median", "mean", "p75", "p95", "max"]]
+
+def WriteHTMLReport(stats, html_fname, figures):
+    # figures: (file name, description) of plots, they are referenced by names relative to the report
+    summary = stats.Summary()
+    lines = ["<html>", "<head><title>IgSimulator: statistics of simulated repertoire</title>",
+             "<style>table {border-collapse: collapse} td {border: 1px solid #ccc; padding: 2px 8px}</style></head>",
+             "<body>", "<h2>Statistics of simulated repertoire</h2>"]
+    lines += HTMLTable("Base sequences", [("number", summary["base_sequences"]["number"])] +
+                       DistributionRows("length", summary["base_sequences"]["lengths"]) +
+                       DistributionRows("multiplicity", summary["base_sequences"]["multiplicities"]))
+    lines += HTMLTable("Mutated sequences", [("number", summary["mutated_sequences"]["number"]),
+                                             ("distinct sequences (estimate)", summary["mutated_sequences"]["distinct"])] +
+                       DistributionRows("length", summary["mutated_sequences"]["lengths"]) +
+                       DistributionRows("multiplicity", summary["mutated_sequences"]["multiplicities"]))
+    lines += HTMLTable("Final repertoire", [("size", summary["final_repertoire"]["size"])] +
+                       DistributionRows("length", summary["final_repertoire"]["lengths"]))
+    lines += HTMLTable("CDR3", [("distinct CDR3s (estimate)", summary["cdr3"]["distinct"])] +
+                       DistributionRows("length", summary["cdr3"]["lengths"]))
+    lines += HTMLTable("SHMs", [("number", summary["shms"]["number"])] +
+                       DistributionRows("SHMs per sequence", summary["shms"]["per_sequence"]) +
+                       [("FR / CDR SHMs", summary["shms"]["fr_cdr_shm_ratio"]),
+                        ("CDR / FR density of SHMs", summary["shms"]["cdr_fr_density_ratio"])] +
+                       [("SHMs per nucleotide, " + name, summary["shms"]["region_densities"][name])
+                        for name in shm_analytics.region_names])
+    for fname, description in figures:
+        lines += ["<h3>" + description[0].upper() + description[1:] + "</h3>",
+                  "<img src=\"" + os.path.basename(fname) + "\">"]
+    lines += ["</body>", "</html>"]
+    fhandler = open(html_fname, "w")
+    fhandler.write("\n".join(lines) + "\n")
+    fhandler.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Final repertoire in compact format (final_repertoire_compact.fasta) stores every sequence once:
+#   >antibody_<id>_multiplicity_<M>
+# Copies are expanded only for read simulation, batch by batch, with the same names
+# as in final_repertoire.fasta:
+#   >antibody_<id>_multiplicity_<M>_copy_<i>
+# Merged reads keep the name of the copy they were simulated from:
+#   <read index>_merged_read_antibody_<id>_multiplicity_<M>_copy_<i>-<fragment>/1
+# Clusters of the ideal repertoire are named cluster___<id>___size___<size>
+
+import compression_utils
+
+def CompactRecordMultiplicity(name):
+    return int(name.split("_")[3])
+
+def AntibodyIdFromReadName(read_name):
+    return int(read_name.split("_")[4])
+
+def CopyIndexFromReadName(read_name):
+    # 1-based
+    return int(read_name.split("_")[8].split("-")[0])
+
+def ClusterIdFromName(cluster_name):
+    return int(cluster_name.split("___")[1])
+
+def ClusterSizeFromName(cluster_name):
+    return int(cluster_name.split("___")[3])
+
+def CopyName(name, copy_index):
+    # copy_index is 0-based
+    return name + "_copy_" + str(copy_index + 1)
+
+def IterateCompactRecords(compact_fasta, offset = 0):
+    # yields (offset of record in file, name, multiplicity, sequence) starting from the given offset
+    fhandler = compression_utils.OpenFile(compact_fasta, "r")
+    if offset != 0:
+        # plain files only
+        fhandler.seek(offset)
+    name = None
+    record_offset = offset
+    seq_lines = list()
+    line = fhandler.readline()
+    while line:
+        if line.startswith(">"):
+            if name is not None:
+                yield record_offset, name, CompactRecordMultiplicity(name), "".join(seq_lines)
+            name = line[1:].strip()
+            record_offset = offset
+            seq_lines = list()
+        else:
+            seq_lines.append(line.strip())
+        offset += len(line)
+        line = fhandler.readline()
+    fhandler.close()
+    if name is not None:
+        yield record_offset, name, CompactRecordMultiplicity(name), "".join(seq_lines)
+
+def CountRepertoireCopies(compact_fasta):
+    num_copies = 0
+    for _, _, multiplicity, _ in IterateCompactRecords(compact_fasta):
+        num_copies += multiplicity
+    return num_copies
+
+def PlanCopyBatches(compact_fasta, min_num_batches, max_batch_size):
+    # splits all copies of the repertoire into consecutive batches of similar number of copies
+    # (copies of a large clone may go to several batches)
+    # every batch is (offset of its first record, number of copies of this record to skip, number of copies)
+    num_copies = CountRepertoireCopies(compact_fasta)
+    if num_copies == 0:
+        return list()
+    num_batches = max(min_num_batches, (num_copies + max_batch_size - 1) // max_batch_size)
+    batch_size = (num_copies + num_batches - 1) // num_batches
+    batches = list()
+    copies_before = 0
+    for offset, _, multiplicity, _ in IterateCompactRecords(compact_fasta):
+        # batches starting inside copies of the current record
+        while len(batches) * batch_size < copies_before + multiplicity:
+            first_copy = len(batches) * batch_size
+            batches.append((offset, first_copy - copies_before, min(batch_size, num_copies - first_copy)))
+        copies_before += multiplicity
+    return batches
+
+def WriteRepertoireCopies(compact_fasta, batch, output_fname):
+    # writes copies of the batch in FASTA format, returns number of written copies
+    offset, skip_copies, num_copies = batch
+    num_written = 0
+    output_fhandler = open(output_fname, "w")
+    for _, name, multiplicity, seq in IterateCompactRecords(compact_fasta, offset):
+        last_copy = min(multiplicity, skip_copies + num_copies - num_written)
+        for i in range(skip_copies, last_copy):
+            output_fhandler.write(">" + CopyName(name, i) + "\n" + seq + "\n")
+        num_written += last_copy - skip_copies
+        skip_copies = 0
+        if num_written == num_copies:
+            break
+    output_fhandler.close()
+    return num_written
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Prediction of wall time, peak RSS and disk usage of ig_simulator.py stages without running them.
+# Every stage is modeled as linear in the number of items it processes (sequences of the final repertoire,
+# simulated read pairs or merged reads), coefficients are fitted by least squares on results of
+# src/benchmark/run_benchmark.py (benchmark_results.json). Numbers of items follow from the fan-out of the pipeline:
+#   sequences    = repertoire size (final_repertoire.fasta has a record for every copy of a mutated sequence,
+#                  the simulated repertoire is usually smaller than the expected one)
+#   read pairs   = sequences * max(1, length * coverage / (2 * read length)), ART is run with -f 1 and 250 bp reads
+#   merged reads = read pairs * fraction of merged pairs
+# Ratios of sequences to repertoire size, of read pairs to sequences and of merged reads to read pairs are
+# taken from the benchmark.
+
+import os
+import json
+
+# the order of stages in the pipeline
+stage_order = ["germline_cache", "repertoire_simulation", "repertoire_stats_visualization", "read_simulation",
+               "paired_read_merging", "ideal_repertoire_construction", "reads_vdj_recombination", "read_index",
+               "ground_truth_db"]
+# stages running concurrently in --stream mode
+streamed_stages = ["read_simulation", "paired_read_merging", "ideal_repertoire_construction"]
+# stage running in background concurrently with all stages after it
+background_stage = "repertoire_stats_visualization"
+# settings of benchmark results compared with the estimated run
+calibration_settings = ["chain_type", "technology", "compact_repertoire", "compression", "stream_reads", "skip_drawing"]
+
+art_coverage = 1
+art_read_length = 250
+# mean lengths of simulated antibody sequences and fraction of merged read pairs,
+# used if benchmark results have no counts of reads
+mean_sequence_length = {"HC": 370, "LC": 330}
+merged_fraction = 0.99
+
+class LinearModel:
+    # y = intercept + slope * x, both are non-negative; points with unknown y (None) are skipped
+    def __init__(self, points):
+        self.intercept = 0.0
+        self.slope = 0.0
+        points = [(float(x), float(y)) for x, y in points if x > 0 and y is not None]
+        self.num_points = len(points)
+        if len(points) == 0:
+            return
+        mean_x = sum([x for x, _ in points]) / len(points)
+        mean_y = sum([y for _, y in points]) / len(points)
+        var_x = sum([(x - mean_x) ** 2 for x, _ in points])
+        if var_x > 0:
+            self.slope = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / var_x
+            self.intercept = mean_y - self.slope * mean_x
+        if self.slope < 0:
+            self.slope = 0.0
+            self.intercept = mean_y
+        elif self.intercept < 0 or var_x == 0:
+            # proportional model
+            self.intercept = 0.0
+            self.slope = sum([x * y for x, y in points]) / sum([x * x for x, _ in points])
+
+    def Predict(self, x):
+        if self.num_points == 0:
+            return None
+        return self.intercept + self.slope * x
+
+class StageEstimate:
+    # peak_rss_kb is None if the benchmark has no samples of peak RSS of the stage
+    def __init__(self, stage_name, items, num_items, wall_time_sec, peak_rss_kb, output_bytes):
+        self.stage_name = stage_name
+        self.items = items
+        self.num_items = num_items
+        self.wall_time_sec = wall_time_sec
+        self.peak_rss_kb = peak_rss_kb
+        self.output_bytes = output_bytes
+
+class Calibration:
+    def __init__(self, results, fnames):
+        # results: benchmark results with the same settings
+        self.fnames = fnames
+        self.settings = dict([(name, results[0].get(name)) for name in calibration_settings])
+        self.num_threads = results[0].get("num_threads")
+        self.runs = [run for result in results for run in result["runs"]]
+
+    def Ratio(self, numerator, denominator):
+        # ratio of totals of two counts over all runs, None if runs do not have them
+        def Count(run, name):
+            if name == "repertoire_size":
+                return run["repertoire_size"]
+            return run["counts"].get(name, 0)
+        total_numerator = sum([Count(run, numerator) for run in self.runs])
+        total_denominator = sum([Count(run, denominator) for run in self.runs])
+        if total_numerator == 0 or total_denominator == 0:
+            return None
+        return float(total_numerator) / total_denominator
+
+    def Stages(self):
+        names = set([name for run in self.runs for name in run["stages"]])
+        return [name for name in stage_order if name in names] + sorted([name for name in names if name not in stage_order])
+
+    def StageModels(self, stage_name):
+        # items of the stage and models of wall time, peak RSS and output size
+        runs = [run for run in self.runs if stage_name in run["stages"]]
+        items = runs[0]["stages"][stage_name]["items"]
+        def Model(metric):
+            return LinearModel([(run["counts"][items], run["stages"][stage_name][metric]) for run in runs])
+        return items, Model("wall_time_sec"), Model("peak_rss_kb"), Model("output_bytes")
+
+    def UncalibratedStages(self, stage_names):
+        # stages with zero wall time in every run, e.g. skipped by options of the benchmark
+        return [name for name in self.Stages() if name in stage_names and
+                all([run["stages"][name]["wall_time_sec"] == 0 for run in self.runs if name in run["stages"]])]
+
+    def RepertoireSizes(self):
+        return sorted([run["repertoire_size"] for run in self.runs])
+
+def LoadBenchmarkResults(calibration_path):
+    # calibration_path is benchmark_results.json or directory of such files
+    fnames = [calibration_path]
+    if os.path.isdir(calibration_path):
+        fnames = sorted([os.path.join(calibration_path, fname) for fname in os.listdir(calibration_path) if fname.endswith(".json")])
+    results = list()
+    for fname in fnames:
+        result = json.load(open(fname, "r"))
+        # stubs do not model resources of the binaries
+        if not result.get("stub", False) and len(result.get("runs", [])) != 0:
+            results.append((fname, result))
+    return results
+
+def SelectCalibration(benchmark_results, settings):
+    # benchmark results matching the most of settings of the estimated run
+    def Score(result):
+        return len([name for name in calibration_settings if result.get(name) == settings[name]])
+    if len(benchmark_results) == 0:
+        return None
+    best_score = max([Score(result) for _, result in benchmark_results])
+    selected = [(fname, result) for fname, result in benchmark_results if Score(result) == best_score]
+    # results of different settings are not mixed
+    selected = [(fname, result) for fname, result in selected
+                if all([result.get(name) == selected[0][1].get(name) for name in calibration_settings])]
+    return Calibration([result for _, result in selected], [fname for fname, _ in selected])
+
+def ExpectedCounts(calibration, settings, repertoire_size):
+    sequences_per_size = calibration.Ratio("sequences", "repertoire_size")
+    if sequences_per_size is None:
+        sequences_per_size = 1.0
+    num_sequences = int(round(repertoire_size * sequences_per_size))
+    pairs_per_sequence = calibration.Ratio("read_pairs", "sequences")
+    if pairs_per_sequence is None:
+        pairs_per_sequence = max(1.0, mean_sequence_length[settings["chain_type"]] * art_coverage / (2.0 * art_read_length))
+    merged_per_pair = calibration.Ratio("merged_reads", "read_pairs")
+    if merged_per_pair is None:
+        merged_per_pair = merged_fraction
+    num_read_pairs = int(round(num_sequences * pairs_per_sequence))
+    return {"sequences": num_sequences,
+            "read_pairs": num_read_pairs,
+            "merged_reads": int(round(num_read_pairs * merged_per_pair))}
+
+def EstimateStages(calibration, counts, stage_names, num_threads):
+    estimates = list()
+    uncalibrated = calibration.UncalibratedStages(stage_names)
+    for stage_name in calibration.Stages():
+        if stage_name not in stage_names or stage_name in uncalibrated:
+            continue
+        items, wall_time_model, peak_rss_model, output_model = calibration.StageModels(stage_name)
+        wall_time_sec = wall_time_model.Predict(counts[items])
+        if wall_time_sec is None:
+            continue
+        # ART chunks run in parallel, other stages do not depend on the number of threads
+        if stage_name == "read_simulation" and calibration.num_threads is not None:
+            wall_time_sec *= float(calibration.num_threads) / num_threads
+        estimates.append(StageEstimate(stage_name, items, counts[items], wall_time_sec,
+                                       peak_rss_model.Predict(counts[items]), output_model.Predict(counts[items])))
+    return estimates
+
+def ForegroundWallTime(estimates, stream_reads):
+    if not stream_reads:
+        return sum([estimate.wall_time_sec for estimate in estimates])
+    streamed = [estimate.wall_time_sec for estimate in estimates if estimate.stage_name in streamed_stages]
+    return sum([estimate.wall_time_sec for estimate in estimates if estimate.stage_name not in streamed_stages]) + max(streamed + [0])
+
+def TotalWallTime(estimates, stream_reads):
+    names = [estimate.stage_name for estimate in estimates]
+    if background_stage not in names:
+        return ForegroundWallTime(estimates, stream_reads)
+    index = names.index(background_stage)
+    before = ForegroundWallTime(estimates[:index], stream_reads)
+    after = ForegroundWallTime(estimates[index + 1:], stream_reads)
+    return before + max(estimates[index].wall_time_sec, after)
+
+def DiskFootprint(estimates, stored_stages, temporary_stages):
+    # bytes of stored outputs and peak bytes, outputs of temporary_stages are written twice (chunks and the result)
+    stored = sum([estimate.output_bytes for estimate in estimates if estimate.stage_name in stored_stages])
+    temporary = sum([estimate.output_bytes for estimate in estimates if estimate.stage_name in temporary_stages])
+    return stored, stored + temporary
+
+def FormatDuration(seconds):
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Statistics of SHM positions relative to CDRs of every mutated sequence. The repertoire simulator writes
+#   shm_positions.txt   <SHM position> <sequence length> per SHM
+#   shm_numbers.txt     number of SHMs of every mutated sequence (SHMs of consecutive sequences follow each other)
+#   cdr_positions.txt   <CDR1 start> <CDR1 end> <CDR2 start> <CDR2 end> <CDR3 start> <CDR3 end> <sequence length>
+#                       per mutated sequence, as labeled by cdr_labeler.hpp (0-based, ends are exclusive)
+# SHMAnalytics is fed by chunks of sequences together with their SHMs (see repertoire_stats), so memory does not
+# depend on the number of SHMs. Region of every SHM is the number of CDR boundaries not greater than its position:
+#   0 FR1, 1 CDR1, 2 FR2, 3 CDR2, 4 FR3, 5 CDR3, 6 FR4
+# Density of a region is the number of its SHMs per nucleotide of the region summed over all sequences.
+
+import json
+import numpy
+
+import columnar_utils
+
+region_names = ["FR1", "CDR1", "FR2", "CDR2", "FR3", "CDR3", "FR4"]
+cdr_regions = [1, 3, 5]
+fr_regions = [0, 2, 4, 6]
+
+def Ratio(numerator, denominator):
+    if denominator == 0:
+        return None
+    return float(numerator) / denominator
+
+class SHMAnalytics:
+    def __init__(self, relative_bins = 100, region_bins = 20):
+        self.region_bins = region_bins
+        self.num_sequences = 0
+        self.num_shms = 0
+        self.region_shms = numpy.zeros(len(region_names), dtype = numpy.int64)
+        # nucleotides of regions summed over sequences
+        self.region_lengths = numpy.zeros(len(region_names), dtype = numpy.int64)
+        # relative CDR boundaries summed over sequences
+        self.boundary_sums = numpy.zeros(2 * len(cdr_regions), dtype = numpy.float64)
+        self.shms_per_sequence = columnar_utils.IntegerHistogram()
+        self.relative_profile = columnar_utils.FixedRangeHistogram(relative_bins, 0.0, 1.0)
+        # SHMs by relative position inside of their regions
+        self.region_profile = numpy.zeros((len(region_names), region_bins), dtype = numpy.int64)
+
+    def Add(self, shm_numbers, cdr_positions, shm_positions):
+        # shm_numbers, cdr_positions: rows of consecutive sequences, shm_positions: rows of all their SHMs
+        lengths = cdr_positions[:, 6]
+        boundaries = numpy.column_stack([numpy.zeros(len(lengths), dtype = numpy.int64), cdr_positions])
+        self.num_sequences += len(shm_numbers)
+        self.num_shms += len(shm_positions)
+        self.region_lengths += numpy.diff(boundaries, axis = 1).sum(axis = 0)
+        self.boundary_sums += (cdr_positions[:, :6] / lengths[:, numpy.newaxis].astype(numpy.float64)).sum(axis = 0)
+        self.shms_per_sequence.Add(shm_numbers)
+        if len(shm_positions) == 0:
+            return
+
+        sequence_ids = numpy.repeat(numpy.arange(len(shm_numbers)), shm_numbers)
+        if numpy.any(shm_positions[:, 1] != lengths[sequence_ids]):
+            raise ValueError("Lengths of sequences in SHM positions and CDR positions do not match")
+        positions = shm_positions[:, 0]
+        regions = numpy.zeros(len(positions), dtype = numpy.int64)
+        for column in range(6):
+            regions += positions >= cdr_positions[sequence_ids, column]
+        self.region_shms += numpy.bincount(regions, minlength = len(region_names))
+
+        starts = boundaries[sequence_ids, regions]
+        region_lengths = numpy.maximum(boundaries[sequence_ids, regions + 1] - starts, 1)
+        bins = (positions - starts) * self.region_bins // region_lengths
+        bins = numpy.minimum(bins, self.region_bins - 1)
+        self.region_profile += numpy.bincount(regions * self.region_bins + bins,
+                                              minlength = self.region_profile.size).reshape(self.region_profile.shape)
+        self.relative_profile.Add(positions.astype(numpy.float64) / shm_positions[:, 1])
+
+    def RelativeCDRPositions(self):
+        # mean relative (start, end) of CDR1, CDR2 and CDR3
+        if self.num_sequences == 0:
+            return []
+        means = self.boundary_sums / self.num_sequences
+        return [(means[2 * i], means[2 * i + 1]) for i in range(len(cdr_regions))]
+
+    def RegionSetStats(self, regions):
+        num_shms = int(self.region_shms[regions].sum())
+        length = int(self.region_lengths[regions].sum())
+        return {"shms": num_shms, "length": length, "density": Ratio(num_shms, length)}
+
+    def RegionProfile(self):
+        # SHMs per nucleotide in every bin of every region, bins of a region have equal shares of its length
+        bin_lengths = self.region_lengths.astype(numpy.float64) / self.region_bins
+        return self.region_profile / numpy.maximum(bin_lengths, 1.0)[:, numpy.newaxis]
+
+    def Summary(self):
+        regions = dict()
+        for i, name in enumerate(region_names):
+            regions[name] = self.RegionSetStats([i])
+            regions[name]["mean_length"] = Ratio(self.region_lengths[i], self.num_sequences)
+            regions[name]["shm_fraction"] = Ratio(self.region_shms[i], self.num_shms)
+        fr = self.RegionSetStats(fr_regions)
+        cdr = self.RegionSetStats(cdr_regions)
+        counts, edges = self.relative_profile.Binned()
+        shms_per_sequence = self.shms_per_sequence.counts
+        return {"num_sequences": self.num_sequences,
+                "num_shms": self.num_shms,
+                "mean_shms_per_sequence": Ratio(self.num_shms, self.num_sequences),
+                "shms_per_sequence": [int(count) for count in shms_per_sequence],
+                "regions": regions,
+                "fr": fr,
+                "cdr": cdr,
+                "fr_cdr_shm_ratio": Ratio(fr["shms"], cdr["shms"]),
+                "cdr_fr_density_ratio": Ratio(cdr["density"], fr["density"]) if fr["density"] is not None and cdr["density"] is not None else None,
+                "relative_cdr_positions": [list(cdr) for cdr in self.RelativeCDRPositions()],
+                "relative_position_profile": {"edges": [float(edge) for edge in edges],
+                                              "shms": [int(count) for count in counts]},
+                "region_profile": {"regions": region_names,
+                                   "bins_per_region": self.region_bins,
+                                   "shms": self.region_profile.tolist(),
+                                   "density": self.RegionProfile().tolist()}}
+
+def WriteSummary(analytics, json_fname):
+    fhandler = open(json_fname, "w")
+    json.dump(analytics.Summary(), fhandler, indent = 2, sort_keys = True)
+    fhandler.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Sketches of streams of values with memory that does not depend on the number of values:
+#   QuantileSketch    distribution of non-negative integers (lengths, multiplicities, numbers of SHMs):
+#                     values below exact_limit are counted exactly, larger values fall into logarithmic buckets,
+#                     so quantiles and histograms of large values have bounded relative error (as in DDSketch)
+#   DistinctCounter   HyperLogLog estimate of the number of distinct strings (sequences, CDR3s)
+# Values are added by NumPy arrays, a chunk at a time.
+
+import math
+import hashlib
+import numpy
+
+class QuantileSketch:
+    def __init__(self, exact_limit = 1024, relative_accuracy = 0.01):
+        self.exact_limit = exact_limit
+        self.exact_counts = numpy.zeros(exact_limit, dtype = numpy.int64)
+        # bucket k holds values in (gamma ^ (k - 1), gamma ^ k], k starts from the bucket of exact_limit
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.first_bucket = int(math.ceil(math.log(exact_limit) / self.log_gamma))
+        self.bucket_counts = numpy.zeros(0, dtype = numpy.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def Add(self, values, weights = None):
+        # weights are numbers of copies of values
+        values = numpy.asarray(values, dtype = numpy.int64)
+        if len(values) == 0:
+            return
+        if weights is None:
+            weights = numpy.ones(len(values), dtype = numpy.int64)
+        weights = numpy.asarray(weights, dtype = numpy.int64)
+        small = values < self.exact_limit
+        self.exact_counts += numpy.bincount(values[small], weights = weights[small],
+                                            minlength = self.exact_limit).astype(numpy.int64)
+        if not small.all():
+            large = ~small
+            buckets = numpy.ceil(numpy.log(values[large]) / self.log_gamma).astype(numpy.int64) - self.first_bucket
+            # values equal to exact_limit may get into bucket -1 because of rounding
+            buckets = numpy.maximum(buckets, 0)
+            counts = numpy.bincount(buckets, weights = weights[large]).astype(numpy.int64)
+            if len(counts) > len(self.bucket_counts):
+                self.bucket_counts = numpy.concatenate([self.bucket_counts,
+                                                        numpy.zeros(len(counts) - len(self.bucket_counts), dtype = numpy.int64)])
+            self.bucket_counts[:len(counts)] += counts
+        self.count += int(weights.sum())
+        self.total += float((values * weights).sum())
+        chunk_min = int(values.min())
+        chunk_max = int(values.max())
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+    def Values(self):
+        # distinct values (representatives of buckets for large values) and their counts, in increasing order
+        exact_values = numpy.nonzero(self.exact_counts)[0]
+        buckets = numpy.nonzero(self.bucket_counts)[0]
+        upper = numpy.power(self.gamma, buckets + self.first_bucket)
+        bucket_values = numpy.clip(2.0 * upper / (1.0 + self.gamma), self.exact_limit, self.max if self.max is not None else 0)
+        values = numpy.concatenate([exact_values.astype(numpy.float64), bucket_values])
+        counts = numpy.concatenate([self.exact_counts[exact_values], self.bucket_counts[buckets]])
+        return values, counts
+
+    def NumValues(self, min_value = 0):
+        # number of values >= min_value
+        values, counts = self.Values()
+        return int(counts[values >= min_value].sum())
+
+    def Quantile(self, q):
+        if self.count == 0:
+            return None
+        values, counts = self.Values()
+        rank = q * (self.count - 1)
+        index = numpy.searchsorted(numpy.cumsum(counts), rank, side = "right")
+        value = values[min(index, len(values) - 1)]
+        if value < self.exact_limit:
+            return int(value)
+        return float(value)
+
+    def Mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def Binned(self, bins, min_value = 0):
+        # counts and edges of equal-width bins over [min, max] of values >= min_value, see columnar_utils.IntegerHistogram
+        values, counts = self.Values()
+        selected = values >= min_value
+        if not selected.any():
+            return numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0)
+        return numpy.histogram(values[selected], bins = bins, weights = counts[selected])
+
+    def Summary(self):
+        summary = {"count": self.count, "mean": self.Mean(), "min": self.min, "max": self.max}
+        for name, q in [("p5", 0.05), ("p25", 0.25), ("median", 0.5), ("p75", 0.75), ("p95", 0.95)]:
+            summary[name] = self.Quantile(q)
+        return summary
+
+class DistinctCounter:
+    # HyperLogLog with 2 ^ precision one-byte registers, standard error is 1.04 / sqrt(2 ^ precision)
+    def __init__(self, precision = 14):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = numpy.zeros(self.num_registers, dtype = numpy.uint8)
+        self.num_items = 0
+
+    def Add(self, items):
+        # items: strings
+        if len(items) == 0:
+            return
+        self.num_items += len(items)
+        digests = b"".join([hashlib.md5(item.encode("utf-8")).digest()[:8] for item in items])
+        hashes = numpy.frombuffer(digests, dtype = numpy.dtype("<u8"))
+        rest_bits = 64 - self.precision
+        indices = (hashes >> numpy.uint64(rest_bits)).astype(numpy.int64)
+        rest = (hashes & numpy.uint64((1 << rest_bits) - 1)).astype(numpy.float64)
+        # rank is position of the leftmost 1-bit of the rest, frexp gives exact binary exponents
+        exponents = numpy.frexp(rest)[1]
+        ranks = numpy.where(rest == 0, rest_bits + 1, rest_bits - exponents + 1).astype(numpy.uint8)
+        numpy.maximum.at(self.registers, indices, ranks)
+
+    def Estimate(self):
+        m = float(self.num_registers)
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        estimate = alpha * m * m / numpy.power(2.0, -self.registers.astype(numpy.float64)).sum()
+        num_zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and num_zeros != 0:
+            # linear counting is more accurate for small numbers
+            estimate = m * math.log(m / num_zeros)
+        return min(int(round(estimate)), self.num_items)
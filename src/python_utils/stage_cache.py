@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+import os
+import json
+import hashlib
+
+def FileDigest(fname, block_size = 1 << 20):
+    sha1 = hashlib.sha1()
+    fhandler = open(fname, "rb")
+    block = fhandler.read(block_size)
+    while block:
+        sha1.update(block)
+        block = fhandler.read(block_size)
+    fhandler.close()
+    return sha1.hexdigest()
+
+def FileFingerprint(fname):
+    stat = os.stat(fname)
+    return [stat.st_size, stat.st_mtime]
+
+class StageCache:
+    # Stage key is a hash of stage parameters, contents of binaries and external inputs
+    # (e.g. germline genes) and fingerprints (size, mtime) of outputs of upstream stages.
+    # Since a recomputed stage always changes fingerprints of its outputs,
+    # all downstream stages are recomputed as well.
+    def __init__(self, cache_fname, enabled):
+        self.cache_fname = cache_fname
+        self.enabled = enabled
+        self.stages = dict()
+        if enabled and os.path.exists(cache_fname):
+            try:
+                self.stages = json.load(open(cache_fname, "r"))
+            except ValueError:
+                self.stages = dict()
+
+    def StageKey(self, stage_name, params, external_fnames, upstream_fnames):
+        key_data = {"stage": stage_name,
+                    "params": [str(param) for param in params],
+                    "external": [FileDigest(fname) for fname in external_fnames],
+                    "upstream": [FileFingerprint(fname) for fname in upstream_fnames]}
+        return hashlib.sha1(json.dumps(key_data, sort_keys = True).encode("utf-8")).hexdigest()
+
+    def OutputsIntact(self, stage_name):
+        outputs = self.stages[stage_name]["outputs"]
+        for fname in outputs:
+            if not os.path.exists(fname) or FileFingerprint(fname) != outputs[fname]:
+                return False
+        return True
+
+    def IsUpToDate(self, stage_name, stage_key):
+        if not self.enabled or stage_name not in self.stages:
+            return False
+        return self.stages[stage_name]["key"] == stage_key and self.OutputsIntact(stage_name)
+
+    def Invalidate(self, stage_name):
+        if stage_name in self.stages:
+            del self.stages[stage_name]
+            self.Save()
+
+    def Update(self, stage_name, stage_key, output_fnames):
+        outputs = dict()
+        for fname in output_fnames:
+            outputs[fname] = FileFingerprint(fname)
+        self.stages[stage_name] = {"key": stage_key, "outputs": outputs}
+        self.Save()
+
+    def Save(self):
+        tmp_fname = self.cache_fname + ".tmp"
+        fhandler = open(tmp_fname, "w")
+        json.dump(self.stages, fhandler, indent = 2, sort_keys = True)
+        fhandler.close()
+        os.rename(tmp_fname, self.cache_fname)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Named pipes connecting concurrently running stages of the pipeline:
+#   ChunkStreamer - files of consecutive chunks -> pipe, as soon as every chunk is ready
+#   FifoRelay     - pipe written by one binary -> pipe read by another one
+# Both can keep a copy of the stream in a file (compressed according to its extension).
+
+import os
+import sys
+import errno
+import threading
+
+import compression_utils
+
+class StreamThread(compression_utils.FifoThread):
+    def __init__(self, fifo_fname, copy_fname):
+        compression_utils.FifoThread.__init__(self, fifo_fname)
+        self.copy_fname = copy_fname
+        self.copy_fhandler = None
+        self.num_bytes = 0
+
+    def OpenCopy(self):
+        if self.copy_fname is not None:
+            self.copy_fhandler = compression_utils.OpenFile(self.copy_fname, "wb")
+
+    def CloseCopy(self):
+        if self.copy_fhandler is not None:
+            self.copy_fhandler.close()
+
+    def WriteBlock(self, fd, block):
+        # returns False if the reader closed the pipe
+        if self.copy_fhandler is not None:
+            self.copy_fhandler.write(block)
+        self.num_bytes += len(block)
+        try:
+            while block:
+                block = block[os.write(fd, block):]
+        except OSError:
+            _, exc, _ = sys.exc_info()
+            if exc.errno != errno.EPIPE:
+                raise
+            self.error = "pipe " + self.fifo_fname + " was closed by reader before the end of stream"
+            return False
+        return True
+
+class ChunkStreamer(StreamThread):
+    # chunk_ready[i] is threading.Event set when chunk i is finished (successfully or not),
+    # chunk_failed(i) tells whether it failed; streaming stops at the first failed chunk
+    # streamed chunk files are removed
+    def __init__(self, fifo_fname, chunk_fnames, chunk_ready, chunk_failed, copy_fname = None):
+        StreamThread.__init__(self, fifo_fname, copy_fname)
+        self.chunk_fnames = chunk_fnames
+        self.chunk_ready = chunk_ready
+        self.chunk_failed = chunk_failed
+
+    def Copy(self):
+        self.OpenCopy()
+        fifo_fd = os.open(self.fifo_fname, os.O_WRONLY)
+        reader_alive = True
+        for i in range(0, len(self.chunk_fnames)):
+            self.chunk_ready[i].wait()
+            if self.chunk_failed(i):
+                self.error = "chunk " + str(i + 1) + " was not produced"
+                break
+            chunk_fhandler = open(self.chunk_fnames[i], "rb")
+            block = chunk_fhandler.read(compression_utils.copy_block_size)
+            while block and reader_alive:
+                reader_alive = self.WriteBlock(fifo_fd, block)
+                block = chunk_fhandler.read(compression_utils.copy_block_size)
+            chunk_fhandler.close()
+            os.remove(self.chunk_fnames[i])
+            if not reader_alive:
+                break
+        os.close(fifo_fd)
+        self.CloseCopy()
+
+    def UnblockOpen(self):
+        fd = os.open(self.fifo_fname, os.O_RDONLY | os.O_NONBLOCK)
+        os.close(fd)
+
+class FifoRelay(StreamThread):
+    # binary writes to input_fifo_fname, another binary reads from output_fifo_fname
+    def __init__(self, input_fifo_fname, output_fifo_fname, copy_fname = None):
+        StreamThread.__init__(self, input_fifo_fname, copy_fname)
+        self.output_fifo_fname = output_fifo_fname
+        self.input_opened = threading.Event()
+        if os.path.exists(output_fifo_fname):
+            os.remove(output_fifo_fname)
+        os.mkfifo(output_fifo_fname)
+
+    def Copy(self):
+        self.OpenCopy()
+        input_fhandler = open(self.fifo_fname, "rb")
+        self.input_opened.set()
+        output_fd = os.open(self.output_fifo_fname, os.O_WRONLY)
+        block = input_fhandler.read(compression_utils.copy_block_size)
+        while block and self.WriteBlock(output_fd, block):
+            block = input_fhandler.read(compression_utils.copy_block_size)
+        os.close(output_fd)
+        input_fhandler.close()
+        self.CloseCopy()
+
+    def UnblockInput(self):
+        try:
+            fd = os.open(self.fifo_fname, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            # relay has not opened the input pipe yet
+            pass
+
+    def ReleaseInput(self):
+        # should be called after the writer of the input pipe exits: if it did not open the pipe,
+        # the relay gets the end of stream and passes it to the reader of the output pipe
+        while self.is_alive() and not self.input_opened.is_set():
+            self.UnblockInput()
+            self.input_opened.wait(0.05)
+
+    def UnblockOpen(self):
+        # should be called after both binaries exit
+        self.UnblockInput()
+        fd = os.open(self.output_fifo_fname, os.O_RDONLY | os.O_NONBLOCK)
+        os.close(fd)
+
+    def Finish(self):
+        error = StreamThread.Finish(self)
+        os.remove(self.output_fifo_fname)
+        return error
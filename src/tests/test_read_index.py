@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+############################################################################
+# Copyright (c) 2011-2013 Saint-Petersburg Academic University
+# All Rights Reserved
+# See file LICENSE for details.
+############################################################################
+
+# Tests of ideal_repertoire.idx: hashes are replaced by ones that send all keys to the last slots of the tables,
+# so every key collides and most of them wrap around to the beginning of the table
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_utils"))
+import read_index
+
+num_reads = 40
+num_antibodies = 7
+num_clusters = 9
+
+def ReadName(index, antibody_id):
+    return str(index) + "_merged_read_antibody_" + str(antibody_id) + "_multiplicity_2_copy_1-1/1"
+
+def ClusterName(cluster_id, size):
+    return "cluster___" + str(cluster_id) + "___size___" + str(size)
+
+class ReadIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix = "read_index_test_")
+        self.string_hash = read_index.StringHash
+        self.int_hash = read_index.IntHash
+        self.integer_run_size = read_index.integer_run_size
+        string_hash = self.string_hash
+        int_hash = self.int_hash
+        read_index.StringHash = lambda value: 0xffffffff - (string_hash(value) & 3)
+        read_index.IntHash = lambda value: 0xffffffff - (int_hash(value) & 1)
+        # several sorted runs in every external sort
+        read_index.integer_run_size = 4
+
+        generator = random.Random(17)
+        self.reads = list()
+        self.read_clusters = dict()
+        for index in range(num_reads):
+            sequence = "".join([generator.choice("ACGT") for _ in range(generator.randint(5, 30))])
+            self.reads.append((ReadName(index, generator.randint(1, num_antibodies)), sequence, "I" * len(sequence)))
+            self.read_clusters[self.reads[-1][0]] = generator.randint(1, num_clusters)
+        self.cluster_sequences = dict()
+        for cluster_id in set(self.read_clusters.values()):
+            self.cluster_sequences[cluster_id] = "".join([generator.choice("ACGT") for _ in range(generator.randint(50, 150))])
+        self.generator = generator
+
+    def tearDown(self):
+        read_index.StringHash = self.string_hash
+        read_index.IntHash = self.int_hash
+        read_index.integer_run_size = self.integer_run_size
+        shutil.rmtree(self.output_dir)
+
+    def WriteInput(self, fastq_reads, rcm_reads, cluster_ids):
+        merged_reads = os.path.join(self.output_dir, "merged_reads.fastq")
+        fhandler = open(merged_reads, "w")
+        for name, sequence, quality in fastq_reads:
+            fhandler.write("@" + name + "\n" + sequence + "\n+\n" + quality + "\n")
+        fhandler.close()
+        rcm = os.path.join(self.output_dir, "ideal_repertoire.rcm")
+        fhandler = open(rcm, "w")
+        for name, _, _ in rcm_reads:
+            fhandler.write(name + "\t" + str(self.clusters[name]) + "\n")
+        fhandler.close()
+        clusters_fa = os.path.join(self.output_dir, "ideal_repertoire.clusters.fa")
+        fhandler = open(clusters_fa, "w")
+        for cluster_id in cluster_ids:
+            sequence = self.cluster_sequences[cluster_id]
+            size = len([name for name in self.clusters if self.clusters[name] == cluster_id])
+            fhandler.write(">" + ClusterName(cluster_id, size) + "\n")
+            for start in range(0, len(sequence), 60):
+                fhandler.write(sequence[start : start + 60] + "\n")
+        fhandler.close()
+        return merged_reads, clusters_fa, rcm
+
+    def BuildAndCheck(self, fastq_reads, rcm_reads, cluster_ids):
+        self.clusters = dict([(name, self.read_clusters[name]) for name, _, _ in rcm_reads])
+        merged_reads, clusters_fa, rcm = self.WriteInput(fastq_reads, rcm_reads, cluster_ids)
+        index_fname = os.path.join(self.output_dir, "ideal_repertoire.idx")
+        tmp_dir = tempfile.mkdtemp(dir = self.output_dir)
+        counts = read_index.BuildReadIndex(merged_reads, clusters_fa, rcm, index_fname, tmp_dir, 3)
+        self.assertEqual(os.listdir(tmp_dir), [])
+        os.rmdir(tmp_dir)
+
+        # reads of merged_reads.fastq in its order, then reads that are only in RCM in order of RCM
+        indexed_reads = fastq_reads + [read for read in rcm_reads if read not in fastq_reads]
+        antibody_ids = set([read_index.repertoire_utils.AntibodyIdFromReadName(name) for name, _, _ in indexed_reads])
+        self.assertEqual(counts, (len(indexed_reads), len(antibody_ids), len(self.cluster_sequences)))
+
+        index = read_index.ReadIndex(index_fname, merged_reads, clusters_fa)
+        try:
+            self.assertEqual(index.NumReads(), len(indexed_reads))
+            # keys of the last slots wrapped around to the first ones
+            self.assertNotEqual(index.data[index.read_table_offset : index.read_table_offset + 4], b"\0" * 4)
+            for number, (name, sequence, quality) in enumerate(indexed_reads):
+                self.assertEqual(index.FindRead(name), number)
+                self.assertEqual(index.ReadName(number), name)
+                self.assertEqual(index.ReadAntibody(name), read_index.repertoire_utils.AntibodyIdFromReadName(name))
+                self.assertEqual(index.ReadCluster(name), self.clusters.get(name))
+                if number < len(fastq_reads):
+                    self.assertEqual(index.Read(name), (name, sequence, quality))
+            self.assertEqual(index.FindRead(ReadName(num_reads, 1)), None)
+            self.assertEqual(index.Read(ReadName(num_reads, 1)), None)
+
+            for antibody_id in range(num_antibodies + 2):
+                expected = [read for read in indexed_reads if read_index.repertoire_utils.AntibodyIdFromReadName(read[0]) == antibody_id]
+                self.assertEqual(index.AntibodyReadNames(antibody_id), [name for name, _, _ in expected])
+            for cluster_id in range(num_clusters + 2):
+                expected = [name for name, _, _ in indexed_reads if self.clusters.get(name) == cluster_id]
+                self.assertEqual(index.ClusterReadNames(cluster_id), expected)
+                if cluster_id in self.cluster_sequences:
+                    self.assertEqual(index.Cluster(cluster_id),
+                                     (ClusterName(cluster_id, len(expected)), self.cluster_sequences[cluster_id]))
+                else:
+                    self.assertEqual(index.Cluster(cluster_id), None)
+        finally:
+            index.Close()
+
+    def testSameOrder(self):
+        self.BuildAndCheck(self.reads, self.reads, sorted(self.cluster_sequences))
+
+    def testDifferentOrders(self):
+        # the first reads are only in RCM, the last ones are not in RCM, clusters are not sorted
+        rcm_reads = self.reads[: num_reads - 5]
+        self.generator.shuffle(rcm_reads)
+        cluster_ids = sorted(self.cluster_sequences)
+        self.generator.shuffle(cluster_ids)
+        self.BuildAndCheck(self.reads[5:], rcm_reads, cluster_ids)
+
+if __name__ == "__main__":
+    unittest.main()